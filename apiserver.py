@@ -1,23 +1,74 @@
-from fastapi import FastAPI, HTTPException, Depends, status
+from fastapi import FastAPI, HTTPException, Depends, Query, Request, Response, status
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
-from typing import Optional
-from datetime import timedelta
+from typing import List, Literal, Optional
+from datetime import datetime, timedelta
 from pydantic import BaseModel, Field
 from models import User, OperationHistory
-from database import get_db, init_db
+from database import get_db, init_db, warm_up_pool
+from stats import get_operation_stats
+from history import (
+    record_operation,
+    operation_row,
+    persist_operations,
+    history_query,
+    history_item,
+    encode_cursor,
+    decode_cursor,
+    history_writer,
+    history_versions,
+    history_response_cache,
+    etag_matches,
+    HISTORY_WRITE_BEHIND,
+    HISTORY_MAX_PAGE_SIZE,
+    HISTORY_STREAM_CHUNK_SIZE
+)
 from auth import (
-    verify_password,
-    get_password_hash,
+    verify_password_async,
+    get_password_hash_async,
     create_access_token,
+    issue_refresh_token,
+    rotate_refresh_token,
     get_current_user,
+    get_admin_user,
+    invalidate_user,
+    shutdown_hash_pool,
+    warm_up_auth,
+    hash_pool_stats,
+    user_cache,
+    token_cache,
     ACCESS_TOKEN_EXPIRE_MINUTES
 )
-from logger import logger
-import uvicorn
-from fastapi.responses import JSONResponse
+from logger import logger, log_sampler, configure_logging, get_log_pipeline
+from metrics import MetricsMiddleware, registry
+from profiling import ProfilingMiddleware, PROFILING_ENABLED
+from slow_queries import slow_query_log
+from archive import history_archive
+from load_shedding import LoadSheddingMiddleware, LOAD_SHEDDING_ENABLED
+from fastapi.responses import JSONResponse, ORJSONResponse, PlainTextResponse, StreamingResponse
+import json
 import math
+import operator
+import os
+import time
+
+try:
+    import orjson
+except ImportError:  # optional dependency; the fast JSON path is disabled without it
+    orjson = None
+
+# Maximum number of operations accepted by a single /batch request
+BATCH_MAX_OPERATIONS = int(os.getenv("BATCH_MAX_OPERATIONS", "1000"))
+
+# Warm the connection pool, bcrypt and JWT before the worker accepts requests
+STARTUP_WARMUP = os.getenv("STARTUP_WARMUP", "true").lower() in ("1", "true", "yes")
+
+# Routes that return pre-built orjson responses, skipping response_model
+# revalidation: comma-separated names (add,subtract,multiply,root,batch,history) or "*"
+FAST_JSON_ROUTES = {
+    name.strip() for name in os.getenv("FAST_JSON_ROUTES", "").split(",") if name.strip()
+}
 
 # Initialize the FastAPI app
 app = FastAPI(
@@ -25,6 +76,37 @@ app = FastAPI(
     description="A simple API for basic arithmetic operations with authentication and logging",
     version="1.0.0"
 )
+if LOAD_SHEDDING_ENABLED:
+    # Inside the metrics middleware so shed requests are counted and timed too
+    app.add_middleware(LoadSheddingMiddleware)
+app.add_middleware(MetricsMiddleware)
+if PROFILING_ENABLED:
+    app.add_middleware(ProfilingMiddleware)
+
+# Gauges refreshed from component stats on every /metrics scrape
+hash_pool_gauge = registry.gauge("password_hash_pool", "bcrypt worker pool state", ("stat",))
+history_queue_gauge = registry.gauge("history_write_queue_depth", "Operation history rows waiting to be flushed")
+history_rows_gauge = registry.gauge("history_write_rows", "Rows handled by the write-behind flusher", ("outcome",))
+cache_gauge = registry.gauge("cache_lookups", "In-process cache lookups", ("cache", "result"))
+log_dropped_gauge = registry.gauge("log_events_dropped", "Log events dropped", ("reason",))
+
+def collect_component_stats():
+    stats = hash_pool_stats()
+    for stat in ("in_flight", "queue_depth", "max_queue_depth", "completed",
+                 "wait_seconds_total", "wait_seconds_max"):
+        hash_pool_gauge.set(stats[stat], stat)
+    history_queue_gauge.set(history_writer.queue_depth())
+    history_rows_gauge.set(history_writer.flushed_rows, "flushed")
+    history_rows_gauge.set(history_writer.failed_rows, "failed")
+    for name, cache in (("user", user_cache), ("token", token_cache)):
+        cache_gauge.set(cache.hits, name, "hit")
+        cache_gauge.set(cache.misses, name, "miss")
+    log_dropped_gauge.set(log_sampler.dropped_total, "sampled")
+    log_pipeline = get_log_pipeline()
+    if log_pipeline is not None:
+        log_dropped_gauge.set(log_pipeline.dropped, "queue_full")
+
+registry.add_collector(collect_component_stats)
 
 # Pydantic models for request/response
 class UserCreate(BaseModel):
@@ -36,6 +118,12 @@ class Token(BaseModel):
     access_token: str
     token_type: str
 
+class TokenPair(Token):
+    refresh_token: str
+
+class RefreshRequest(BaseModel):
+    refresh_token: str
+
 class OperationResult(BaseModel):
     result: float | None = None
     operation: str | None = None
@@ -45,18 +133,94 @@ class OperationResult(BaseModel):
 class RootOperation(BaseModel):
     number: float = Field(..., ge=0)
 
+class BatchOperation(BaseModel):
+    operation: Literal["add", "subtract", "multiply", "root"]
+    # Reject Infinity/NaN literals before anything is written
+    num1: float = Field(..., allow_inf_nan=False)
+    num2: float = Field(0, allow_inf_nan=False)
+
+class BatchRequest(BaseModel):
+    operations: List[BatchOperation] = Field(..., min_length=1, max_length=BATCH_MAX_OPERATIONS)
+
+class BatchItemResult(BaseModel):
+    index: int
+    operation: str
+    num1: float
+    num2: float
+    result: float | None = None
+    error: str | None = None
+
+class BatchResult(BaseModel):
+    results: List[BatchItemResult]
+    succeeded: int
+    failed: int
+
+# Binary operations applied column-wise by /batch
+BINARY_OPERATIONS = {
+    "add": operator.add,
+    "subtract": operator.sub,
+    "multiply": operator.mul,
+}
+
+def fast_json(route: str) -> bool:
+    return orjson is not None and ("*" in FAST_JSON_ROUTES or route in FAST_JSON_ROUTES)
+
+def json_response(route: str, payload, headers: Optional[dict] = None):
+    """Serialize trusted output with orjson when the fast path is on for this route.
+
+    Returning a Response bypasses FastAPI's response_model validation and
+    jsonable_encoder; otherwise the payload is returned unchanged.
+    """
+    if fast_json(route):
+        return ORJSONResponse(payload, headers=headers)
+    return payload
+
+if FAST_JSON_ROUTES and orjson is None:
+    logger.warning("FAST_JSON_ROUTES is set but orjson is not installed; using the default encoder")
+
 # Startup event
 @app.on_event("startup")
 async def startup_event():
     """Initialize database and create tables"""
+    started = time.perf_counter()
+    configure_logging()
     try:
         # Initialize database
         await init_db()
-        logger.info("Application startup")
+        workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+        if history_versions.source == "process" and workers > 1:
+            logger.warning(
+                "HISTORY_VERSION_SOURCE=process only sees this worker's writes; "
+                "/history may answer 304 for changed data",
+                workers=workers
+            )
+        if HISTORY_WRITE_BEHIND:
+            await history_writer.start()
+        if STARTUP_WARMUP:
+            await warm_up_pool()
+            await warm_up_auth()
+        logger.info(
+            "Application startup",
+            startup_ms=round((time.perf_counter() - started) * 1000, 1),
+            warmed_up=STARTUP_WARMUP
+        )
     except Exception as e:
         logger.error(f"Error during startup: {str(e)}")
         raise
 
+# Shutdown event
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Flush queued history rows and release background worker pools"""
+    await history_writer.stop()
+    shutdown_hash_pool()
+    logger.info("Application shutdown")
+
+# Prometheus metrics for this worker process
+@app.get("/metrics", tags=["monitoring"], response_class=PlainTextResponse)
+async def metrics():
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
 # User registration
 @app.post("/register", response_model=Token)
 async def register(user: UserCreate, db: AsyncSession = Depends(get_db)):
@@ -73,11 +237,12 @@ async def register(user: UserCreate, db: AsyncSession = Depends(get_db)):
         db_user = User(
             username=user.username,
             email=user.email,
-            hashed_password=get_password_hash(user.password)
+            hashed_password=await get_password_hash_async(user.password)
         )
         db.add(db_user)
         await db.commit()
         await db.refresh(db_user)
+        invalidate_user(db_user.username)
 
         # Create access token
         access_token = create_access_token(
@@ -97,7 +262,7 @@ async def register(user: UserCreate, db: AsyncSession = Depends(get_db)):
         )
 
 # Login endpoint
-@app.post("/token", response_model=Token)
+@app.post("/token", response_model=TokenPair)
 async def login(
     form_data: OAuth2PasswordRequestForm = Depends(),
     db: AsyncSession = Depends(get_db)
@@ -106,7 +271,7 @@ async def login(
         result = await db.execute(select(User).where(User.username == form_data.username))
         user = result.scalar_one_or_none()
 
-        if not user or not verify_password(form_data.password, user.hashed_password):
+        if not user or not await verify_password_async(form_data.password, user.hashed_password):
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Incorrect username or password",
@@ -117,9 +282,11 @@ async def login(
             data={"sub": user.username},
             expires_delta=timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
         )
+        refresh_token = issue_refresh_token(db, user)
+        await db.commit()
 
         logger.info("User logged in", username=user.username)
-        return {"access_token": access_token, "token_type": "bearer"}
+        return {"access_token": access_token, "token_type": "bearer", "refresh_token": refresh_token}
     except HTTPException:
         raise
     except Exception as e:
@@ -129,6 +296,26 @@ async def login(
             detail="Internal server error during login"
         )
 
+# Exchange a refresh token for a new access token (and rotated refresh token) without bcrypt
+@app.post("/token/refresh", response_model=TokenPair)
+async def refresh_access_token(request: RefreshRequest, db: AsyncSession = Depends(get_db)):
+    try:
+        user, refresh_token = await rotate_refresh_token(db, request.refresh_token)
+        access_token = create_access_token(
+            data={"sub": user.username},
+            expires_delta=timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+        )
+        logger.info("Access token refreshed", username=user.username)
+        return {"access_token": access_token, "token_type": "bearer", "refresh_token": refresh_token}
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error during token refresh: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail="Internal server error during token refresh"
+        )
+
 # Root endpoint
 @app.get("/", tags=["root"])
 async def read_root(current_user: User = Depends(get_current_user)):
@@ -152,15 +339,14 @@ async def add(
     try:
         result = operation.num1 + operation.num2
         # Log operation to database
-        db_operation = OperationHistory(
+        await record_operation(
+            db,
+            user_id=current_user.id,
             operation="add",
             num1=operation.num1,
             num2=operation.num2,
-            result=result,
-            user_id=current_user.id
+            result=result
         )
-        db.add(db_operation)
-        await db.commit()
 
         logger.info(
             "Addition operation performed",
@@ -169,7 +355,9 @@ async def add(
             num2=operation.num2,
             result=result
         )
-        return {"result": result, "operation": "add", "num1": operation.num1, "num2": operation.num2}
+        return json_response("add", {"result": result, "operation": "add", "num1": operation.num1, "num2": operation.num2})
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(
             "Error in addition operation",
@@ -188,15 +376,14 @@ async def subtract(
     try:
         result = operation.num1 - operation.num2
         # Log operation to database
-        db_operation = OperationHistory(
+        await record_operation(
+            db,
+            user_id=current_user.id,
             operation="subtract",
             num1=operation.num1,
             num2=operation.num2,
-            result=result,
-            user_id=current_user.id
+            result=result
         )
-        db.add(db_operation)
-        await db.commit()
 
         logger.info(
             "Subtraction operation performed",
@@ -205,7 +392,9 @@ async def subtract(
             num2=operation.num2,
             result=result
         )
-        return {"result": result, "operation": "subtract", "num1": operation.num1, "num2": operation.num2}
+        return json_response("subtract", {"result": result, "operation": "subtract", "num1": operation.num1, "num2": operation.num2})
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(
             "Error in subtraction operation",
@@ -224,15 +413,14 @@ async def multiply(
     try:
         result = operation.num1 * operation.num2
         # Log operation to database
-        db_operation = OperationHistory(
+        await record_operation(
+            db,
+            user_id=current_user.id,
             operation="multiply",
             num1=operation.num1,
             num2=operation.num2,
-            result=result,
-            user_id=current_user.id
+            result=result
         )
-        db.add(db_operation)
-        await db.commit()
 
         logger.info(
             "Multiplication operation performed",
@@ -241,7 +429,9 @@ async def multiply(
             num2=operation.num2,
             result=result
         )
-        return {"result": result, "operation": "multiply", "num1": operation.num1, "num2": operation.num2}
+        return json_response("multiply", {"result": result, "operation": "multiply", "num1": operation.num1, "num2": operation.num2})
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(
             "Error in multiplication operation",
@@ -263,15 +453,14 @@ async def root(
 
         result = math.sqrt(operation.number)
         # Log operation to database
-        db_operation = OperationHistory(
+        await record_operation(
+            db,
+            user_id=current_user.id,
             operation="root",
             num1=operation.number,
             num2=0,  # Not used for root operation
-            result=result,
-            user_id=current_user.id
+            result=result
         )
-        db.add(db_operation)
-        await db.commit()
 
         logger.info(
             "Square root operation performed",
@@ -279,7 +468,7 @@ async def root(
             number=operation.number,
             result=result
         )
-        return {"result": result, "operation": "root", "num1": operation.number, "num2": 0}
+        return json_response("root", {"result": result, "operation": "root", "num1": operation.number, "num2": 0})
     except HTTPException:
         raise
     except Exception as e:
@@ -290,26 +479,141 @@ async def root(
         )
         raise HTTPException(status_code=500, detail=str(e))
 
+def compute_batch(operations: List[BatchOperation]) -> List[dict]:
+    """Evaluate a batch grouped by operation type, one column-wise pass per type"""
+    results: List[dict] = [None] * len(operations)
+    groups: dict = {}
+    for index, item in enumerate(operations):
+        groups.setdefault(item.operation, []).append(index)
+
+    for name, indexes in groups.items():
+        num1 = [operations[i].num1 for i in indexes]
+        if name == "root":
+            values = [math.sqrt(n) if n >= 0 else None for n in num1]
+            num2 = [0.0] * len(indexes)
+        else:
+            num2 = [operations[i].num2 for i in indexes]
+            values = list(map(BINARY_OPERATIONS[name], num1, num2))
+
+        for i, a, b, value in zip(indexes, num1, num2, values):
+            item = {"index": i, "operation": name, "num1": a, "num2": b, "result": value}
+            if value is None:
+                item["error"] = "Cannot calculate square root of negative number"
+            elif not math.isfinite(value):
+                # e.g. 1e308 * 10; neither JSON nor the history can hold it
+                item["result"] = None
+                item["error"] = "Result is out of range"
+            results[i] = item
+    return results
+
+# Batch endpoint
+@app.post("/batch", tags=["arithmetic"], response_model=BatchResult)
+async def batch(
+    request: BatchRequest,
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    try:
+        results = compute_batch(request.operations)
+        timestamp = datetime.utcnow()
+        rows = [
+            operation_row(
+                current_user.id, item["operation"], item["num1"], item["num2"],
+                item["result"], timestamp
+            )
+            for item in results if "error" not in item
+        ]
+        # One bulk insert and one commit for the whole batch
+        await persist_operations(db, rows)
+        await db.commit()
+        history_versions.bump([current_user.id])
+
+        failed = len(results) - len(rows)
+        logger.info(
+            "Batch operation performed",
+            username=current_user.username,
+            operations=len(results),
+            failed=failed
+        )
+        return json_response("batch", {"results": results, "succeeded": len(rows), "failed": failed})
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(
+            "Error in batch operation",
+            username=current_user.username,
+            error=str(e)
+        )
+        raise HTTPException(status_code=500, detail=str(e))
+
 # Get user's operation history
 @app.get("/history", tags=["user"])
 async def get_history(
+    request: Request,
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=HISTORY_MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    format: Literal["json", "ndjson"] = "json",
     current_user: User = Depends(get_current_user),
     db: AsyncSession = Depends(get_db)
 ):
     try:
+        ndjson = format == "ndjson" or "application/x-ndjson" in request.headers.get("accept", "")
+        version = await history_versions.current(db, current_user.id)
+        etag = history_versions.etag(version, current_user.id, f"{limit}|{cursor}|{ndjson}")
+        headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            # Nothing written since the client's copy: no query, no serialization
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+        if ndjson:
+            return StreamingResponse(
+                stream_history(db, current_user, cursor, limit),
+                media_type="application/x-ndjson",
+                headers=headers
+            )
+
+        cache_page = limit is not None and history_response_cache.maxsize > 0
+        cached = history_response_cache.get(etag) if cache_page else None
+        if cached is not None:
+            body, next_cursor = cached
+            if next_cursor:
+                headers["X-Next-Cursor"] = next_cursor
+            return Response(body, media_type="application/json", headers=headers)
+
+        # Fetch one extra row to know whether another page exists
         result = await db.execute(
-            select(OperationHistory)
-            .where(OperationHistory.user_id == current_user.id)
-            .order_by(OperationHistory.timestamp.desc())
+            history_query(current_user.id, cursor, limit + 1 if limit else None)
         )
-        operations = result.scalars().all()
+        operations = list(result.scalars().all())
+        if limit is None or len(operations) <= limit:
+            # Paged past the oldest row in the table: continue in the archive
+            operations += await history_archive.read(
+                current_user.id,
+                archive_boundary(operations, cursor),
+                limit + 1 - len(operations) if limit else None
+            )
+        next_cursor = None
+        if limit and len(operations) > limit:
+            operations = operations[:limit]
+            next_cursor = headers["X-Next-Cursor"] = encode_cursor(operations[-1])
 
         logger.info(
             "User history accessed",
             username=current_user.username,
             operation_count=len(operations)
         )
+        if cache_page:
+            items = [history_item(op) for op in operations]
+            body = orjson.dumps(items) if fast_json("history") else json.dumps(items).encode()
+            history_response_cache.set(etag, (body, next_cursor))
+            return Response(body, media_type="application/json", headers=headers)
+        if fast_json("history"):
+            return json_response("history", [history_item(op) for op in operations], headers)
+        response.headers.update(headers)
         return operations
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(
             "Error accessing user history",
@@ -318,6 +622,84 @@ async def get_history(
         )
         raise HTTPException(status_code=500, detail=str(e))
 
+# Get per-operation statistics from the rollup table
+@app.get("/history/stats", tags=["user"])
+async def get_history_stats(
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    try:
+        stats = await get_operation_stats(db, current_user.id)
+        logger.info(
+            "User history stats accessed",
+            username=current_user.username,
+            operation_types=len(stats)
+        )
+        return stats
+    except Exception as e:
+        logger.error(
+            "Error accessing user history stats",
+            username=current_user.username,
+            error=str(e)
+        )
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Slowest normalized SQL statements seen by this worker, with captured plans
+@app.get("/admin/slow-queries", tags=["admin"])
+async def get_slow_queries(
+    limit: int = Query(20, ge=1, le=200),
+    order_by: Literal["total_ms", "max_ms", "count"] = "total_ms",
+    current_user: User = Depends(get_admin_user)
+):
+    return {
+        "threshold_ms": slow_query_log.threshold_ms,
+        "queries": slow_query_log.top(limit, order_by)
+    }
+
+@app.delete("/admin/slow-queries", tags=["admin"], status_code=status.HTTP_204_NO_CONTENT)
+async def reset_slow_queries(current_user: User = Depends(get_admin_user)):
+    slow_query_log.clear()
+    logger.info("Slow query log cleared", username=current_user.username)
+
+def archive_boundary(operations: List[OperationHistory], cursor: Optional[str]):
+    """Key that archived rows must sort below: the oldest row returned so far, else the cursor"""
+    if operations:
+        return operations[-1].timestamp, operations[-1].id
+    return decode_cursor(cursor) if cursor else None
+
+async def stream_history(
+    db: AsyncSession,
+    current_user: User,
+    cursor: Optional[str],
+    limit: Optional[int]
+):
+    """Yield history rows as NDJSON while they are read from the database"""
+    count = 0
+    query = history_query(current_user.id, cursor, limit).execution_options(
+        yield_per=HISTORY_STREAM_CHUNK_SIZE
+    )
+    result = await db.stream(query)
+    oldest = []
+    async for partition in result.scalars().partitions():
+        yield "".join(json.dumps(history_item(op)) + "\n" for op in partition)
+        count += len(partition)
+        oldest = partition[-1:]
+    if limit is None or count < limit:
+        archived = await history_archive.read(
+            current_user.id,
+            archive_boundary(oldest, cursor),
+            limit - count if limit else None
+        )
+        for start in range(0, len(archived), HISTORY_STREAM_CHUNK_SIZE):
+            partition = archived[start:start + HISTORY_STREAM_CHUNK_SIZE]
+            yield "".join(json.dumps(history_item(op)) + "\n" for op in partition)
+        count += len(archived)
+    logger.info(
+        "User history streamed",
+        username=current_user.username,
+        operation_count=count
+    )
+
 # Error handling middleware
 @app.exception_handler(HTTPException)
 async def http_exception_handler(request, exc):
@@ -334,12 +716,7 @@ async def http_exception_handler(request, exc):
         }
     )
 
-# Run the app using Uvicorn
+# Run the app using Uvicorn (serve.py runs several workers with uvloop/httptools)
 if __name__ == "__main__":
-    uvicorn.run(
-        "apiserver:app",
-        host="0.0.0.0",
-        port=8000,
-        reload=False,  # Disable reload in production
-        log_level="info"
-    )
+    import serve
+    serve.main()
@@ -0,0 +1,267 @@
+"""Archival of old operation_history rows into compressed per-user monthly files.
+
+Rows older than ARCHIVE_AFTER_DAYS are written to
+``<ARCHIVE_DIR>/<user_id>/<YYYY-MM>.ophz`` and then deleted from the table in
+batches. Each file is columnar: ids, timestamps and the three number columns
+as packed arrays, operation names dictionary-encoded, the whole body
+zlib-compressed. A file is always written before its rows are deleted and is
+merged by id when rewritten, so an interrupted run can simply be repeated.
+
+Every run removes all rows older than its cutoff, so archived rows are always
+older than the ones left in the table; /history therefore reads the archive
+only once a request has paged past the oldest hot row.
+
+Usage:
+    python archive.py                     # archive rows older than ARCHIVE_AFTER_DAYS
+    python archive.py --older-than-days 30
+"""
+import array
+import asyncio
+import math
+import os
+import struct
+import sys
+import zlib
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional, Tuple
+from sqlalchemy import delete, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import OperationHistory
+from cache import TTLCache
+from logger import logger
+
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "archive")
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "90"))
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "5000"))
+# Decoded partitions kept in memory for /history reads
+ARCHIVE_CACHE_PARTITIONS = int(os.getenv("ARCHIVE_CACHE_PARTITIONS", "64"))
+
+PARTITION_SUFFIX = ".ophz"
+_MAGIC = b"OPHZ1"
+_HEADER = struct.Struct("<5sI")
+_EPOCH = datetime(1970, 1, 1)
+_MICROSECOND = timedelta(microseconds=1)
+_NUMBER_COLUMNS = ("num1", "num2", "result")
+
+Key = Tuple[datetime, int]
+
+def _to_le(values: array.array) -> bytes:
+    if sys.byteorder == "big":
+        values = array.array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+def _from_le(typecode: str, data: bytes) -> array.array:
+    values = array.array(typecode)
+    values.frombytes(data)
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values
+
+def encode_partition(rows: List[dict]) -> bytes:
+    """Serialize rows (sorted by timestamp, id) into the compressed columnar format"""
+    names = sorted({row["operation"] for row in rows})
+    codes = {name: index for index, name in enumerate(names)}
+    encoded_names = "\n".join(names).encode()
+
+    body = [struct.pack("<I", len(encoded_names)), encoded_names]
+    body.append(_to_le(array.array("q", (row["id"] for row in rows))))
+    body.append(_to_le(array.array("q", ((row["timestamp"] - _EPOCH) // _MICROSECOND for row in rows))))
+    body.append(bytes(codes[row["operation"]] for row in rows))
+    for column in _NUMBER_COLUMNS:
+        body.append(_to_le(array.array(
+            "d", (math.nan if row[column] is None else row[column] for row in rows)
+        )))
+    return _HEADER.pack(_MAGIC, len(rows)) + zlib.compress(b"".join(body))
+
+def decode_partition(data: bytes, user_id: int) -> List[dict]:
+    magic, count = _HEADER.unpack_from(data)
+    if magic != _MAGIC:
+        raise ValueError("Not an operation history archive")
+    body = zlib.decompress(data[_HEADER.size:])
+
+    (names_length,) = struct.unpack_from("<I", body)
+    offset = 4 + names_length
+    names = body[4:offset].decode().split("\n")
+
+    def take(typecode: str) -> array.array:
+        nonlocal offset
+        size = array.array(typecode).itemsize * count
+        values = _from_le(typecode, body[offset:offset + size])
+        offset += size
+        return values
+
+    ids = take("q")
+    timestamps = take("q")
+    codes = take("B")
+    numbers = [take("d") for _ in _NUMBER_COLUMNS]
+    return [
+        {
+            "id": ids[i],
+            "operation": names[codes[i]],
+            "num1": None if math.isnan(numbers[0][i]) else numbers[0][i],
+            "num2": None if math.isnan(numbers[1][i]) else numbers[1][i],
+            "result": None if math.isnan(numbers[2][i]) else numbers[2][i],
+            "timestamp": _EPOCH + timedelta(microseconds=timestamps[i]),
+            "user_id": user_id,
+        }
+        for i in range(count)
+    ]
+
+class HistoryArchive:
+    """Per-user, per-month archive files under ``directory``"""
+
+    def __init__(self, directory: str = ARCHIVE_DIR, cache_partitions: int = ARCHIVE_CACHE_PARTITIONS):
+        self.directory = directory
+        self._cache = TTLCache(maxsize=cache_partitions, ttl=300)
+
+    def partition_path(self, user_id: int, timestamp: datetime) -> str:
+        return os.path.join(self.directory, str(user_id), f"{timestamp:%Y-%m}{PARTITION_SUFFIX}")
+
+    def user_ids(self) -> List[int]:
+        """Users with at least one archive directory"""
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        return sorted(int(name) for name in names if name.isdigit())
+
+    def partitions(self, user_id: int) -> List[Tuple[datetime, str]]:
+        """(month start, path) of a user's archive files, newest first"""
+        user_dir = os.path.join(self.directory, str(user_id))
+        try:
+            names = os.listdir(user_dir)
+        except FileNotFoundError:
+            return []
+        return sorted(
+            (
+                (datetime.strptime(name[:-len(PARTITION_SUFFIX)], "%Y-%m"), os.path.join(user_dir, name))
+                for name in names if name.endswith(PARTITION_SUFFIX)
+            ),
+            reverse=True
+        )
+
+    def load_partition(self, path: str, user_id: int) -> List[dict]:
+        try:
+            with open(path, "rb") as f:
+                return decode_partition(f.read(), user_id)
+        except FileNotFoundError:
+            return []
+
+    def write_partition(self, path: str, user_id: int, rows: List[dict]) -> None:
+        """Merge rows into a partition file by id and replace it atomically"""
+        merged = {row["id"]: row for row in self.load_partition(path, user_id)}
+        merged.update((row["id"], row) for row in rows)
+        ordered = sorted(merged.values(), key=lambda row: (row["timestamp"], row["id"]))
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary = f"{path}.{os.getpid()}.tmp"
+        with open(temporary, "wb") as f:
+            f.write(encode_partition(ordered))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, path)
+
+    def write_rows(self, rows: List[dict]) -> int:
+        """Write rows into their partitions and return the number of files touched"""
+        partitions: Dict[str, List[dict]] = {}
+        owners: Dict[str, int] = {}
+        for row in rows:
+            path = self.partition_path(row["user_id"], row["timestamp"])
+            partitions.setdefault(path, []).append(row)
+            owners[path] = row["user_id"]
+        for path, partition_rows in partitions.items():
+            self.write_partition(path, owners[path], partition_rows)
+        return len(partitions)
+
+    async def _cached_partition(self, path: str, user_id: int) -> List[dict]:
+        try:
+            key = (path, os.stat(path).st_mtime_ns)
+        except FileNotFoundError:
+            return []
+        return await self._cache.get_or_load(
+            key,
+            lambda: asyncio.get_running_loop().run_in_executor(None, self.load_partition, path, user_id)
+        )
+
+    async def read(
+        self,
+        user_id: int,
+        before: Optional[Key] = None,
+        limit: Optional[int] = None
+    ) -> List[OperationHistory]:
+        """Archived rows newest first, strictly older than ``before`` (timestamp, id)"""
+        operations = []
+        for month_start, path in self.partitions(user_id):
+            if before is not None and month_start > before[0]:
+                continue
+            rows = await self._cached_partition(path, user_id)
+            for row in reversed(rows):
+                if before is not None and (row["timestamp"], row["id"]) >= before:
+                    continue
+                # Detached instances serialize exactly like rows loaded from the table
+                operations.append(OperationHistory(**row))
+                if limit is not None and len(operations) >= limit:
+                    return operations
+        return operations
+
+history_archive = HistoryArchive()
+
+async def archive_history(
+    session_factory: Callable[[], AsyncSession],
+    cutoff: datetime,
+    archive: HistoryArchive = history_archive,
+    batch_size: int = ARCHIVE_BATCH_SIZE
+) -> int:
+    """Move rows older than ``cutoff`` into the archive and return how many were moved.
+
+    The operation_stats rollups are left alone, so they keep counting archived
+    rows (``stats.py rebuild`` reads the archive files too).
+    """
+    loop = asyncio.get_running_loop()
+    columns = [OperationHistory.__table__.c[name] for name in (
+        "id", "operation", "num1", "num2", "result", "timestamp", "user_id"
+    )]
+    moved = 0
+    after = None
+    while True:
+        async with session_factory() as session:
+            # Walk the (user_id, timestamp, id) index once instead of rescanning per batch
+            query = (
+                select(*columns)
+                .where(OperationHistory.timestamp < cutoff)
+                .order_by(OperationHistory.user_id, OperationHistory.timestamp, OperationHistory.id)
+                .limit(batch_size)
+            )
+            if after is not None:
+                query = query.where(
+                    tuple_(OperationHistory.user_id, OperationHistory.timestamp, OperationHistory.id) > after
+                )
+            rows = [dict(row._mapping) for row in await session.execute(query)]
+            if not rows:
+                break
+
+            files = await loop.run_in_executor(None, archive.write_rows, rows)
+            await session.execute(
+                delete(OperationHistory).where(OperationHistory.id.in_([row["id"] for row in rows]))
+            )
+            await session.commit()
+
+        moved += len(rows)
+        last = rows[-1]
+        after = (last["user_id"], last["timestamp"], last["id"])
+        logger.info("Archived operation history batch", rows=len(rows), files=files, total=moved)
+    return moved
+
+if __name__ == "__main__":
+    import argparse
+    from database import new_session
+
+    parser = argparse.ArgumentParser(description="Archive old operation history")
+    parser.add_argument("--older-than-days", type=int, default=ARCHIVE_AFTER_DAYS)
+    parser.add_argument("--batch-size", type=int, default=ARCHIVE_BATCH_SIZE)
+    args = parser.parse_args()
+
+    cutoff = datetime.utcnow() - timedelta(days=args.older_than_days)
+    moved = asyncio.run(archive_history(new_session, cutoff, batch_size=args.batch_size))
+    print(f"Archived {moved} operation history rows older than {cutoff:%Y-%m-%d %H:%M}")
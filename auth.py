@@ -1,28 +1,139 @@
 from datetime import datetime, timedelta
 from typing import Optional
-from jose import JWTError, jwt
-from passlib.context import CryptContext
+from jose import JWTError
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
-from models import User
+from sqlalchemy import delete, select, update
+from models import RefreshToken, User
 from database import get_db
+from cache import TTLCache
+from logger import logger
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+import asyncio
 import os
+import time
+import uuid
 
 # Security configuration
 SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-here")  # In production, use environment variable
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "30"))
+REFRESH_TOKEN_EXPIRE_DAYS = int(os.getenv("REFRESH_TOKEN_EXPIRE_DAYS", "30"))
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Authenticated-user cache configuration (set USER_CACHE_SIZE=0 to disable)
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+USER_CACHE_TTL_SECONDS = float(os.getenv("USER_CACHE_TTL_SECONDS", "60"))
+
+# Verified-token cache configuration (set TOKEN_CACHE_SIZE=0 to disable)
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "10000"))
+TOKEN_CACHE_TTL_SECONDS = float(os.getenv("TOKEN_CACHE_TTL_SECONDS", "300"))
+
+# bcrypt worker pool configuration ("thread" or "process")
+PASSWORD_HASH_EXECUTOR = os.getenv("PASSWORD_HASH_EXECUTOR", "thread")
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+# Users allowed to call /admin endpoints (comma-separated usernames)
+ADMIN_USERNAMES = {
+    name.strip() for name in os.getenv("ADMIN_USERNAMES", "").split(",") if name.strip()
+}
+
+# passlib's CryptContext and jose.jwt (with its cryptography backend) are
+# imported on first use to keep module import cheap; startup warms both
+_pwd_context = None
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
+# Resolved users keyed by the JWT "sub" claim (the username)
+user_cache = TTLCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL_SECONDS)
+
+# Decoded claims of already-verified bearer tokens, keyed by the raw token
+token_cache = TTLCache(maxsize=TOKEN_CACHE_SIZE, ttl=TOKEN_CACHE_TTL_SECONDS)
+
+def invalidate_user(username: str) -> None:
+    """Drop a cached user, e.g. after its is_active flag or credentials change"""
+    user_cache.pop(username)
+
+def clear_user_cache() -> None:
+    user_cache.clear()
+
+def clear_token_cache() -> None:
+    token_cache.clear()
+
+def get_pwd_context():
+    global _pwd_context
+    if _pwd_context is None:
+        from passlib.context import CryptContext
+        _pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+    return _pwd_context
+
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+    return get_pwd_context().verify(plain_password, hashed_password)
 
 def get_password_hash(password: str) -> str:
-    return pwd_context.hash(password)
+    return get_pwd_context().hash(password)
+
+# Password hashing runs on a bounded pool so bcrypt never blocks the event loop
+_hash_executor: Optional[Executor] = None
+_hash_stats = {
+    "in_flight": 0,
+    "max_queue_depth": 0,
+    "completed": 0,
+    "wait_seconds_total": 0.0,
+    "wait_seconds_max": 0.0,
+}
+
+def _get_hash_executor() -> Executor:
+    global _hash_executor
+    if _hash_executor is None:
+        if PASSWORD_HASH_EXECUTOR == "process":
+            _hash_executor = ProcessPoolExecutor(max_workers=PASSWORD_HASH_WORKERS)
+        else:
+            _hash_executor = ThreadPoolExecutor(
+                max_workers=PASSWORD_HASH_WORKERS,
+                thread_name_prefix="bcrypt"
+            )
+    return _hash_executor
+
+def _timed_call(func, submitted_at: float, *args):
+    # Runs in the worker; CLOCK_MONOTONIC is shared between processes on Linux
+    return time.monotonic() - submitted_at, func(*args)
+
+async def _run_in_hash_pool(func, *args):
+    _hash_stats["in_flight"] += 1
+    queue_depth = max(0, _hash_stats["in_flight"] - PASSWORD_HASH_WORKERS)
+    _hash_stats["max_queue_depth"] = max(_hash_stats["max_queue_depth"], queue_depth)
+    try:
+        future = _get_hash_executor().submit(_timed_call, func, time.monotonic(), *args)
+        waited, result = await asyncio.wrap_future(future)
+    finally:
+        _hash_stats["in_flight"] -= 1
+    _hash_stats["completed"] += 1
+    _hash_stats["wait_seconds_total"] += waited
+    _hash_stats["wait_seconds_max"] = max(_hash_stats["wait_seconds_max"], waited)
+    return result
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    return await _run_in_hash_pool(verify_password, plain_password, hashed_password)
+
+async def get_password_hash_async(password: str) -> str:
+    return await _run_in_hash_pool(get_password_hash, password)
+
+def hash_pool_stats() -> dict:
+    """Queue depth and wait-time metrics for the password hashing pool"""
+    stats = dict(_hash_stats)
+    stats["workers"] = PASSWORD_HASH_WORKERS
+    stats["executor"] = PASSWORD_HASH_EXECUTOR
+    stats["queue_depth"] = max(0, stats["in_flight"] - PASSWORD_HASH_WORKERS)
+    stats["wait_seconds_avg"] = (
+        stats["wait_seconds_total"] / stats["completed"] if stats["completed"] else 0.0
+    )
+    return stats
+
+def shutdown_hash_pool() -> None:
+    global _hash_executor
+    if _hash_executor is not None:
+        _hash_executor.shutdown(wait=True)
+        _hash_executor = None
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     to_encode = data.copy()
@@ -31,9 +142,27 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
     else:
         expire = datetime.utcnow() + timedelta(minutes=15)
     to_encode.update({"exp": expire})
+    from jose import jwt
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
+def decode_access_token(token: str) -> dict:
+    """Verify a JWT and return its claims, reusing earlier verifications.
+
+    Entries never outlive the token's own ``exp`` claim. Raises JWTError for
+    invalid or expired tokens.
+    """
+    payload = token_cache.get(token)
+    if payload is not None:
+        return payload
+
+    from jose import jwt
+    payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    exp = payload.get("exp")
+    if exp is not None:
+        token_cache.set(token, payload, ttl=exp - time.time())
+    return payload
+
 async def get_current_user(
     token: str = Depends(oauth2_scheme),
     db: AsyncSession = Depends(get_db)
@@ -44,15 +173,138 @@ async def get_current_user(
         headers={"WWW-Authenticate": "Bearer"},
     )
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = decode_access_token(token)
         username: str = payload.get("sub")
-        if username is None:
+        # Refresh tokens share the signing key but are only accepted by /token/refresh
+        if username is None or payload.get("type") == "refresh":
             raise credentials_exception
     except JWTError:
         raise credentials_exception
 
-    result = await db.execute(select(User).where(User.username == username))
-    user = result.scalar_one_or_none()
+    async def load_user() -> Optional[User]:
+        result = await db.execute(select(User).where(User.username == username))
+        user = result.scalar_one_or_none()
+        if user is not None:
+            # Detach so the cached instance is not expired by this session's rollback
+            db.expunge(user)
+        return user
+
+    user = await user_cache.get_or_load(username, load_user)
     if user is None:
         raise credentials_exception
     return user
+
+async def get_admin_user(current_user: User = Depends(get_current_user)) -> User:
+    if current_user.username not in ADMIN_USERNAMES:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Admin privileges required"
+        )
+    return current_user
+
+def _add_refresh_token(db: AsyncSession, user: User, family_id: str) -> tuple:
+    jti = uuid.uuid4().hex
+    expires_at = datetime.utcnow() + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
+    db.add(RefreshToken(jti=jti, family_id=family_id, user_id=user.id, expires_at=expires_at))
+    from jose import jwt
+    token = jwt.encode(
+        {"sub": user.username, "jti": jti, "type": "refresh", "exp": expires_at},
+        SECRET_KEY,
+        algorithm=ALGORITHM
+    )
+    return jti, token
+
+def issue_refresh_token(db: AsyncSession, user: User) -> str:
+    """Store a refresh token starting a new family and return it signed (caller commits)"""
+    return _add_refresh_token(db, user, uuid.uuid4().hex)[1]
+
+async def rotate_refresh_token(db: AsyncSession, token: str) -> tuple:
+    """Exchange a refresh token for a new one in the same family and return (user, new token).
+
+    Presenting a token that was already rotated or revoked means it leaked (or
+    a client retried a stale one): the whole family is revoked, so neither the
+    legitimate client nor an attacker can continue it. Commits.
+    """
+    invalid = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Invalid refresh token",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+    from jose import jwt
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        raise invalid
+    if payload.get("type") != "refresh" or not payload.get("jti"):
+        raise invalid
+
+    now = datetime.utcnow()
+    stored = await db.get(RefreshToken, payload["jti"])
+    if stored is None or stored.expires_at <= now:
+        raise invalid
+
+    # Conditional update: of two concurrent refreshes with one token, only one wins
+    rotated = await db.execute(
+        update(RefreshToken)
+        .where(RefreshToken.jti == stored.jti, RefreshToken.revoked_at.is_(None))
+        .values(revoked_at=now)
+    )
+    if rotated.rowcount != 1:
+        await db.execute(
+            update(RefreshToken)
+            .where(RefreshToken.family_id == stored.family_id, RefreshToken.revoked_at.is_(None))
+            .values(revoked_at=now)
+        )
+        await db.commit()
+        logger.warning(
+            "Refresh token reuse detected, family revoked",
+            user_id=stored.user_id,
+            family_id=stored.family_id
+        )
+        raise invalid
+
+    user = await db.get(User, stored.user_id)
+    if user is None or not user.is_active:
+        await db.rollback()
+        raise invalid
+
+    stored.replaced_by, new_token = _add_refresh_token(db, user, stored.family_id)
+    await db.commit()
+    return user, new_token
+
+async def purge_refresh_tokens(db: AsyncSession, now: Optional[datetime] = None) -> int:
+    """Delete refresh tokens nobody can use any more and return how many (caller commits).
+
+    Expired tokens go, and so do families without a live token (revoked after
+    reuse, or every token rotated and expired). Rotated tokens of a live family
+    are kept until they expire, since replaying one is how reuse is detected.
+    """
+    now = now or datetime.utcnow()
+    expired = await db.execute(delete(RefreshToken).where(RefreshToken.expires_at <= now))
+    live_families = select(RefreshToken.family_id).where(RefreshToken.revoked_at.is_(None))
+    dead = await db.execute(
+        delete(RefreshToken).where(RefreshToken.family_id.not_in(live_families))
+    )
+    return expired.rowcount + dead.rowcount
+
+async def warm_up_auth() -> None:
+    """Run one bcrypt hash and one JWT round trip so the first login pays no setup cost"""
+    await get_password_hash_async("warm-up")
+    from jose import jwt
+    jwt.decode(create_access_token({"sub": "warm-up"}), SECRET_KEY, algorithms=[ALGORITHM])
+
+if __name__ == "__main__":
+    import argparse
+    from database import new_session
+
+    parser = argparse.ArgumentParser(description="Authentication maintenance")
+    parser.add_argument("command", choices=["purge-refresh-tokens"])
+    args = parser.parse_args()
+
+    async def purge():
+        async with new_session() as session:
+            purged = await purge_refresh_tokens(session)
+            await session.commit()
+        print(f"Purged {purged} refresh tokens")
+
+    asyncio.run(purge())
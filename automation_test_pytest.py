@@ -7,13 +7,42 @@ from fastapi.testclient import TestClient
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.pool import StaticPool
-from sqlalchemy import select
-from apiserver import app
-from models import Base, User, OperationHistory
-from database import get_db, init_db, drop_db
-from auth import get_password_hash
+from sqlalchemy import select, insert, func
+from apiserver import app, FAST_JSON_ROUTES
+from models import Base, User, OperationHistory, RefreshToken
+from database import get_db, init_db, drop_db, schema_lock
+import database
+from auth import (
+    get_password_hash,
+    create_access_token,
+    user_cache,
+    token_cache,
+    clear_user_cache,
+    clear_token_cache,
+    invalidate_user,
+    hash_pool_stats,
+    purge_refresh_tokens,
+    ADMIN_USERNAMES
+)
+from datetime import timedelta
+from cache import TTLCache
+from history import HistoryWriter, HistoryVersions, history_versions, history_response_cache
+from migrations import run_migrations, LATEST_VERSION, HISTORY_INDEX
+from stats import rebuild_operation_stats, get_operation_stats
+from sqlalchemy import text
 import json
-from logger import logger
+from logger import logger, SamplingProcessor, LogPipeline
+import time
+from metrics import instrument_engine, http_requests, db_queries
+from profiling import ProfilingMiddleware
+import pstats
+from slow_queries import SlowQueryLog, normalize_statement, slow_query_log
+from load_runner import parse_stats, check_slos
+from archive import HistoryArchive, archive_history, history_archive
+from load_shedding import AIMDLimiter, TokenBuckets, LoadSheddingMiddleware, requests_shed
+from datetime import datetime
+import structlog
+import structlog.testing
 
 # Add the current directory to Python path
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
@@ -31,6 +60,7 @@ test_engine = create_async_engine(
     connect_args={"check_same_thread": False},
     poolclass=StaticPool,
 )
+instrument_engine(test_engine, "test")
 
 # Create test session
 TestingSessionLocal = sessionmaker(
@@ -68,6 +98,11 @@ test_user = {
 async def setup_database():
     """Setup test database and create tables"""
     try:
+        # Cached users would point at rows from the previous test's database
+        clear_user_cache()
+        clear_token_cache()
+        history_response_cache.clear()
+
         # Create tables in test database
         async with test_engine.begin() as conn:
             await conn.run_sync(Base.metadata.drop_all)
@@ -202,6 +237,759 @@ async def test_response_time(test_user_token):
     assert response.status_code == 200
     assert end_time - start_time < 1.0  # Response should be under 1 second
 
+@pytest.mark.asyncio
+@allure.feature("Performance")
+@allure.story("User Cache")
+async def test_user_cache(test_user_token):
+    """Test that authenticated users are served from the cache until invalidated"""
+    headers = {"Authorization": f"Bearer {test_user_token}"}
+
+    client.get("/", headers=headers)
+    assert user_cache.get(test_user["username"]) is not None
+    hits = user_cache.hits
+
+    response = client.post("/add", json={"num1": 1, "num2": 1}, headers=headers)
+    assert response.status_code == 200
+    assert user_cache.hits > hits
+
+    invalidate_user(test_user["username"])
+    assert user_cache.get(test_user["username"]) is None
+
+    response = client.get("/history", headers=headers)
+    assert response.status_code == 200
+    assert len(response.json()) == 1
+
+@pytest.mark.asyncio
+@allure.feature("Performance")
+@allure.story("Cache Load Coalescing")
+async def test_cache_load_survives_cancelled_leader():
+    """Test that concurrent misses share one load and a cancelled loader does not fail the waiters"""
+    cache = TTLCache(maxsize=8, ttl=60)
+    calls = []
+    started = asyncio.Event()
+
+    async def loader():
+        calls.append(1)
+        started.set()
+        await asyncio.sleep(0.05)
+        return len(calls)
+
+    leader = asyncio.create_task(cache.get_or_load("key", loader))
+    await started.wait()
+    waiters = [asyncio.create_task(cache.get_or_load("key", loader)) for _ in range(3)]
+    await asyncio.sleep(0)
+    leader.cancel()
+
+    # One waiter takes over the load, the others share it
+    assert await asyncio.gather(*waiters) == [2, 2, 2]
+    assert leader.cancelled()
+    assert len(calls) == 2
+    assert cache.get("key") == 2
+
+@pytest.mark.asyncio
+@allure.feature("Performance")
+@allure.story("Token Cache")
+async def test_token_cache(test_user_token):
+    """Test that verified tokens are cached and expired tokens are rejected"""
+    headers = {"Authorization": f"Bearer {test_user_token}"}
+    response = client.get("/", headers=headers)
+    assert response.status_code == 200
+    assert token_cache.get(test_user_token)["sub"] == test_user["username"]
+
+    expired = create_access_token(
+        data={"sub": test_user["username"]},
+        expires_delta=timedelta(seconds=-1)
+    )
+    response = client.get("/", headers={"Authorization": f"Bearer {expired}"})
+    assert response.status_code == 401
+    assert token_cache.get(expired) is None
+
+@pytest.mark.asyncio
+@allure.feature("Performance")
+@allure.story("Password Hash Pool")
+async def test_password_hash_pool(test_user_token):
+    """Test that login runs bcrypt on the worker pool and records metrics"""
+    completed = hash_pool_stats()["completed"]
+    response = client.post(
+        "/token",
+        data={"username": test_user["username"], "password": test_user["password"]}
+    )
+    assert response.status_code == 200
+
+    stats = hash_pool_stats()
+    assert stats["completed"] == completed + 1
+    assert stats["in_flight"] == 0
+    assert stats["wait_seconds_max"] >= 0
+
+@pytest.mark.asyncio
+@allure.feature("Database Operations")
+@allure.story("Write-Behind History")
+async def test_history_write_behind():
+    """Test that queued history rows are bulk-inserted and flushed on stop"""
+    writer = HistoryWriter(TestingSessionLocal, batch_size=10, flush_interval=0.01)
+    await writer.start()
+    for i in range(25):
+        await writer.submit({
+            "operation": "add", "num1": i, "num2": 1, "result": i + 1, "user_id": 1
+        })
+    await writer.stop()
+
+    assert writer.flushed_rows == 25
+    async with TestingSessionLocal() as session:
+        result = await session.execute(select(OperationHistory))
+        assert len(result.scalars().all()) == 25
+
+    # A failed flush is retried instead of dropping rows that were already acknowledged
+    attempts = []
+
+    def flaky_session():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise RuntimeError("database is locked")
+        return TestingSessionLocal()
+
+    writer = HistoryWriter(flaky_session, batch_size=10, flush_interval=0.01, retry_delay=0.01)
+    await writer.start()
+    for i in range(5):
+        await writer.submit({
+            "operation": "add", "num1": i, "num2": 2, "result": i + 2, "user_id": 1
+        })
+    await writer.stop()
+
+    assert (writer.flushed_rows, writer.failed_rows, writer.retried_flushes) == (5, 0, 1)
+    async with TestingSessionLocal() as session:
+        result = await session.execute(select(OperationHistory))
+        assert len(result.scalars().all()) == 30
+
+@pytest.mark.asyncio
+@allure.feature("Arithmetic Operations")
+@allure.story("Batch Operations")
+async def test_batch_operations(test_user_token):
+    """Test mixed batch operations with a per-item error"""
+    headers = {"Authorization": f"Bearer {test_user_token}"}
+    response = client.post("/batch", json={"operations": [
+        {"operation": "add", "num1": 2, "num2": 3},
+        {"operation": "root", "num1": -4},
+        {"operation": "multiply", "num1": 6, "num2": 7},
+        {"operation": "subtract", "num1": 5, "num2": 3},
+        {"operation": "root", "num1": 16}
+    ]}, headers=headers)
+    assert response.status_code == 200
+    body = response.json()
+    assert body["succeeded"] == 4
+    assert body["failed"] == 1
+    assert [item["result"] for item in body["results"]] == [5, None, 42, 2, 4]
+    assert body["results"][1]["error"]
+
+    response = client.get("/history", headers=headers)
+    assert len(response.json()) == 4
+
+    # An overflowing item fails on its own and is not recorded
+    response = client.post("/batch", json={"operations": [
+        {"operation": "multiply", "num1": 1e308, "num2": 10},
+        {"operation": "add", "num1": 1e308, "num2": 1e308},
+        {"operation": "add", "num1": 1, "num2": 1}
+    ]}, headers=headers)
+    assert response.status_code == 200
+    body = response.json()
+    assert (body["succeeded"], body["failed"]) == (1, 2)
+    assert [item["result"] for item in body["results"]] == [None, None, 2]
+    assert body["results"][0]["error"] == "Result is out of range"
+    assert len(client.get("/history", headers=headers).json()) == 5
+
+    response = client.post("/batch", json={"operations": [
+        {"operation": "divide", "num1": 1, "num2": 2}
+    ]}, headers=headers)
+    assert response.status_code == 422
+
+@pytest.mark.asyncio
+@allure.feature("Database Operations")
+@allure.story("History Pagination")
+async def test_history_pagination(test_user_token):
+    """Test keyset pagination and NDJSON streaming of history"""
+    headers = {"Authorization": f"Bearer {test_user_token}"}
+    client.post("/batch", json={"operations": [
+        {"operation": "add", "num1": i, "num2": 1} for i in range(5)
+    ]}, headers=headers)
+
+    response = client.get("/history?limit=2", headers=headers)
+    assert response.status_code == 200
+    first_page = response.json()
+    assert len(first_page) == 2
+    cursor = response.headers["X-Next-Cursor"]
+
+    pages = [first_page]
+    while cursor:
+        response = client.get(f"/history?limit=2&cursor={cursor}", headers=headers)
+        pages.append(response.json())
+        cursor = response.headers.get("X-Next-Cursor")
+    ids = [item["id"] for page in pages for item in page]
+    assert ids == [5, 4, 3, 2, 1]
+
+    response = client.get("/history?format=ndjson", headers=headers)
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [item["id"] for item in lines] == ids
+
+    response = client.get("/history?cursor=not-a-cursor", headers=headers)
+    assert response.status_code == 400
+
+@pytest.mark.asyncio
+@allure.feature("Database Operations")
+@allure.story("Schema Migrations")
+async def test_schema_migrations():
+    """Test that migrations add the history index to an existing database"""
+    async with test_engine.begin() as conn:
+        await conn.execute(text(f"DROP INDEX {HISTORY_INDEX}"))
+
+    assert await run_migrations(test_engine) == LATEST_VERSION
+    # Running again is a no-op
+    assert await run_migrations(test_engine) == LATEST_VERSION
+
+    async with test_engine.connect() as conn:
+        result = await conn.execute(
+            text("SELECT name FROM sqlite_master WHERE type = 'index' AND name = :name"),
+            {"name": HISTORY_INDEX}
+        )
+        assert result.scalar() == HISTORY_INDEX
+
+@pytest.mark.asyncio
+@allure.feature("Database Operations")
+@allure.story("Operation Statistics")
+async def test_history_stats(test_user_token):
+    """Test that rollups track inserts and match a rebuild from raw history"""
+    headers = {"Authorization": f"Bearer {test_user_token}"}
+    client.post("/add", json={"num1": 2, "num2": 3}, headers=headers)
+    client.post("/add", json={"num1": -1, "num2": -1}, headers=headers)
+    client.post("/batch", json={"operations": [
+        {"operation": "add", "num1": 10, "num2": 0},
+        {"operation": "root", "num1": 9}
+    ]}, headers=headers)
+
+    response = client.get("/history/stats", headers=headers)
+    assert response.status_code == 200
+    stats = {item["operation"]: item for item in response.json()}
+    assert stats["add"]["count"] == 3
+    assert stats["add"]["sum"] == 13
+    assert stats["add"]["min"] == -2
+    assert stats["add"]["max"] == 10
+    assert stats["root"]["count"] == 1
+
+    async with TestingSessionLocal() as session:
+        await rebuild_operation_stats(session)
+        await session.commit()
+        rebuilt = await get_operation_stats(session, 1)
+    assert [item["count"] for item in rebuilt] == [3, 1]
+    assert rebuilt[0]["sum"] == 13
+
+@allure.feature("Logging")
+@allure.story("Log Sampling")
+def test_log_sampling():
+    """Test 1-in-N sampling, per-user rate limits and that warnings are never dropped"""
+    def kept(sampler, method_name, event_dict, times):
+        count = 0
+        for _ in range(times):
+            try:
+                sampler(None, method_name, dict(event_dict))
+                count += 1
+            except structlog.DropEvent:
+                pass
+        return count
+
+    sampler = SamplingProcessor(sample_rates={"Addition operation performed": 3})
+    assert kept(sampler, "info", {"event": "Addition operation performed"}, 9) == 3
+    assert kept(sampler, "info", {"event": "User logged in"}, 4) == 4
+    assert kept(sampler, "warning", {"event": "Addition operation performed"}, 5) == 5
+    assert sampler.dropped_total == 6
+
+    sampler = SamplingProcessor(user_rate=0.001, user_burst=2)
+    assert kept(sampler, "info", {"event": "Root endpoint accessed", "username": "a"}, 5) == 2
+    assert kept(sampler, "info", {"event": "Root endpoint accessed", "username": "b"}, 1) == 1
+    assert kept(sampler, "error", {"event": "Error accessing root endpoint", "username": "a"}, 3) == 3
+
+    # The drop summary is emitted by the writer thread even when no further events arrive
+    sampler = SamplingProcessor(sample_rates={"Root endpoint accessed": 2}, report_interval=0)
+    assert kept(sampler, "info", {"event": "Root endpoint accessed"}, 4) == 2
+    with structlog.testing.capture_logs() as logs:
+        pipeline = LogPipeline(periodic=[sampler.report], tick_interval=0.01)
+        deadline = time.monotonic() + 2
+        while not logs and time.monotonic() < deadline:
+            time.sleep(0.01)
+        pipeline.stop()
+    assert logs[0]["event"] == "Log events dropped by sampling"
+    assert logs[0]["dropped"] == {"Root endpoint accessed": 2}
+    assert sampler.stats()["dropped_pending"] == {}
+
+@pytest.mark.asyncio
+@allure.feature("Performance")
+@allure.story("Fast JSON Responses")
+async def test_fast_json_responses(test_user_token):
+    """Test that the orjson fast path returns the same payloads"""
+    headers = {"Authorization": f"Bearer {test_user_token}"}
+    default = client.post("/add", json={"num1": 2, "num2": 3}, headers=headers).json()
+    default_history = client.get("/history?limit=1", headers=headers)
+
+    FAST_JSON_ROUTES.add("*")
+    try:
+        fast = client.post("/add", json={"num1": 2, "num2": 3}, headers=headers)
+        fast_history = client.get("/history?limit=1", headers=headers)
+    finally:
+        FAST_JSON_ROUTES.discard("*")
+
+    assert fast.status_code == 200
+    assert fast.json() == default
+    assert fast_history.json()[0]["operation"] == default_history.json()[0]["operation"]
+    assert fast_history.headers["X-Next-Cursor"]
+
+@pytest.mark.asyncio
+@allure.feature("Monitoring")
+@allure.story("Prometheus Metrics")
+async def test_metrics_endpoint(test_user_token):
+    """Test that /metrics exposes request, database and component metrics"""
+    headers = {"Authorization": f"Bearer {test_user_token}"}
+    before = http_requests.value("/add", "POST", "200")
+    client.post("/add", json={"num1": 1, "num2": 2}, headers=headers)
+    client.post("/root", json={"number": -4}, headers=headers)
+    assert http_requests.value("/add", "POST", "200") == before + 1
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    body = response.text
+    assert 'http_requests_total{route="/root",method="POST",status="422"}' in body
+    assert 'http_request_duration_seconds_bucket{route="/add",method="POST",le="+Inf"}' in body
+    assert 'db_queries_total{engine="test"}' in body
+    assert 'password_hash_pool{stat="completed"}' in body
+    assert 'cache_lookups{cache="token",result="hit"}' in body
+
+@pytest.mark.asyncio
+@allure.feature("Performance")
+@allure.story("Request Profiling")
+async def test_request_profiling(test_user_token, tmp_path):
+    """Test that only sampled or flagged requests are profiled"""
+    headers = {"Authorization": f"Bearer {test_user_token}"}
+    profiled = TestClient(ProfilingMiddleware(app, sample_rate=0, output_dir=str(tmp_path)))
+
+    profiled.post("/add", json={"num1": 1, "num2": 2}, headers=headers)
+    assert list(tmp_path.iterdir()) == []
+
+    response = profiled.post("/add", json={"num1": 1, "num2": 2}, headers={**headers, "X-Debug-Profile": "1"})
+    assert response.status_code == 200
+    files = list(tmp_path.iterdir())
+    assert len(files) == 1
+    assert "_POST_add_" in files[0].name and files[0].name.endswith("ms.prof")
+    assert pstats.Stats(str(files[0])).total_calls > 0
+
+@pytest.mark.asyncio
+@allure.feature("Performance")
+@allure.story("Slow Query Log")
+async def test_slow_query_log(test_user_token, tmp_path):
+    """Test slow statement aggregation, plan capture and the admin endpoint"""
+    assert normalize_statement("SELECT * FROM t WHERE a = 'x' AND b IN (?, ?, ?) LIMIT 10") == \
+        "SELECT * FROM t WHERE a = ? AND b IN (?) LIMIT ?"
+
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'slow.db'}")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    log = SlowQueryLog(threshold_ms=0.000001, max_entries=10, log_parameters=True)
+    log.attach(engine, "test")
+    async with engine.connect() as conn:
+        for user_id in (1, 2):
+            await conn.execute(select(OperationHistory).where(OperationHistory.user_id == user_id))
+        await conn.execute(select(User).where(User.username == "secret-name"))
+    await log.wait_for_plans()
+    await engine.dispose()
+
+    entry = next(e for e in log.top() if e["statement"].startswith("SELECT operation_history"))
+    assert entry["count"] == 2
+    assert any("ix_operation_history_user_ts_id" in line for line in entry["plan"])
+    assert entry["sample_parameters"] is not None
+    users_entry = next(e for e in log.top() if "FROM users" in e["statement"])
+    assert users_entry["sample_parameters"] == "<redacted>"
+    assert SlowQueryLog().log_parameters is False
+
+    headers = {"Authorization": f"Bearer {test_user_token}"}
+    assert client.get("/admin/slow-queries", headers=headers).status_code == 403
+    ADMIN_USERNAMES.add(test_user["username"])
+    try:
+        response = client.get("/admin/slow-queries?order_by=max_ms", headers=headers)
+    finally:
+        ADMIN_USERNAMES.discard(test_user["username"])
+    assert response.status_code == 200
+    assert response.json()["threshold_ms"] == slow_query_log.threshold_ms
+
+@allure.feature("Performance")
+@allure.story("Load Test SLO Gates")
+def test_load_test_slo_gates(tmp_path):
+    """Test Locust CSV parsing and per-route SLO checks"""
+    stats_csv = tmp_path / "run_stats.csv"
+    stats_csv.write_text(
+        "Type,Name,Request Count,Failure Count,Median Response Time,Average Response Time,"
+        "Min Response Time,Max Response Time,Average Content Size,Requests/s,Failures/s,"
+        "50%,66%,75%,80%,90%,95%,98%,99%,99.9%,99.99%,100%\n"
+        "POST,/add,100,2,10,12,5,90,54,10.0,0.2,10,11,12,13,20,40,60,80,90,90,90\n"
+        "POST,/token,10,0,300,310,280,700,180,1.0,0.0,300,310,320,330,400,600,700,700,700,700,700\n"
+        ",Aggregated,110,2,12,40,5,700,60,11.0,0.2,12,13,15,20,30,300,600,700,700,700,700\n"
+    )
+    routes = parse_stats(str(stats_csv))
+    assert routes["POST /add"]["error_rate"] == 0.02
+    assert routes["Aggregated"]["p95_ms"] == 300
+
+    slo = {
+        "default": {"p95_ms": 100, "error_rate": 0.05},
+        "routes": {"/token": {"p95_ms": 1000}, "Aggregated": {"p95_ms": 1000, "min_rps": 20}}
+    }
+    assert check_slos(routes, slo) == ["Aggregated: 11.0 req/s < 20"]
+    slo["default"]["error_rate"] = 0.01
+    assert "POST /add: error rate 2.00% > 1.00%" in check_slos(routes, slo)
+
+@pytest.mark.asyncio
+@allure.feature("Database")
+@allure.story("Schema Initialization Lock")
+async def test_schema_lock(tmp_path, monkeypatch):
+    """Test that schema initialization is serialized between workers"""
+    monkeypatch.setattr(database, "SCHEMA_LOCK_FILE", str(tmp_path / "schema.lock"))
+    events = []
+
+    async def worker(name: str):
+        async with schema_lock(test_engine):
+            events.append(f"{name} start")
+            await asyncio.sleep(0.05)
+            events.append(f"{name} end")
+
+    await asyncio.gather(worker("a"), worker("b"))
+    assert events in (
+        ["a start", "a end", "b start", "b end"],
+        ["b start", "b end", "a start", "a end"]
+    )
+
+@allure.feature("Performance")
+@allure.story("Side-Effect-Free Imports")
+def test_imports_are_side_effect_free(tmp_path):
+    """Test that importing the app neither configures logging nor creates engines"""
+    import subprocess
+    code = (
+        "import apiserver, database, logger, os; "
+        "print(database._engines is None, logger._configured, os.path.exists('logs'))"
+    )
+    output = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=tmp_path,
+        env={**os.environ, "PYTHONPATH": os.path.dirname(os.path.abspath(__file__))},
+        capture_output=True,
+        text=True,
+        check=True
+    ).stdout
+    assert output.strip().splitlines()[-1] == "True False False"
+
+@allure.feature("Database Operations")
+@allure.story("SQL Echo")
+def test_sql_echo_is_opt_in():
+    """Test that SQL echo stays off in every environment unless SQL_ECHO is set"""
+    import subprocess
+    env = {key: value for key, value in os.environ.items() if key != "SQL_ECHO"}
+    env["PYTHONPATH"] = os.path.dirname(os.path.abspath(__file__))
+    for environment, sql_echo, expected in (("development", None, "False"), ("test", "true", "True")):
+        run_env = {**env, "ENV": environment}
+        if sql_echo is not None:
+            run_env["SQL_ECHO"] = sql_echo
+        output = subprocess.run(
+            [sys.executable, "-c", "import database; print(database.SQL_ECHO)"],
+            env=run_env,
+            capture_output=True,
+            text=True,
+            check=True
+        ).stdout
+        assert output.strip().splitlines()[-1] == expected
+
+@pytest.mark.asyncio
+@allure.feature("Database Operations")
+@allure.story("SQLite Reader/Writer Routing")
+async def test_sqlite_read_write_routing(tmp_path):
+    """Test the WAL profile and that reads after a write in one session see that write"""
+    engine, read_engine = database.create_engines(
+        f"sqlite+aiosqlite:///{tmp_path / 'routing.db'}", sqlite_profile="performance", echo=False
+    )
+    assert read_engine is not None
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    async with read_engine.connect() as conn:
+        assert (await conn.execute(text("PRAGMA journal_mode"))).scalar() == "wal"
+    session_factory = database.create_session_factory(engine, read_engine)
+
+    def bind(session):
+        return session.sync_session.get_bind(clause=select(User))
+
+    try:
+        async with session_factory() as session:
+            # A transaction that has not written reads from the reader pool
+            assert bind(session) is read_engine.sync_engine
+            await session.execute(
+                insert(User).values(username="routed", email="routed@example.com", hashed_password="x")
+            )
+            assert bind(session) is engine.sync_engine
+            user = (await session.execute(select(User).where(User.username == "routed"))).scalar_one()
+            assert (await session.execute(text("SELECT count(*) FROM users"))).scalar() == 1
+
+            session.add(OperationHistory(operation="add", num1=1, num2=2, result=3, user_id=user.id))
+            await session.flush()
+            assert len((await session.execute(select(OperationHistory))).scalars().all()) == 1
+            await session.commit()
+
+            # Committed: back on the reader, which now sees the rows
+            assert bind(session) is read_engine.sync_engine
+            assert (await session.execute(select(func.count()).select_from(OperationHistory))).scalar() == 1
+
+            await session.execute(insert(User).values(username="undone", email="undone@example.com"))
+            await session.rollback()
+            assert bind(session) is read_engine.sync_engine
+            assert (await session.execute(select(func.count()).select_from(User))).scalar() == 1
+    finally:
+        await engine.dispose()
+        await read_engine.dispose()
+
+@pytest.mark.asyncio
+@allure.feature("Database Operations")
+@allure.story("Schema Initialization")
+async def test_init_db_skips_current_schema(monkeypatch):
+    """Test that init_db skips schema creation once the stored version is current"""
+    monkeypatch.setattr(database, "_engines", (test_engine, None))
+    await init_db()
+    async with test_engine.begin() as conn:
+        await conn.execute(text("DROP TABLE operation_stats"))
+
+    await init_db()
+    async with test_engine.connect() as conn:
+        result = await conn.execute(
+            text("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'operation_stats'")
+        )
+        assert result.scalar() is None
+
+@pytest.mark.asyncio
+@allure.feature("Database Operations")
+@allure.story("History Archival")
+async def test_history_archival(test_user_token, tmp_path, monkeypatch):
+    """Test that old rows move to archive files and /history still returns them"""
+    headers = {"Authorization": f"Bearer {test_user_token}"}
+    client.post("/batch", json={"operations": [
+        {"operation": "add", "num1": i, "num2": 1} for i in range(3)
+    ]}, headers=headers)
+    async with TestingSessionLocal() as session:
+        session.add_all([
+            OperationHistory(operation="multiply", num1=i, num2=2, result=i * 2, user_id=1,
+                             timestamp=datetime(2024, 1 + i % 2, 1 + i))
+            for i in range(5)
+        ])
+        await session.commit()
+
+    archive = HistoryArchive(str(tmp_path))
+    monkeypatch.setattr(history_archive, "directory", str(tmp_path))
+    moved = await archive_history(TestingSessionLocal, datetime(2025, 1, 1), archive, batch_size=2)
+    assert moved == 5
+    assert sorted(p.name for p in (tmp_path / "1").iterdir()) == ["2024-01.ophz", "2024-02.ophz"]
+    async with TestingSessionLocal() as session:
+        remaining = (await session.execute(select(OperationHistory))).scalars().all()
+    assert [op.operation for op in remaining] == ["add"] * 3
+
+    # Running again finds nothing left to move
+    assert await archive_history(TestingSessionLocal, datetime(2025, 1, 1), archive) == 0
+
+    # Rebuilt rollups still count the archived rows
+    async with TestingSessionLocal() as session:
+        await rebuild_operation_stats(session, archive=archive)
+        await session.commit()
+        rebuilt = {item["operation"]: item for item in await get_operation_stats(session, 1)}
+    assert rebuilt["add"]["count"] == 3
+    assert rebuilt["multiply"]["count"] == 5
+    assert rebuilt["multiply"]["max"] == 8
+    assert rebuilt["multiply"]["last_timestamp"] == datetime(2024, 2, 4)
+
+    expected = [3, 2, 1, 7, 5, 8, 6, 4]
+    assert [item["id"] for item in client.get("/history", headers=headers).json()] == expected
+
+    pages, cursor = [], ""
+    while cursor is not None:
+        response = client.get(f"/history?limit=3&cursor={cursor}" if cursor else "/history?limit=3",
+                              headers=headers)
+        pages.append(response.json())
+        cursor = response.headers.get("X-Next-Cursor")
+    assert [item["id"] for page in pages for item in page] == expected
+    assert pages[1][-1] == {
+        "id": 8, "operation": "multiply", "num1": 4.0, "num2": 2.0, "result": 8.0,
+        "timestamp": "2024-01-05T00:00:00", "user_id": 1
+    }
+
+    response = client.get("/history?format=ndjson&limit=5", headers=headers)
+    assert [json.loads(line)["id"] for line in response.text.splitlines()] == expected[:5]
+
+@pytest.mark.asyncio
+@allure.feature("Performance")
+@allure.story("Load Shedding")
+async def test_load_shedding(test_user_token):
+    """Test per-client quotas (429), concurrency limits (503) and AIMD limit changes"""
+    headers = {"Authorization": f"Bearer {test_user_token}"}
+    compute = AIMDLimiter(max_limit=4, target_latency=0.5, min_limit=1)
+    shedding_client = TestClient(LoadSheddingMiddleware(
+        app,
+        limiters={"compute": compute},
+        quotas={"compute": TokenBuckets(rate=0.01, burst=2)}
+    ))
+
+    assert shedding_client.post("/add", json={"num1": 1, "num2": 2}, headers=headers).status_code == 200
+    assert shedding_client.post("/add", json={"num1": 1, "num2": 2}, headers=headers).status_code == 200
+    response = shedding_client.post("/add", json={"num1": 1, "num2": 2}, headers=headers)
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) >= 1
+    assert requests_shed.value("compute", "quota") >= 1
+    # Other route classes are not affected
+    assert shedding_client.get("/history", headers=headers).status_code == 200
+
+    shedding_client = TestClient(LoadSheddingMiddleware(app, limiters={"compute": compute}, quotas={}))
+    for _ in range(4):
+        assert compute.try_acquire()
+    response = shedding_client.post("/subtract", json={"num1": 1, "num2": 2}, headers=headers)
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+    assert response.json()["status_code"] == 503
+
+    # A slow completion shrinks the limit; fast ones under load grow it back
+    compute.release(1.0)
+    assert int(compute.limit) == 3
+    for _ in range(3):
+        compute.release(0.01)
+    assert compute.in_flight == 0
+    assert compute.limit == 4
+    assert shedding_client.post("/subtract", json={"num1": 1, "num2": 2}, headers=headers).status_code == 200
+
+    # A response that starts quickly but streams for long is not an overload signal
+    async def slow_stream(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await asyncio.sleep(0.2)
+        await send({"type": "http.response.body", "body": b"done"})
+
+    history = AIMDLimiter(max_limit=4, target_latency=0.1, min_limit=1)
+    history.limit = 3.0
+    sent = []
+    async def collect(message):
+        sent.append(message)
+    middleware = LoadSheddingMiddleware(slow_stream, limiters={"history": history}, quotas={})
+    await middleware({"type": "http", "path": "/history", "headers": []}, None, collect)
+    assert sent[-1]["body"] == b"done"
+    assert history.limit == 3.0
+
+@pytest.mark.asyncio
+@allure.feature("Performance")
+@allure.story("Conditional History Requests")
+async def test_history_etag(test_user_token, monkeypatch):
+    """Test ETag/If-None-Match on /history and that a write changes the ETag"""
+    headers = {"Authorization": f"Bearer {test_user_token}"}
+    # Opt-in per-process versions answer a conditional poll without a query
+    monkeypatch.setattr(history_versions, "source", "process")
+    client.post("/add", json={"num1": 1, "num2": 2}, headers=headers)
+
+    response = client.get("/history", headers=headers)
+    assert response.status_code == 200
+    etag = response.headers["ETag"]
+    assert [item["result"] for item in response.json()] == [3]
+
+    queries = db_queries.value("test")
+    response = client.get("/history", headers={**headers, "If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.headers["ETag"] == etag
+    assert response.content == b""
+    assert db_queries.value("test") == queries
+
+    # Another page or format is another representation
+    assert client.get("/history?limit=1", headers=headers).headers["ETag"] != etag
+    response = client.get("/history?format=ndjson", headers={**headers, "If-None-Match": etag})
+    assert response.status_code == 200
+
+    client.post("/batch", json={"operations": [{"operation": "multiply", "num1": 2, "num2": 5}]}, headers=headers)
+    response = client.get("/history", headers={**headers, "If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+    assert [item["result"] for item in response.json()] == [10, 3]
+
+    # Opt-in page cache: a repeat request for the same page skips the query
+    monkeypatch.setattr(history_response_cache, "maxsize", 8)
+    page = client.get("/history?limit=1", headers=headers)
+    queries = db_queries.value("test")
+    cached = client.get("/history?limit=1", headers=headers)
+    assert cached.content == page.content
+    assert cached.headers["X-Next-Cursor"] == page.headers["X-Next-Cursor"]
+    assert db_queries.value("test") == queries
+    assert len(history_response_cache) == 1
+
+    # The default versions are read from the rollups, so other workers' writes count
+    assert HistoryVersions().source == "database"
+    monkeypatch.setattr(history_versions, "source", "database")
+    etag = client.get("/history", headers=headers).headers["ETag"]
+    assert client.get("/history", headers={**headers, "If-None-Match": etag}).status_code == 304
+    client.post("/subtract", json={"num1": 1, "num2": 2}, headers=headers)
+    assert client.get("/history", headers={**headers, "If-None-Match": etag}).status_code == 200
+
+@pytest.mark.asyncio
+@allure.feature("Authentication")
+@allure.story("Refresh Tokens")
+async def test_refresh_tokens(test_user_token, monkeypatch):
+    """Test refresh token rotation, reuse detection and that refreshing skips bcrypt"""
+    response = client.post("/token", data={"username": test_user["username"], "password": test_user["password"]})
+    assert response.status_code == 200
+    first = response.json()["refresh_token"]
+    # Registration keeps its original response shape
+    response = client.post("/register", json={**test_user, "username": "otheruser", "email": "other@example.com"})
+    assert set(response.json()) == {"access_token", "token_type"}
+
+    # A refresh token is not an access token
+    response = client.get("/", headers={"Authorization": f"Bearer {first}"})
+    assert response.status_code == 401
+
+    def no_bcrypt(*args):
+        raise AssertionError("bcrypt called during refresh")
+    monkeypatch.setattr("auth.verify_password", no_bcrypt)
+
+    response = client.post("/token/refresh", json={"refresh_token": first})
+    assert response.status_code == 200
+    second = response.json()["refresh_token"]
+    assert second != first
+    access_token = response.json()["access_token"]
+    assert client.get("/", headers={"Authorization": f"Bearer {access_token}"}).status_code == 200
+
+    response = client.post("/token/refresh", json={"refresh_token": second})
+    assert response.status_code == 200
+    third = response.json()["refresh_token"]
+
+    # Replaying a rotated token revokes the whole family, including the newest token
+    assert client.post("/token/refresh", json={"refresh_token": first}).status_code == 401
+    assert client.post("/token/refresh", json={"refresh_token": third}).status_code == 401
+    assert client.post("/token/refresh", json={"refresh_token": test_user_token}).status_code == 401
+    assert client.post("/token/refresh", json={"refresh_token": "garbage"}).status_code == 401
+
+    async with TestingSessionLocal() as session:
+        tokens = (await session.execute(select(RefreshToken))).scalars().all()
+    assert len(tokens) == 3
+    assert len({token.family_id for token in tokens}) == 1
+    assert all(token.revoked_at is not None for token in tokens)
+    assert sorted(token.replaced_by is not None for token in tokens) == [False, True, True]
+
+    # Purging drops the revoked family and expired tokens but keeps what reuse detection needs
+    monkeypatch.undo()
+    response = client.post("/token", data={"username": test_user["username"], "password": test_user["password"]})
+    rotated = response.json()["refresh_token"]
+    assert client.post("/token/refresh", json={"refresh_token": rotated}).status_code == 200
+    async with TestingSessionLocal() as session:
+        session.add(RefreshToken(
+            jti="expired", family_id="old", user_id=tokens[0].user_id,
+            expires_at=datetime.utcnow() - timedelta(days=1)
+        ))
+        await session.commit()
+        assert await purge_refresh_tokens(session) == 4
+        await session.commit()
+        remaining = (await session.execute(select(RefreshToken))).scalars().all()
+    assert len(remaining) == 2
+    assert client.post("/token/refresh", json={"refresh_token": rotated}).status_code == 401
+
 # Add pytest configuration
 def pytest_configure(config):
     """Configure pytest to handle async tests"""
@@ -0,0 +1,10 @@
+"""Benchmarks, run as ``python -m benchmarks.<name>`` from the repository root.
+
+The application modules read ENV when they are imported, and the development
+default logs every request and (through the DEBUG root logger) every SQL
+statement and aiosqlite call, which buries the results. Importing this package
+first switches them to BENCH_ENV (default: production, warnings only).
+"""
+import os
+
+os.environ["ENV"] = os.getenv("BENCH_ENV", "production")
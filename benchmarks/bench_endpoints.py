@@ -0,0 +1,258 @@
+"""Benchmark: latency percentiles and throughput for every route, checked against a stored baseline.
+
+Drives the ASGI app in-process through httpx's ASGI transport (no network)
+against an in-memory SQLite database. Requests within a case run one after
+another, so the numbers reflect per-request server cost. /history is measured
+for users with several history sizes, including conditional polls that are
+answered with 304 Not Modified.
+
+The first run (or --update-baseline) writes the results to the baseline file.
+Later runs compare p50, p95 and throughput per case and exit with status 1 if
+any of them is worse than the baseline by more than --max-regression percent.
+
+Usage:
+    python -m benchmarks.bench_endpoints --requests 500
+    python -m benchmarks.bench_endpoints --update-baseline
+    python -m benchmarks.bench_endpoints --max-regression 15 --only add,history_1000
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import platform
+import sys
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+import httpx
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+import auth
+from apiserver import app
+from base import Base
+from database import get_db
+from history import operation_row, persist_operations
+from models import User
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), "endpoint_baseline.json")
+MAX_REGRESSION_PERCENT = float(os.getenv("BENCH_MAX_REGRESSION_PERCENT", "20"))
+HISTORY_SIZES = (10, 100, 1000)
+# bcrypt-bound routes get fewer iterations
+SLOW_CASE_REQUESTS = 20
+PASSWORD = "benchpassword"
+
+class Case:
+    def __init__(
+        self,
+        name: str,
+        method: str,
+        path: str,
+        request_kwargs: Callable[[int], dict],
+        requests: Optional[int] = None
+    ):
+        self.name = name
+        self.method = method
+        self.path = path
+        self.request_kwargs = request_kwargs
+        self.requests = requests
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    index = min(len(sorted_values) - 1, max(0, round(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+async def register(client: httpx.AsyncClient, username: str) -> str:
+    response = await client.post("/register", json={
+        "username": username, "email": f"{username}@example.com", "password": PASSWORD
+    })
+    response.raise_for_status()
+    return response.json()["access_token"]
+
+async def seed_history(session_factory, client: httpx.AsyncClient, size: int) -> str:
+    """Register a user with ``size`` history rows and return its Authorization header"""
+    token = await register(client, f"history{size}")
+    async with session_factory() as db:
+        user_id = (await db.execute(select(User.id).where(User.username == f"history{size}"))).scalar_one()
+        await persist_operations(db, [operation_row(user_id, "add", i, 1, i + 1) for i in range(size)])
+        await db.commit()
+    return f"Bearer {token}"
+
+def build_cases(
+    auth_header: str,
+    history_headers: Dict[int, str],
+    history_etags: Dict[int, str],
+    requests: int
+) -> List[Case]:
+    headers = {"Authorization": auth_header}
+    counter = itertools.count()
+    slow = min(requests, SLOW_CASE_REQUESTS)
+
+    def body(payload: dict) -> Callable[[int], dict]:
+        return lambda i: {"json": payload, "headers": headers}
+
+    cases = [
+        Case("root", "GET", "/", lambda i: {"headers": headers}),
+        Case("metrics", "GET", "/metrics", lambda i: {}),
+        Case("register", "POST", "/register", lambda i, n=counter: {"json": {
+            "username": f"new{next(n)}", "email": f"new{next(n)}@example.com", "password": PASSWORD
+        }}, slow),
+        Case("token", "POST", "/token", lambda i: {"data": {"username": "benchuser", "password": PASSWORD}}, slow),
+        Case("add", "POST", "/add", body({"num1": 7, "num2": 1.5})),
+        Case("subtract", "POST", "/subtract", body({"num1": 7, "num2": 1.5})),
+        Case("multiply", "POST", "/multiply", body({"num1": 7, "num2": 1.5})),
+        Case("sqrt", "POST", "/root", body({"number": 16})),
+        Case("batch", "POST", "/batch", body({"operations": [
+            {"operation": "add", "num1": i, "num2": 1} for i in range(10)
+        ]})),
+        Case("history_stats", "GET", "/history/stats", lambda i: {"headers": headers}),
+        Case("admin_slow_queries", "GET", "/admin/slow-queries", lambda i: {"headers": headers}),
+    ]
+    for size, header in history_headers.items():
+        size_headers = {"Authorization": header}
+        cases.append(Case(f"history_{size}", "GET", "/history", lambda i, h=size_headers: {"headers": h}))
+        cases.append(Case(
+            f"history_{size}_page50", "GET", "/history", lambda i, h=size_headers: {"headers": h, "params": {"limit": 50}}
+        ))
+        conditional_headers = {**size_headers, "If-None-Match": history_etags[size]}
+        cases.append(Case(
+            f"history_{size}_304", "GET", "/history", lambda i, h=conditional_headers: {"headers": h}
+        ))
+    return cases
+
+async def measure(client: httpx.AsyncClient, case: Case, requests: int, warmup: int) -> dict:
+    for i in range(warmup):
+        await client.request(case.method, case.path, **case.request_kwargs(i))
+
+    latencies = []
+    errors = 0
+    started = time.perf_counter()
+    for i in range(requests):
+        request_started = time.perf_counter()
+        response = await client.request(case.method, case.path, **case.request_kwargs(warmup + i))
+        latencies.append((time.perf_counter() - request_started) * 1000)
+        if response.status_code >= 400:
+            errors += 1
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "requests": requests,
+        "errors": errors,
+        "throughput_rps": requests / elapsed,
+        "p50_ms": percentile(latencies, 50),
+        "p95_ms": percentile(latencies, 95),
+        "p99_ms": percentile(latencies, 99),
+    }
+
+async def run(requests: int, warmup: int, only: Optional[List[str]]) -> Dict[str, dict]:
+    engine = create_async_engine(
+        "sqlite+aiosqlite:///:memory:",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool
+    )
+    session_factory = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
+    async def override_get_db():
+        async with session_factory() as session:
+            yield session
+
+    app.dependency_overrides[get_db] = override_get_db
+    auth.ADMIN_USERNAMES.add("benchuser")
+    results = {}
+    try:
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            token = await register(client, "benchuser")
+            history_headers = {size: await seed_history(session_factory, client, size) for size in HISTORY_SIZES}
+            history_etags = {
+                size: (await client.get("/history", headers={"Authorization": header})).headers["ETag"]
+                for size, header in history_headers.items()
+            }
+            for case in build_cases(f"Bearer {token}", history_headers, history_etags, requests):
+                if only and case.name not in only:
+                    continue
+                case_requests = case.requests or requests
+                results[case.name] = await measure(client, case, case_requests, min(warmup, case_requests))
+    finally:
+        auth.ADMIN_USERNAMES.discard("benchuser")
+        app.dependency_overrides.pop(get_db, None)
+        await engine.dispose()
+    return results
+
+def compare(results: Dict[str, dict], baseline: Dict[str, dict], max_regression: float) -> List[str]:
+    """Return a description of every metric that regressed past max_regression percent"""
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        for metric in ("p50_ms", "p95_ms"):
+            change = (result[metric] - base[metric]) / base[metric] * 100 if base[metric] else 0.0
+            if change > max_regression:
+                regressions.append(f"{name}: {metric} {base[metric]:.2f} -> {result[metric]:.2f} (+{change:.0f}%)")
+        change = (base["throughput_rps"] - result["throughput_rps"]) / base["throughput_rps"] * 100
+        if change > max_regression:
+            regressions.append(
+                f"{name}: throughput {base['throughput_rps']:.0f} -> {result['throughput_rps']:.0f} req/s (-{change:.0f}%)"
+            )
+    return regressions
+
+def print_results(results: Dict[str, dict], baseline: Dict[str, dict]) -> None:
+    print(f"\n{'case':24s} {'req/s':>9s} {'p50 ms':>8s} {'p95 ms':>8s} {'p99 ms':>8s} {'errors':>6s}  vs baseline p95")
+    for name, result in results.items():
+        base = baseline.get(name)
+        delta = f"{(result['p95_ms'] / base['p95_ms'] - 1) * 100:+.0f}%" if base and base["p95_ms"] else "-"
+        print(f"{name:24s} {result['throughput_rps']:9.1f} {result['p50_ms']:8.2f} {result['p95_ms']:8.2f} "
+              f"{result['p99_ms']:8.2f} {result['errors']:6d}  {delta}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=300, help="requests per case")
+    parser.add_argument("--warmup", type=int, default=20, help="unmeasured requests per case")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--update-baseline", action="store_true", help="overwrite the baseline with this run")
+    parser.add_argument("--max-regression", type=float, default=MAX_REGRESSION_PERCENT,
+                        help="allowed slowdown per metric, in percent")
+    parser.add_argument("--only", help="comma-separated case names")
+    args = parser.parse_args()
+    # Per-request client and driver debug logging would skew the timings
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    logging.getLogger("aiosqlite").setLevel(logging.WARNING)
+
+    only = [name.strip() for name in args.only.split(",")] if args.only else None
+    results = asyncio.run(run(args.requests, args.warmup, only))
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+    print_results(results, baseline)
+
+    if args.update_baseline or not baseline:
+        with open(args.baseline, "w") as f:
+            json.dump({
+                "created": datetime.utcnow().isoformat(),
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "results": {**baseline, **results},
+            }, f, indent=2)
+        print(f"\nBaseline written to {args.baseline}")
+        return
+
+    regressions = compare(results, baseline, args.max_regression)
+    if regressions:
+        print(f"\nRegressions beyond {args.max_regression:.0f}%:")
+        for line in regressions:
+            print(f"  {line}")
+        sys.exit(1)
+    print(f"\nNo regressions beyond {args.max_regression:.0f}%")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""Benchmark: per-request CPU for /add with and without the orjson fast response path.
+
+Drives the ASGI app in-process against an in-memory SQLite database and
+reports process CPU time per request, so the numbers reflect work done by
+the server rather than network or scheduling noise.
+
+Usage:
+    python -m benchmarks.bench_fast_json --requests 2000
+"""
+import argparse
+import asyncio
+import logging
+import time
+
+import httpx
+from fastapi.responses import JSONResponse, ORJSONResponse
+from fastapi.routing import serialize_response
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+import apiserver
+from base import Base
+from database import get_db
+
+async def measure(client: httpx.AsyncClient, headers: dict, requests: int) -> float:
+    started = time.process_time()
+    for i in range(requests):
+        response = await client.post("/add", json={"num1": i, "num2": 1.5}, headers=headers)
+        assert response.status_code == 200, response.text
+    return (time.process_time() - started) / requests * 1e6
+
+async def measure_serialization(iterations: int) -> tuple:
+    """CPU per response for the serialization step alone"""
+    route = next(r for r in apiserver.app.routes if getattr(r, "path", None) == "/add")
+    payload = {"result": 8.5, "operation": "add", "num1": 7.0, "num2": 1.5}
+
+    started = time.process_time()
+    for _ in range(iterations):
+        content = await serialize_response(field=route.response_field, response_content=payload)
+        JSONResponse(content)
+    default_us = (time.process_time() - started) / iterations * 1e6
+
+    started = time.process_time()
+    for _ in range(iterations):
+        ORJSONResponse(payload)
+    fast_us = (time.process_time() - started) / iterations * 1e6
+    return default_us, fast_us
+
+async def run(requests: int) -> None:
+    engine = create_async_engine(
+        "sqlite+aiosqlite:///:memory:",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool
+    )
+    session_factory = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
+    async def override_get_db():
+        async with session_factory() as session:
+            yield session
+
+    apiserver.app.dependency_overrides[get_db] = override_get_db
+    transport = httpx.ASGITransport(app=apiserver.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        response = await client.post("/register", json={
+            "username": "benchuser", "email": "bench@example.com", "password": "benchpassword"
+        })
+        headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+        await measure(client, headers, 100)  # warm-up
+        apiserver.FAST_JSON_ROUTES.discard("*")
+        default_us = await measure(client, headers, requests)
+        apiserver.FAST_JSON_ROUTES.add("*")
+        fast_us = await measure(client, headers, requests)
+        apiserver.FAST_JSON_ROUTES.discard("*")
+
+    apiserver.app.dependency_overrides.pop(get_db, None)
+    await engine.dispose()
+    serialize_default_us, serialize_fast_us = await measure_serialization(requests * 10)
+
+    print(f"\n/add, {requests} requests each (process CPU per request)")
+    print(f"response_model + default encoder: {default_us:8.1f} us")
+    print(f"fast path (orjson, no revalidation): {fast_us:5.1f} us")
+    print(f"saved: {default_us - fast_us:.1f} us/request ({(1 - fast_us / default_us) * 100:.1f}%)")
+    print("\nResponse serialization step alone")
+    print(f"response_model validation + JSONResponse: {serialize_default_us:6.1f} us")
+    print(f"ORJSONResponse:                           {serialize_fast_us:6.1f} us")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=2000)
+    args = parser.parse_args()
+    # Per-request client logging would dominate the CPU numbers
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    asyncio.run(run(args.requests))
+
+if __name__ == "__main__":
+    main()
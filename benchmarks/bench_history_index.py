@@ -0,0 +1,93 @@
+"""Benchmark: /history query plan and latency before and after the composite index.
+
+Seeds a throwaway SQLite database without the (user_id, timestamp, id) index,
+measures the /history query, applies the migrations and measures again.
+
+Usage:
+    python -m benchmarks.bench_history_index --rows 500000 --users 100
+"""
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert, text
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from base import Base
+from history import history_query
+from migrations import HISTORY_INDEX, run_migrations
+from models import OperationHistory, SchemaVersion
+
+async def seed(engine, rows: int, users: int) -> None:
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        # Simulate a database created before the index existed
+        await conn.execute(text(f"DROP INDEX IF EXISTS {HISTORY_INDEX}"))
+        await conn.execute(SchemaVersion.__table__.delete())
+
+        start = datetime.utcnow() - timedelta(days=365)
+        batch = []
+        for i in range(rows):
+            batch.append({
+                "operation": "add",
+                "num1": i,
+                "num2": 1,
+                "result": i + 1,
+                "user_id": random.randint(1, users),
+                "timestamp": start + timedelta(seconds=i),
+            })
+            if len(batch) == 20000:
+                await conn.execute(insert(OperationHistory), batch)
+                batch = []
+        if batch:
+            await conn.execute(insert(OperationHistory), batch)
+
+async def measure(engine, user_id: int, limit: int, repeat: int) -> dict:
+    query = history_query(user_id, limit=limit)
+    compiled = query.compile(dialect=engine.dialect, compile_kwargs={"literal_binds": True})
+    async with engine.connect() as conn:
+        plan = await conn.execute(text(f"EXPLAIN QUERY PLAN {compiled}"))
+        plan_lines = [row[-1] for row in plan]
+
+        started = time.perf_counter()
+        for _ in range(repeat):
+            await conn.execute(query)
+        elapsed = (time.perf_counter() - started) / repeat
+    return {"plan": plan_lines, "ms_per_query": elapsed * 1000}
+
+async def run(rows: int, users: int, limit: int, repeat: int) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+        print(f"Seeding {rows} rows for {users} users...")
+        await seed(engine, rows, users)
+
+        before = await measure(engine, 1, limit, repeat)
+        started = time.perf_counter()
+        await run_migrations(engine)
+        migrate_s = time.perf_counter() - started
+        after = await measure(engine, 1, limit, repeat)
+        await engine.dispose()
+
+    for label, result in (("before", before), ("after", after)):
+        print(f"\n[{label}] {result['ms_per_query']:.2f} ms/query (limit={limit})")
+        for line in result["plan"]:
+            print(f"    {line}")
+    print(f"\nIndex migration took {migrate_s:.2f}s; "
+          f"speedup {before['ms_per_query'] / after['ms_per_query']:.1f}x")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=500000)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--limit", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+    asyncio.run(run(args.rows, args.users, args.limit, args.repeat))
+
+if __name__ == "__main__":
+    main()
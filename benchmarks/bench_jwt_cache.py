@@ -0,0 +1,49 @@
+"""Microbenchmark: bearer-token verification cost with and without the token cache.
+
+Usage:
+    python -m benchmarks.bench_jwt_cache --iterations 20000
+"""
+import argparse
+import timeit
+from datetime import timedelta
+
+from jose import jwt
+
+import auth
+
+def run(iterations: int) -> dict:
+    token = auth.create_access_token(
+        data={"sub": "benchmark-user"},
+        expires_delta=timedelta(minutes=30)
+    )
+
+    def uncached():
+        jwt.decode(token, auth.SECRET_KEY, algorithms=[auth.ALGORITHM])
+
+    def cached():
+        auth.decode_access_token(token)
+
+    auth.clear_token_cache()
+    cached()  # prime the cache
+
+    uncached_s = timeit.timeit(uncached, number=iterations)
+    cached_s = timeit.timeit(cached, number=iterations)
+    return {
+        "iterations": iterations,
+        "uncached_us_per_call": uncached_s / iterations * 1e6,
+        "cached_us_per_call": cached_s / iterations * 1e6,
+        "speedup": uncached_s / cached_s if cached_s else float("inf"),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=20000)
+    args = parser.parse_args()
+
+    results = run(args.iterations)
+    print(f"jwt.decode (no cache):   {results['uncached_us_per_call']:8.2f} us/request")
+    print(f"decode_access_token hit: {results['cached_us_per_call']:8.2f} us/request")
+    print(f"speedup:                 {results['speedup']:8.1f}x")
+
+if __name__ == "__main__":
+    main()
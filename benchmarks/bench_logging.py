@@ -0,0 +1,99 @@
+"""Benchmark: per-call cost of a log statement on the request path, direct vs queued.
+
+Both variants write to a temporary file so terminal speed does not skew the
+numbers. The queued variant also reports how long the writer thread needed to
+drain everything afterwards (time that is no longer spent on the request path).
+
+Usage:
+    python -m benchmarks.bench_logging --calls 50000
+"""
+import argparse
+import logging
+import os
+import tempfile
+import time
+from logging.handlers import RotatingFileHandler
+
+import structlog
+
+import logger as app_logger
+
+EVENT = dict(username="benchmark-user", num1=5.0, num2=3.0, result=8.0)
+
+def _timed(func, calls: int) -> float:
+    started = time.perf_counter()
+    for _ in range(calls):
+        func()
+    return (time.perf_counter() - started) / calls * 1e6
+
+def bench_structlog(calls: int, tmp: str) -> dict:
+    processors = app_logger.get_processors()
+    if app_logger.LOG_ASYNC:
+        # get_processors() leaves rendering to the pipeline; add it back for the direct case
+        processors = processors + [app_logger.get_renderer()]
+    else:
+        processors = processors[:-1] + [app_logger.get_renderer()]
+
+    with open(os.path.join(tmp, "direct.log"), "w") as f:
+        direct = structlog.wrap_logger(
+            structlog.PrintLogger(f),
+            processors=processors,
+            wrapper_class=structlog.make_filtering_bound_logger(logging.INFO)
+        )
+        direct_us = _timed(lambda: direct.info("Addition operation performed", **EVENT), calls)
+
+    with open(os.path.join(tmp, "queued.log"), "w") as f:
+        pipeline = app_logger.LogPipeline(renderer=app_logger.get_renderer(), stream=f)
+        queued = structlog.wrap_logger(
+            app_logger.QueuedLogger(pipeline),
+            processors=processors[:-1],
+            wrapper_class=structlog.make_filtering_bound_logger(logging.INFO)
+        )
+        queued_us = _timed(lambda: queued.info("Addition operation performed", **EVENT), calls)
+        started = time.perf_counter()
+        pipeline.stop(timeout=60)
+        drain_s = time.perf_counter() - started
+
+    return {"direct_us": direct_us, "queued_us": queued_us, "drain_s": drain_s, "dropped": pipeline.dropped}
+
+def bench_stdlib(calls: int, tmp: str) -> dict:
+    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    file_handler = RotatingFileHandler(os.path.join(tmp, "direct-std.log"), maxBytes=10 * 1024 * 1024, backupCount=5)
+    file_handler.setFormatter(formatter)
+    direct = logging.Logger("bench.direct")
+    direct.addHandler(file_handler)
+    direct_us = _timed(lambda: direct.info("Statement executed %s", EVENT), calls)
+    file_handler.close()
+
+    file_handler = RotatingFileHandler(os.path.join(tmp, "queued-std.log"), maxBytes=10 * 1024 * 1024, backupCount=5)
+    file_handler.setFormatter(formatter)
+    pipeline = app_logger.LogPipeline(handlers=[file_handler])
+    queued = logging.Logger("bench.queued")
+    queued.addHandler(app_logger.PipelineHandler(pipeline))
+    queued_us = _timed(lambda: queued.info("Statement executed %s", EVENT), calls)
+    started = time.perf_counter()
+    pipeline.stop(timeout=60)
+    drain_s = time.perf_counter() - started
+    file_handler.close()
+
+    return {"direct_us": direct_us, "queued_us": queued_us, "drain_s": drain_s, "dropped": pipeline.dropped}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--calls", type=int, default=50000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        results = {
+            "structlog logger.info": bench_structlog(args.calls, tmp),
+            "stdlib logging.info": bench_stdlib(args.calls, tmp),
+        }
+
+    print(f"\n{args.calls} calls each (us per call on the caller's thread)")
+    for name, result in results.items():
+        print(f"{name:22s} direct {result['direct_us']:7.2f} us   queued {result['queued_us']:7.2f} us   "
+              f"(writer drained backlog in {result['drain_s']:.2f}s, dropped {result['dropped']})")
+
+if __name__ == "__main__":
+    main()
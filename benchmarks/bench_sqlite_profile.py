@@ -0,0 +1,109 @@
+"""Benchmark: concurrent /add and /history throughput for the SQLite engine profiles.
+
+Compares the legacy setup (one StaticPool connection, with SQL echo as before
+and without) with the "performance" profile (WAL, tuned pragmas, reader pool and
+a single writer). Requests go through the ASGI app in-process, each profile
+against a fresh database file. In one process the performance profile is not
+faster than the legacy connection without echo (see the README); its gains are
+with several worker processes sharing the file.
+
+Usage:
+    python -m benchmarks.bench_sqlite_profile --clients 20 --duration 10
+"""
+import argparse
+import asyncio
+import logging
+import os
+import tempfile
+import time
+
+import httpx
+
+import database
+from apiserver import app
+from base import Base
+
+async def run_profile(profile: str, echo: bool, clients: int, duration: float, history_every: int) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        url = f"sqlite+aiosqlite:///{os.path.join(tmp, 'bench.db')}"
+        engine, read_engine = database.create_engines(url, sqlite_profile=profile, echo=echo)
+        if echo:
+            # Keep the cost of echo in the measurement but its output off the terminal
+            for handler in logging.getLogger("sqlalchemy.engine.Engine").handlers:
+                handler.setStream(open(os.devnull, "w"))
+        session_factory = database.create_session_factory(engine, read_engine)
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+
+        async def override_get_db():
+            async with session_factory() as session:
+                yield session
+
+        app.dependency_overrides[database.get_db] = override_get_db
+        transport = httpx.ASGITransport(app=app)
+        counts = {"add": 0, "history": 0, "errors": 0}
+
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            tokens = []
+            for i in range(clients):
+                response = await client.post("/register", json={
+                    "username": f"bench{i}",
+                    "email": f"bench{i}@example.com",
+                    "password": "benchpassword"
+                })
+                tokens.append(response.json()["access_token"])
+
+            deadline = time.perf_counter() + duration
+
+            async def worker(token: str):
+                headers = {"Authorization": f"Bearer {token}"}
+                n = 0
+                while time.perf_counter() < deadline:
+                    n += 1
+                    if n % history_every == 0:
+                        response = await client.get("/history?limit=50", headers=headers)
+                        key = "history"
+                    else:
+                        response = await client.post("/add", json={"num1": n, "num2": 1}, headers=headers)
+                        key = "add"
+                    counts[key if response.status_code == 200 else "errors"] += 1
+
+            started = time.perf_counter()
+            await asyncio.gather(*(worker(token) for token in tokens))
+            elapsed = time.perf_counter() - started
+
+        app.dependency_overrides.pop(database.get_db, None)
+        await engine.dispose()
+        if read_engine is not None:
+            await read_engine.dispose()
+
+    return {
+        "add_rps": counts["add"] / elapsed,
+        "history_rps": counts["history"] / elapsed,
+        "errors": counts["errors"],
+    }
+
+async def run(clients: int, duration: float, history_every: int) -> None:
+    results = {
+        "legacy (StaticPool, echo)": await run_profile("legacy", True, clients, duration, history_every),
+        "legacy (StaticPool)": await run_profile("legacy", False, clients, duration, history_every),
+        "performance (WAL, pools)": await run_profile("performance", False, clients, duration, history_every),
+    }
+    print(f"\n{clients} concurrent clients, {duration:.0f}s per profile")
+    for name, result in results.items():
+        print(f"{name:28s} /add {result['add_rps']:8.1f} req/s   "
+              f"/history {result['history_rps']:7.1f} req/s   errors {result['errors']}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--clients", type=int, default=20)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--history-every", type=int, default=5,
+                        help="every Nth request of a client is a /history read")
+    args = parser.parse_args()
+    # SQL echo goes through logging; keep it from drowning the results
+    logging.getLogger("sqlalchemy.engine").propagate = False
+    asyncio.run(run(args.clients, args.duration, args.history_every))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""Benchmark: module import time and time-to-first-request of the API server.
+
+Import times are measured in fresh interpreters (median of --repeat runs), with
+the framework imports (FastAPI, SQLAlchemy, pydantic) reported separately since
+they dominate and are outside this repository's control.
+
+Time-to-first-request starts serve.py with one worker and polls until it
+answers: once against an empty database (schema is created) and twice against
+the initialized one (schema creation skipped), with and without the startup
+warm-up. For the warm runs the latency of the first login is reported too,
+which is where the warm-up pays off.
+
+Usage:
+    python -m benchmarks.bench_startup --repeat 5
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODULES = ["fastapi, sqlalchemy.ext.asyncio, pydantic", "logger", "database", "auth", "apiserver"]
+USER = {"username": "startup", "email": "startup@example.com", "password": "startuppassword"}
+
+def _env(**extra) -> dict:
+    return dict(os.environ, PYTHONPATH=ROOT, ENV="production", **extra)
+
+def import_time(module: str, repeat: int, cwd: str) -> float:
+    code = f"import time; t = time.perf_counter(); import {module}; print(time.perf_counter() - t)"
+    samples = []
+    for _ in range(repeat):
+        output = subprocess.run(
+            [sys.executable, "-c", code], cwd=cwd, env=_env(), capture_output=True, text=True, check=True
+        ).stdout
+        samples.append(float(output.strip().splitlines()[-1]) * 1000)
+    return statistics.median(samples)
+
+def time_to_first_request(cwd: str, port: int, warmup: bool, login: bool) -> dict:
+    env = _env(
+        DATABASE_URL=f"sqlite+aiosqlite:///{os.path.join(cwd, 'startup.db')}",
+        STARTUP_WARMUP="true" if warmup else "false"
+    )
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, "serve.py"), "--workers", "1", "--port", str(port), "--log-level", "warning"],
+        cwd=cwd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    result = {}
+    try:
+        with httpx.Client(base_url=f"http://127.0.0.1:{port}", timeout=30) as client:
+            while True:
+                try:
+                    client.get("/openapi.json")
+                    break
+                except httpx.TransportError:
+                    if server.poll() is not None or time.perf_counter() - started > 60:
+                        raise RuntimeError("server did not start")
+                    time.sleep(0.01)
+            result["ready_ms"] = (time.perf_counter() - started) * 1000
+
+            if login:
+                request_started = time.perf_counter()
+                response = client.post("/token", data={"username": USER["username"], "password": USER["password"]})
+                response.raise_for_status()
+                result["first_login_ms"] = (time.perf_counter() - request_started) * 1000
+            else:
+                client.post("/register", json=USER).raise_for_status()
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--port", type=int, default=8014)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as cwd:
+        print(f"\nImport time (median of {args.repeat} fresh interpreters)")
+        for module in MODULES:
+            print(f"  {module:42s} {import_time(module, args.repeat, cwd):7.1f} ms")
+
+        print("\nTime to first request (serve.py, 1 worker)")
+        cold = time_to_first_request(cwd, args.port, warmup=True, login=False)
+        print(f"  empty database (create schema)             ready {cold['ready_ms']:7.1f} ms")
+        for warmup in (True, False):
+            run = time_to_first_request(cwd, args.port, warmup=warmup, login=True)
+            label = "initialized database, warm-up " + ("on" if warmup else "off")
+            print(f"  {label:42s} ready {run['ready_ms']:7.1f} ms   first /token {run['first_login_ms']:7.1f} ms")
+
+if __name__ == "__main__":
+    main()
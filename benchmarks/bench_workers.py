@@ -0,0 +1,142 @@
+"""Benchmark: throughput of serve.py as the number of worker processes grows.
+
+For each worker count a fresh server is started on a temporary SQLite file (or
+--database-url), a set of users is registered, and several client processes
+hammer one route for a fixed duration. Reads (/history/stats) show how the API
+itself scales; writes (/add) are additionally bounded by the database's
+writer. Run the load generator on other cores than the server where possible:
+on a machine with few cores the clients compete with the workers.
+
+Usage:
+    python -m benchmarks.bench_workers --workers 1,2,4 --duration 10
+    python -m benchmarks.bench_workers --route /add --clients 64
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from typing import List
+
+import httpx
+
+ROUTES = {
+    "/add": ("POST", {"num1": 5, "num2": 3}),
+    "/history/stats": ("GET", None),
+    "/": ("GET", None),
+}
+
+def start_server(workers: int, port: int, database_url: str, workdir: str) -> subprocess.Popen:
+    env = dict(os.environ, DATABASE_URL=database_url, WEB_CONCURRENCY=str(workers), ENV="production")
+    server = subprocess.Popen(
+        [sys.executable, "serve.py", "--port", str(port), "--log-level", "warning"],
+        env=env,
+        stdout=open(os.path.join(workdir, f"server-{workers}.log"), "w"),
+        stderr=subprocess.STDOUT
+    )
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(f"http://127.0.0.1:{port}/openapi.json", timeout=1)
+            # Give the remaining workers time to finish their startup too
+            time.sleep(1 + workers * 0.5)
+            return server
+        except httpx.TransportError:
+            time.sleep(0.5)
+    server.terminate()
+    raise RuntimeError("server did not start")
+
+def register_users(base_url: str, count: int) -> List[str]:
+    tokens = []
+    with httpx.Client(base_url=base_url, timeout=30) as client:
+        for i in range(count):
+            response = client.post("/register", json={
+                "username": f"bench{i}-{time.time_ns()}",
+                "email": f"bench{i}-{time.time_ns()}@example.com",
+                "password": "benchpassword"
+            })
+            response.raise_for_status()
+            tokens.append(response.json()["access_token"])
+    return tokens
+
+async def _drive(base_url: str, route: str, tokens: List[str], concurrency: int, duration: float) -> tuple:
+    method, payload = ROUTES[route]
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    completed = errors = 0
+    latencies = []
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=30) as client:
+        deadline = time.perf_counter() + duration
+
+        async def worker(index: int):
+            nonlocal completed, errors
+            headers = {"Authorization": f"Bearer {tokens[index % len(tokens)]}"}
+            while time.perf_counter() < deadline:
+                started = time.perf_counter()
+                response = await client.request(method, route, json=payload, headers=headers)
+                latencies.append(time.perf_counter() - started)
+                if response.status_code == 200:
+                    completed += 1
+                else:
+                    errors += 1
+
+        await asyncio.gather(*(worker(i) for i in range(concurrency)))
+    return completed, errors, latencies
+
+def client_process(args: tuple) -> tuple:
+    return asyncio.run(_drive(*args))
+
+def run_level(workers: int, args, workdir: str) -> dict:
+    database_url = args.database_url or f"sqlite+aiosqlite:///{os.path.join(workdir, f'bench-{workers}.db')}"
+    port = args.port
+    server = start_server(workers, port, database_url, workdir)
+    try:
+        base_url = f"http://127.0.0.1:{port}"
+        tokens = register_users(base_url, args.users)
+        per_process = max(1, args.clients // args.client_processes)
+        with multiprocessing.Pool(args.client_processes) as pool:
+            started = time.perf_counter()
+            results = pool.map(
+                client_process,
+                [(base_url, args.route, tokens, per_process, args.duration)] * args.client_processes
+            )
+            elapsed = time.perf_counter() - started
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+    completed = sum(r[0] for r in results)
+    errors = sum(r[1] for r in results)
+    latencies = sorted(latency for r in results for latency in r[2])
+    p95 = latencies[int(len(latencies) * 0.95) - 1] * 1000 if latencies else 0.0
+    return {"rps": completed / elapsed, "errors": errors, "p95_ms": p95}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", default=",".join(str(n) for n in sorted({1, 2, os.cpu_count() or 1})),
+                        help="comma-separated worker counts")
+    parser.add_argument("--route", choices=sorted(ROUTES), default="/history/stats")
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--clients", type=int, default=32, help="concurrent connections in total")
+    parser.add_argument("--client-processes", type=int, default=2)
+    parser.add_argument("--users", type=int, default=8)
+    parser.add_argument("--port", type=int, default=8013)
+    parser.add_argument("--database-url", help="defaults to a fresh SQLite file per run")
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        for workers in (int(n) for n in args.workers.split(",")):
+            results[workers] = run_level(workers, args, workdir)
+            print(f"{workers} worker(s): {results[workers]['rps']:8.1f} req/s", flush=True)
+
+    base = results[min(results)]["rps"]
+    print(f"\n{args.route}, {args.clients} connections, {args.duration:.0f}s per level, {os.cpu_count()} CPU(s)")
+    for workers, result in results.items():
+        print(f"{workers:3d} worker(s) {result['rps']:9.1f} req/s  x{result['rps'] / base:4.2f}  "
+              f"p95 {result['p95_ms']:7.1f} ms  errors {result['errors']}")
+
+if __name__ == "__main__":
+    main()
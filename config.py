@@ -12,23 +12,84 @@ class Config:
     TEST_TIMEOUT = int(os.getenv("TEST_TIMEOUT", "30"))
     PERFORMANCE_TEST_USERS = int(os.getenv("PERFORMANCE_TEST_USERS", "10"))
     PERFORMANCE_TEST_SPAWN_RATE = int(os.getenv("PERFORMANCE_TEST_SPAWN_RATE", "1"))
+    # Locust client: "http" (requests) or "fast" (FastHttpUser / geventhttpclient)
+    PERFORMANCE_TEST_CLIENT = os.getenv("PERFORMANCE_TEST_CLIENT", "http")
+    PERFORMANCE_TEST_RUN_TIME = os.getenv("PERFORMANCE_TEST_RUN_TIME", "1m")
+    PERFORMANCE_TEST_RESULTS_DIR = os.getenv("PERFORMANCE_TEST_RESULTS_DIR", "performance-results")
+    # One JSON summary per load-test run is appended here
+    PERFORMANCE_TEST_TREND_FILE = os.getenv("PERFORMANCE_TEST_TREND_FILE", "performance-results/trend.jsonl")
+    # Task mix: "arithmetic" (the four operations, equal weights) or "realistic"
+    PERFORMANCE_TEST_MIX = os.getenv("PERFORMANCE_TEST_MIX", "arithmetic")
+    # Think time between tasks, "min,max" seconds
+    PERFORMANCE_TEST_WAIT_SECONDS = os.getenv("PERFORMANCE_TEST_WAIT_SECONDS", "1,3")
+    # Load shape from LOAD_SHAPES; empty keeps Locust's constant --users/--spawn-rate
+    LOAD_SHAPE = os.getenv("LOAD_SHAPE", "")
+
+    # Load shape options (seconds, users, users per second); see load_shapes.py
+    LOAD_SHAPES: Dict[str, Dict] = {
+        "step": {
+            "step_users": 10,
+            "step_seconds": 60,
+            "steps": 5,
+            "spawn_rate": 2,
+            "hold_seconds": 120
+        },
+        "spike": {
+            "base_users": 10,
+            "peak_users": 100,
+            "warmup_seconds": 60,
+            "spike_seconds": 60,
+            "recovery_seconds": 120,
+            "spawn_rate": 2,
+            "spike_spawn_rate": 50
+        },
+        "soak": {
+            "users": 25,
+            "ramp_seconds": 60,
+            "duration_seconds": 4 * 60 * 60
+        }
+    }
 
     # Environment specific configurations
     ENVIRONMENTS: Dict[str, Dict] = {
         "development": {
             "base_url": "http://localhost:8000",
             "timeout": 30,
-            "debug": True
+            "debug": True,
+            # Load-test targets: "default" applies to every route, "routes" overrides
+            # per Locust entry name ("Aggregated" is the total row). Latencies in ms,
+            # error_rate as a fraction, min_rps in requests per second.
+            "slo": {
+                "default": {"p95_ms": 500, "p99_ms": 1000, "error_rate": 0.01},
+                "routes": {
+                    "/token": {"p95_ms": 2000, "p99_ms": 3000},
+                    "Aggregated": {"min_rps": 1}
+                }
+            }
         },
         "staging": {
             "base_url": "http://staging-api.example.com",
             "timeout": 60,
-            "debug": False
+            "debug": False,
+            "slo": {
+                "default": {"p95_ms": 300, "p99_ms": 800, "error_rate": 0.005},
+                "routes": {
+                    "/token": {"p95_ms": 1500, "p99_ms": 2500},
+                    "Aggregated": {"min_rps": 3}
+                }
+            }
         },
         "production": {
             "base_url": "http://api.example.com",
             "timeout": 60,
-            "debug": False
+            "debug": False,
+            "slo": {
+                "default": {"p95_ms": 200, "p99_ms": 500, "error_rate": 0.001},
+                "routes": {
+                    "/token": {"p95_ms": 1000, "p99_ms": 2000},
+                    "Aggregated": {"min_rps": 3}
+                }
+            }
         }
     }
 
@@ -1,53 +1,205 @@
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy.pool import StaticPool
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncEngine, AsyncSession
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, StaticPool
+from sqlalchemy import Select, event, text
+from contextlib import asynccontextmanager
+from typing import Optional, Tuple
+import asyncio
 import os
+import tempfile
 from base import Base
 from logger import logger
+from metrics import instrument_engine
+from migrations import run_migrations, stored_version, LATEST_VERSION
+from slow_queries import attach_slow_query_log, SLOW_QUERY_THRESHOLD_MS
 
 # Get database URL from environment variable or use default
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite+aiosqlite:///./arithmetic.db")
 
-# Create engine with proper error handling
+# Log every SQL statement; off unless explicitly enabled
+SQL_ECHO = os.getenv("SQL_ECHO", "false").lower() in ("1", "true", "yes")
+
+# SQLite engine profile: "performance" (WAL, pragmas, reader pool + single writer)
+# or "legacy" (one shared connection)
+SQLITE_PROFILE = os.getenv("SQLITE_PROFILE", "performance")
+SQLITE_READ_POOL_SIZE = int(os.getenv("SQLITE_READ_POOL_SIZE", "5"))
+SQLITE_BUSY_TIMEOUT_SECONDS = float(os.getenv("SQLITE_BUSY_TIMEOUT_SECONDS", "5"))
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", str(64 * 1024)))
+
+# Schema initialization is serialized across worker processes: a pg_advisory_lock
+# on PostgreSQL, an exclusive lock on this file everywhere else
+SCHEMA_LOCK_KEY = int(os.getenv("SCHEMA_LOCK_KEY", "724101"))
+SCHEMA_LOCK_FILE = os.getenv("SCHEMA_LOCK_FILE", "")
+
 try:
-    # Configure engine based on database type
-    if DATABASE_URL.startswith("postgresql"):
+    import fcntl
+except ImportError:  # not available on Windows; workers then initialize unserialized
+    fcntl = None
+
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}",
+    f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}",
+    "PRAGMA temp_store=MEMORY",
+    f"PRAGMA busy_timeout={int(SQLITE_BUSY_TIMEOUT_SECONDS * 1000)}",
+)
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for pragma in SQLITE_PRAGMAS:
+        cursor.execute(pragma)
+    cursor.close()
+
+def _is_sqlite_file(url: str) -> bool:
+    return url.startswith("sqlite") and ":memory:" not in url and "mode=memory" not in url
+
+def create_engines(
+    url: str,
+    sqlite_profile: str = SQLITE_PROFILE,
+    echo: bool = SQL_ECHO
+) -> Tuple[AsyncEngine, Optional[AsyncEngine]]:
+    """Build the writer engine and, for tuned SQLite, a separate reader engine"""
+    if url.startswith("postgresql"):
         engine = create_async_engine(
-            DATABASE_URL,
+            url,
             pool_pre_ping=True,  # Enable connection health checks
             pool_size=5,  # Set reasonable pool size
             max_overflow=10,  # Allow some overflow connections
-            echo=True  # Enable SQL logging for debugging
+            echo=echo
         )
-    else:
-        engine = create_async_engine(
-            DATABASE_URL,
-            connect_args={"check_same_thread": False},
-            poolclass=StaticPool,
-            echo=True  # Enable SQL logging for debugging
+        return engine, None
+
+    if sqlite_profile == "performance" and _is_sqlite_file(url):
+        connect_args = {"check_same_thread": False, "timeout": SQLITE_BUSY_TIMEOUT_SECONDS}
+        # SQLite allows one writer at a time; queue writers on a one-connection pool
+        writer = create_async_engine(
+            url,
+            connect_args=connect_args,
+            poolclass=AsyncAdaptedQueuePool,
+            pool_size=1,
+            max_overflow=0,
+            echo=echo
         )
-    logger.info(f"Database engine created successfully for URL: {DATABASE_URL}")
-except Exception as e:
-    logger.error(f"Failed to create database engine: {str(e)}")
-    raise
+        # WAL lets readers run concurrently with the writer
+        reader = create_async_engine(
+            url,
+            connect_args=connect_args,
+            poolclass=AsyncAdaptedQueuePool,
+            pool_size=SQLITE_READ_POOL_SIZE,
+            max_overflow=SQLITE_READ_POOL_SIZE,
+            echo=echo
+        )
+        for sqlite_engine in (writer, reader):
+            event.listen(sqlite_engine.sync_engine, "connect", _set_sqlite_pragmas)
+        return writer, reader
 
-# Create session factory with error handling
-try:
-    SessionLocal = sessionmaker(
-        engine,
+    engine = create_async_engine(
+        url,
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+        echo=echo
+    )
+    return engine, None
+
+class RoutingSession(Session):
+    """Sends SELECTs to the reader engine and everything else to the writer.
+
+    Once a transaction has used the writer, its later SELECTs stay on the
+    writer too: a reader connection cannot see the uncommitted writes.
+    """
+
+    writer: AsyncEngine
+    reader: AsyncEngine
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        # ORM bulk inserts ask for a connection by mapper only, without a clause;
+        # text() and anything else that is not a Select may write as well
+        if not self._flushing and not self.info.get("wrote") and isinstance(clause, Select):
+            return self.reader.sync_engine
+        self.info["wrote"] = True
+        return self.writer.sync_engine
+
+@event.listens_for(RoutingSession, "after_transaction_end")
+def _reset_routing(session, transaction):
+    if transaction.parent is None:
+        session.info.pop("wrote", None)
+
+def create_session_factory(engine: AsyncEngine, read_engine: Optional[AsyncEngine] = None):
+    options = dict(
         class_=AsyncSession,
         expire_on_commit=False,
         autocommit=False,
         autoflush=False
     )
-    logger.info("Session factory created successfully")
-except Exception as e:
-    logger.error(f"Failed to create session factory: {str(e)}")
-    raise
+    if read_engine is None:
+        return sessionmaker(engine, **options)
+
+    routing_session = type(
+        "AppRoutingSession", (RoutingSession,), {"writer": engine, "reader": read_engine}
+    )
+    return sessionmaker(sync_session_class=routing_session, **options)
+
+# Engines and the session factory are created on first use, so importing this
+# module stays cheap and free of side effects
+_engines: Optional[Tuple[AsyncEngine, Optional[AsyncEngine]]] = None
+_session_factory = None
+
+def get_engines() -> Tuple[AsyncEngine, Optional[AsyncEngine]]:
+    """The writer engine and the optional reader engine for DATABASE_URL"""
+    global _engines
+    if _engines is not None:
+        return _engines
+
+    # Create engine with proper error handling
+    try:
+        engine, read_engine = create_engines(DATABASE_URL)
+        instrument_engine(engine, "primary")
+        if read_engine is not None:
+            instrument_engine(read_engine, "reader")
+        if SLOW_QUERY_THRESHOLD_MS > 0:
+            attach_slow_query_log(engine, "primary")
+            if read_engine is not None:
+                attach_slow_query_log(read_engine, "reader")
+        logger.info(
+            f"Database engine created successfully for URL: {DATABASE_URL}",
+            read_pool=read_engine is not None
+        )
+    except Exception as e:
+        logger.error(f"Failed to create database engine: {str(e)}")
+        raise
+    _engines = (engine, read_engine)
+    return _engines
+
+def get_session_factory():
+    global _session_factory
+    if _session_factory is None:
+        # Create session factory with error handling
+        try:
+            _session_factory = create_session_factory(*get_engines())
+            logger.info("Session factory created successfully")
+        except Exception as e:
+            logger.error(f"Failed to create session factory: {str(e)}")
+            raise
+    return _session_factory
+
+def new_session() -> AsyncSession:
+    return get_session_factory()()
+
+def __getattr__(name: str):
+    # Keeps `from database import engine, read_engine, SessionLocal` working, lazily
+    if name == "engine":
+        return get_engines()[0]
+    if name == "read_engine":
+        return get_engines()[1]
+    if name == "SessionLocal":
+        return get_session_factory()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 async def get_db():
     """Get database session with error handling"""
-    async with SessionLocal() as session:
+    async with new_session() as session:
         try:
             yield session
         except Exception as e:
@@ -57,13 +209,71 @@ async def get_db():
         finally:
             await session.close()
 
+def _schema_lock_path(url: str) -> str:
+    if SCHEMA_LOCK_FILE:
+        return SCHEMA_LOCK_FILE
+    if _is_sqlite_file(url):
+        return url.split("///", 1)[-1] + ".init.lock"
+    return os.path.join(tempfile.gettempdir(), "arithmetic-schema.lock")
+
+@asynccontextmanager
+async def schema_lock(engine: AsyncEngine):
+    """Hold an inter-process lock while the schema is created or migrated"""
+    if engine.dialect.name == "postgresql":
+        async with engine.connect() as conn:
+            await conn.execute(text("SELECT pg_advisory_lock(:key)"), {"key": SCHEMA_LOCK_KEY})
+            try:
+                yield
+            finally:
+                await conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": SCHEMA_LOCK_KEY})
+        return
+
+    if fcntl is None:
+        yield
+        return
+    with open(_schema_lock_path(str(engine.url)), "a") as lock_file:
+        # Blocks until the worker holding the lock is done, so wait off the event loop
+        await asyncio.get_running_loop().run_in_executor(None, fcntl.flock, lock_file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+async def warm_up_pool() -> None:
+    """Open every pooled connection once so the first requests skip connect and pragma setup"""
+    for pool_engine in get_engines():
+        if pool_engine is None:
+            continue
+        size = pool_engine.sync_engine.pool.size() if hasattr(pool_engine.sync_engine.pool, "size") else 1
+
+        async def ping():
+            async with pool_engine.connect() as conn:
+                await conn.execute(text("SELECT 1"))
+
+        await asyncio.gather(*(ping() for _ in range(size)))
+
 async def init_db():
     """Initialize database and create tables safely"""
+    engine = get_engines()[0]
     try:
-        async with engine.begin() as conn:
-            # Only create tables if they don't exist
-            await conn.run_sync(Base.metadata.create_all)
-            logger.info("Database tables created successfully")
+        # Nothing to do when the stored schema version is current (so new tables
+        # and indexes must come with a migration, not only a model change)
+        async with engine.connect() as conn:
+            version = await stored_version(conn)
+        if version == LATEST_VERSION:
+            logger.info("Database schema up to date", schema_version=version)
+            return
+
+        # With several workers only one initializes at a time; the rest find it done
+        async with schema_lock(engine):
+            async with engine.begin() as conn:
+                # Only create tables if they don't exist
+                await conn.run_sync(Base.metadata.create_all)
+                logger.info("Database tables created successfully")
+
+            # create_all never alters existing tables; migrations bring them up to date
+            version = await run_migrations(engine)
+        logger.info("Database schema up to date", schema_version=version)
     except Exception as e:
         logger.error(f"Error initializing database: {str(e)}")
         raise
@@ -71,7 +281,7 @@ async def init_db():
 async def drop_db():
     """Drop all tables (for testing only)"""
     try:
-        async with engine.begin() as conn:
+        async with get_engines()[0].begin() as conn:
             await conn.run_sync(Base.metadata.drop_all)
             logger.info("Database tables dropped successfully")
     except Exception as e:
@@ -0,0 +1,303 @@
+import asyncio
+import base64
+import hashlib
+import os
+import secrets
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+from fastapi import HTTPException
+from sqlalchemy import Select, func, insert, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import OperationHistory, OperationStats
+from database import new_session
+from cache import TTLCache
+from stats import update_operation_stats
+from logger import logger
+
+# Write-behind configuration: when enabled, arithmetic handlers enqueue history
+# rows and a background task bulk-inserts them instead of committing per request
+HISTORY_WRITE_BEHIND = os.getenv("HISTORY_WRITE_BEHIND", "false").lower() in ("1", "true", "yes")
+HISTORY_BATCH_SIZE = int(os.getenv("HISTORY_BATCH_SIZE", "500"))
+HISTORY_FLUSH_INTERVAL_SECONDS = float(os.getenv("HISTORY_FLUSH_INTERVAL_SECONDS", "0.05"))
+HISTORY_QUEUE_SIZE = int(os.getenv("HISTORY_QUEUE_SIZE", "10000"))
+HISTORY_ENQUEUE_TIMEOUT_SECONDS = float(os.getenv("HISTORY_ENQUEUE_TIMEOUT_SECONDS", "1.0"))
+# A failed flush is retried with doubling delays before its rows are given up;
+# the queue fills meanwhile, so new requests get 503 instead of losing rows
+HISTORY_FLUSH_RETRIES = int(os.getenv("HISTORY_FLUSH_RETRIES", "5"))
+HISTORY_FLUSH_RETRY_DELAY_SECONDS = float(os.getenv("HISTORY_FLUSH_RETRY_DELAY_SECONDS", "0.1"))
+
+# /history paging configuration
+HISTORY_MAX_PAGE_SIZE = int(os.getenv("HISTORY_MAX_PAGE_SIZE", "1000"))
+HISTORY_STREAM_CHUNK_SIZE = int(os.getenv("HISTORY_STREAM_CHUNK_SIZE", "500"))
+
+# Source of the per-user versions behind /history ETags: "database" derives the
+# version from the operation_stats rollups (one small query, correct with any
+# number of workers or replicas); "process" counts writes in this worker's memory
+# (a conditional poll needs no database access, but only this process's writes
+# are seen, so it is only safe with a single server process)
+HISTORY_VERSION_SOURCE = os.getenv("HISTORY_VERSION_SOURCE", "database")
+# Serialized /history pages (requests with ?limit only) kept per ETag; opt-in
+HISTORY_RESPONSE_CACHE_SIZE = int(os.getenv("HISTORY_RESPONSE_CACHE_SIZE", "0"))
+HISTORY_RESPONSE_CACHE_TTL_SECONDS = float(os.getenv("HISTORY_RESPONSE_CACHE_TTL_SECONDS", "60"))
+
+_STOP = object()
+
+async def persist_operations(db: AsyncSession, rows: List[dict]) -> None:
+    """Insert OperationHistory rows in one statement and update the rollups (caller commits)"""
+    if rows:
+        now = datetime.utcnow()
+        for row in rows:
+            # Stamp here rather than via the column default so the rollup sees it too
+            row.setdefault("timestamp", now)
+        await db.execute(insert(OperationHistory), rows)
+        await update_operation_stats(db, rows)
+
+class HistoryWriter:
+    """Background flusher that batches OperationHistory inserts"""
+
+    def __init__(
+        self,
+        session_factory: Callable[[], AsyncSession],
+        batch_size: int = HISTORY_BATCH_SIZE,
+        flush_interval: float = HISTORY_FLUSH_INTERVAL_SECONDS,
+        queue_size: int = HISTORY_QUEUE_SIZE,
+        enqueue_timeout: float = HISTORY_ENQUEUE_TIMEOUT_SECONDS,
+        flush_retries: int = HISTORY_FLUSH_RETRIES,
+        retry_delay: float = HISTORY_FLUSH_RETRY_DELAY_SECONDS
+    ):
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue_size = queue_size
+        self.enqueue_timeout = enqueue_timeout
+        self.flush_retries = flush_retries
+        self.retry_delay = retry_delay
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self.flushed_rows = 0
+        self.failed_rows = 0
+        self.retried_flushes = 0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def queue_depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def start(self) -> None:
+        if self.running:
+            return
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._task = asyncio.create_task(self._run())
+        logger.info(
+            "History write-behind started",
+            batch_size=self.batch_size,
+            flush_interval=self.flush_interval,
+            queue_size=self.queue_size
+        )
+
+    async def stop(self) -> None:
+        """Flush everything still queued and stop the background task"""
+        if not self.running:
+            return
+        await self._queue.put(_STOP)
+        await self._task
+        self._task = None
+        logger.info("History write-behind stopped", flushed_rows=self.flushed_rows)
+
+    async def submit(self, row: dict) -> None:
+        """Queue a row, waiting for space when the queue is full (backpressure)"""
+        try:
+            await asyncio.wait_for(self._queue.put(row), timeout=self.enqueue_timeout)
+        except asyncio.TimeoutError:
+            raise HTTPException(
+                status_code=503,
+                detail="Operation history queue is full, retry later",
+                headers={"Retry-After": "1"}
+            )
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            if item is _STOP:
+                break
+            batch = [item]
+            deadline = loop.time() + self.flush_interval
+            while True:
+                # get_nowait never loses an item the way a timed-out
+                # wait_for(queue.get()) can when both complete together
+                while len(batch) < self.batch_size and not stopping:
+                    try:
+                        item = self._queue.get_nowait()
+                    except asyncio.QueueEmpty:
+                        break
+                    if item is _STOP:
+                        stopping = True
+                    else:
+                        batch.append(item)
+                remaining = deadline - loop.time()
+                if stopping or len(batch) >= self.batch_size or remaining <= 0:
+                    break
+                await asyncio.sleep(remaining)
+            await self._flush(batch)
+
+    async def _flush(self, batch: List[dict]) -> None:
+        """Insert a batch, retrying with backoff; the rows were already acknowledged"""
+        for attempt in range(self.flush_retries + 1):
+            try:
+                async with self.session_factory() as session:
+                    await persist_operations(session, batch)
+                    await session.commit()
+                history_versions.bump(row["user_id"] for row in batch)
+                self.flushed_rows += len(batch)
+                return
+            except Exception as e:
+                if attempt == self.flush_retries:
+                    self.failed_rows += len(batch)
+                    logger.error(
+                        "Error flushing operation history, rows lost",
+                        rows=len(batch),
+                        attempts=attempt + 1,
+                        error=str(e)
+                    )
+                    return
+                self.retried_flushes += 1
+                delay = self.retry_delay * 2 ** attempt
+                logger.warning(
+                    "Error flushing operation history, retrying",
+                    rows=len(batch),
+                    attempt=attempt + 1,
+                    retry_in=delay,
+                    error=str(e)
+                )
+                await asyncio.sleep(delay)
+
+class HistoryVersions:
+    """Per-user history versions, bumped after every committed OperationHistory write.
+
+    Process counters start from zero in every worker, so they are qualified
+    with a random boot nonce: ETags issued before a restart never match again.
+    """
+
+    def __init__(self, source: str = HISTORY_VERSION_SOURCE):
+        self.source = source
+        self.nonce = secrets.token_hex(8)
+        self._versions: Dict[int, int] = {}
+
+    def bump(self, user_ids: Iterable[int]) -> None:
+        for user_id in set(user_ids):
+            self._versions[user_id] = self._versions.get(user_id, 0) + 1
+
+    async def current(self, db: AsyncSession, user_id: int) -> str:
+        if self.source == "database":
+            # The rollups are updated in the same transaction as every insert
+            result = await db.execute(
+                select(func.coalesce(func.sum(OperationStats.count), 0), func.max(OperationStats.last_timestamp))
+                .where(OperationStats.user_id == user_id)
+            )
+            count, last_timestamp = result.one()
+            return f"{count}.{last_timestamp.isoformat() if last_timestamp else ''}"
+        return f"{self.nonce}.{self._versions.get(user_id, 0)}"
+
+    def etag(self, version: str, user_id: int, variant: str) -> str:
+        """Weak ETag for one user's history at ``version``, per query variant"""
+        digest = hashlib.blake2b(f"{user_id}|{version}|{variant}".encode(), digest_size=12).hexdigest()
+        return f'W/"{digest}"'
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = {candidate.strip() for candidate in if_none_match.split(",")}
+    # Weak comparison: W/"x" and "x" refer to the same representation
+    return "*" in candidates or etag in candidates or etag[2:] in candidates
+
+history_versions = HistoryVersions()
+
+# Serialized /history pages keyed by ETag: (body, X-Next-Cursor or None). Only
+# paged responses are cached, so an entry is at most HISTORY_MAX_PAGE_SIZE rows
+history_response_cache = TTLCache(
+    maxsize=HISTORY_RESPONSE_CACHE_SIZE,
+    ttl=HISTORY_RESPONSE_CACHE_TTL_SECONDS
+)
+
+history_writer = HistoryWriter(new_session)
+
+def operation_row(
+    user_id: int,
+    operation: str,
+    num1: float,
+    num2: float,
+    result: float,
+    timestamp: Optional[datetime] = None
+) -> dict:
+    return {
+        "operation": operation,
+        "num1": num1,
+        "num2": num2,
+        "result": result,
+        "user_id": user_id,
+        "timestamp": timestamp or datetime.utcnow(),
+    }
+
+async def record_operation(
+    db: AsyncSession,
+    user_id: int,
+    operation: str,
+    num1: float,
+    num2: float,
+    result: float
+) -> None:
+    """Persist one arithmetic operation, via the write-behind queue when running"""
+    row = operation_row(user_id, operation, num1, num2, result)
+    if history_writer.running:
+        await history_writer.submit(row)
+    else:
+        await persist_operations(db, [row])
+        await db.commit()
+        history_versions.bump([user_id])
+
+def encode_cursor(operation: OperationHistory) -> str:
+    """Opaque keyset cursor pointing just past the given row"""
+    raw = f"{operation.timestamp.isoformat()}|{operation.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        timestamp, operation_id = base64.urlsafe_b64decode(padded).decode().split("|")
+        return datetime.fromisoformat(timestamp), int(operation_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid history cursor")
+
+def history_query(
+    user_id: int,
+    cursor: Optional[str] = None,
+    limit: Optional[int] = None
+) -> Select:
+    """Newest-first history for a user, keyset-paginated on (timestamp, id)"""
+    query = (
+        select(OperationHistory)
+        .where(OperationHistory.user_id == user_id)
+        .order_by(OperationHistory.timestamp.desc(), OperationHistory.id.desc())
+    )
+    if cursor:
+        query = query.where(
+            tuple_(OperationHistory.timestamp, OperationHistory.id) < decode_cursor(cursor)
+        )
+    if limit:
+        query = query.limit(limit)
+    return query
+
+def history_item(operation: OperationHistory) -> dict:
+    return {
+        "id": operation.id,
+        "operation": operation.operation,
+        "num1": operation.num1,
+        "num2": operation.num2,
+        "result": operation.result,
+        "timestamp": operation.timestamp.isoformat() if operation.timestamp else None,
+        "user_id": operation.user_id,
+    }
@@ -0,0 +1,223 @@
+"""Headless Locust runner with per-environment SLO gates.
+
+Starts a local API server (unless --host points at a running one), seeds the
+load-test accounts, runs performance_test.py headless with the users, spawn
+rate and run time from Config, turns Locust's CSV stats into a report,
+appends a summary line to the trend file and exits with status 1 when a route
+misses a target from ``Config.ENVIRONMENTS[ENV]["slo"]``.
+
+Usage:
+    python load_runner.py
+    python load_runner.py --host http://localhost:8000 --run-time 5m --users 50
+"""
+import argparse
+import csv
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import requests
+from config import Config
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+SERVER_STARTUP_TIMEOUT_SECONDS = 60
+
+def start_server(port: int, workdir: str) -> subprocess.Popen:
+    """Run the API with uvicorn on a fresh SQLite database and wait until it answers"""
+    env = dict(os.environ)
+    env.setdefault("DATABASE_URL", f"sqlite+aiosqlite:///{os.path.join(workdir, 'loadtest.db')}")
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "apiserver:app", "--port", str(port), "--log-level", "warning"],
+        env=env,
+        stdout=open(os.path.join(workdir, "server.log"), "w"),
+        stderr=subprocess.STDOUT
+    )
+    deadline = time.monotonic() + SERVER_STARTUP_TIMEOUT_SECONDS
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"API server exited with status {server.returncode}")
+        try:
+            requests.get(f"http://127.0.0.1:{port}/openapi.json", timeout=1)
+            return server
+        except requests.ConnectionError:
+            time.sleep(0.5)
+    server.terminate()
+    raise RuntimeError("API server did not start in time")
+
+def run_locust(
+    host: str,
+    users: int,
+    spawn_rate: int,
+    run_time: Optional[str],
+    csv_prefix: str,
+    env: dict
+) -> int:
+    command = [
+        sys.executable, "-m", "locust",
+        "-f", "performance_test.py",
+        "--headless",
+        "--host", host,
+        "--users", str(users),
+        "--spawn-rate", str(spawn_rate),
+        "--csv", csv_prefix,
+        "--only-summary",
+        "--loglevel", "WARNING",
+    ]
+    if run_time:
+        command += ["--run-time", run_time]
+    logger.info(f"Running {' '.join(command[2:])}")
+    return subprocess.run(command, env=env).returncode
+
+def _number(value: str) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+def parse_stats(stats_csv: str) -> Dict[str, dict]:
+    """Per-route summary from Locust's <prefix>_stats.csv"""
+    routes = {}
+    with open(stats_csv, newline="") as f:
+        for row in csv.DictReader(f):
+            requests_count = int(_number(row["Request Count"]))
+            failures = int(_number(row["Failure Count"]))
+            name = row["Name"] if row["Name"] == "Aggregated" else f"{row['Type']} {row['Name']}".strip()
+            routes[name] = {
+                "requests": requests_count,
+                "failures": failures,
+                "error_rate": failures / requests_count if requests_count else 0.0,
+                "rps": _number(row["Requests/s"]),
+                "avg_ms": _number(row["Average Response Time"]),
+                "p50_ms": _number(row["50%"]),
+                "p95_ms": _number(row["95%"]),
+                "p99_ms": _number(row["99%"]),
+                "max_ms": _number(row["Max Response Time"]),
+            }
+    return routes
+
+def route_targets(slo: dict, name: str) -> dict:
+    """Default targets overlaid with those for the route, matched with or without the method"""
+    overrides = slo.get("routes", {})
+    path = name.split(" ", 1)[-1]
+    return {**slo.get("default", {}), **overrides.get(path, {}), **overrides.get(name, {})}
+
+def check_slos(routes: Dict[str, dict], slo: dict) -> List[str]:
+    breaches = []
+    for name, stats in routes.items():
+        targets = route_targets(slo, name)
+        for metric in ("p50_ms", "p95_ms", "p99_ms"):
+            if metric in targets and stats[metric] > targets[metric]:
+                breaches.append(f"{name}: {metric} {stats[metric]:.0f} > {targets[metric]}")
+        if "error_rate" in targets and stats["error_rate"] > targets["error_rate"]:
+            breaches.append(f"{name}: error rate {stats['error_rate']:.2%} > {targets['error_rate']:.2%}")
+        if "min_rps" in targets and stats["rps"] < targets["min_rps"]:
+            breaches.append(f"{name}: {stats['rps']:.1f} req/s < {targets['min_rps']}")
+    return breaches
+
+def print_report(routes: Dict[str, dict]) -> None:
+    print(f"\n{'route':28s} {'reqs':>7s} {'errors':>7s} {'req/s':>8s} {'p50':>6s} {'p95':>6s} {'p99':>6s} {'max':>7s}")
+    for name, stats in routes.items():
+        print(f"{name:28s} {stats['requests']:7d} {stats['error_rate']:7.2%} {stats['rps']:8.1f} "
+              f"{stats['p50_ms']:6.0f} {stats['p95_ms']:6.0f} {stats['p99_ms']:6.0f} {stats['max_ms']:7.0f}")
+
+def _git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def append_trend(path: str, summary: dict) -> None:
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "a") as f:
+        f.write(json.dumps(summary) + "\n")
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Headless Locust run with SLO gates")
+    parser.add_argument("--host", help="target a running server instead of starting one")
+    parser.add_argument("--port", type=int, default=8001, help="port for the local server")
+    parser.add_argument("--users", type=int, default=Config.PERFORMANCE_TEST_USERS)
+    parser.add_argument("--spawn-rate", type=int, default=Config.PERFORMANCE_TEST_SPAWN_RATE)
+    parser.add_argument("--run-time", help="defaults to PERFORMANCE_TEST_RUN_TIME, or the load shape's own length")
+    parser.add_argument("--results-dir", default=Config.PERFORMANCE_TEST_RESULTS_DIR)
+    parser.add_argument("--trend-file", default=Config.PERFORMANCE_TEST_TREND_FILE)
+    args = parser.parse_args(argv)
+
+    # Imported here so `python load_runner.py --help` does not need Locust's gevent patching
+    from performance_test import seed_user_pool, LoadShape
+
+    users, run_time = args.users, args.run_time
+    if LoadShape is not None:
+        # The shape drives the user count and decides when the run ends
+        users = LoadShape().max_users
+    elif run_time is None:
+        run_time = Config.PERFORMANCE_TEST_RUN_TIME
+
+    slo = Config.get_config().get("slo", {})
+    started_at = datetime.utcnow()
+    os.makedirs(args.results_dir, exist_ok=True)
+    csv_prefix = os.path.join(args.results_dir, f"locust_{started_at.strftime('%Y%m%dT%H%M%S')}")
+
+    with tempfile.TemporaryDirectory() as workdir:
+        server = None
+        host = args.host
+        if host is None:
+            server = start_server(args.port, workdir)
+            host = f"http://127.0.0.1:{args.port}"
+        try:
+            pool_file = os.path.join(workdir, "users.json")
+            seed_user_pool(host, users, pool_file)
+            env = dict(os.environ, USER_POOL_FILE=pool_file)
+            locust_status = run_locust(host, users, args.spawn_rate, run_time, csv_prefix, env)
+        finally:
+            if server is not None:
+                server.terminate()
+                server.wait(timeout=30)
+
+    # Locust also exits non-zero when any request failed; the SLO check decides below
+    stats_csv = f"{csv_prefix}_stats.csv"
+    if not os.path.exists(stats_csv):
+        logger.error(f"Locust exited with status {locust_status} without writing {stats_csv}")
+        return 1
+
+    routes = parse_stats(stats_csv)
+    breaches = check_slos(routes, slo)
+    print_report(routes)
+
+    summary = {
+        "timestamp": started_at.isoformat(),
+        "environment": Config.ENV,
+        "revision": _git_revision(),
+        "client": Config.PERFORMANCE_TEST_CLIENT,
+        "mix": Config.PERFORMANCE_TEST_MIX,
+        "shape": Config.LOAD_SHAPE or None,
+        "users": users,
+        "spawn_rate": args.spawn_rate,
+        "run_time": run_time,
+        "routes": routes,
+        "breaches": breaches,
+        "passed": not breaches,
+    }
+    with open(f"{csv_prefix}_report.json", "w") as f:
+        json.dump(summary, f, indent=2)
+    append_trend(args.trend_file, summary)
+
+    if breaches:
+        print(f"\nSLO breaches for environment '{Config.ENV}':")
+        for line in breaches:
+            print(f"  {line}")
+        return 1
+    print(f"\nAll routes within the '{Config.ENV}' targets")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
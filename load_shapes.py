@@ -0,0 +1,113 @@
+"""Load shapes for performance_test.py, selected with LOAD_SHAPE.
+
+Each shape is a list of stages, built from ``Config.LOAD_SHAPES[<name>]``
+(override single options with LOAD_SHAPE_OPTIONS, e.g. '{"peak_users": 300}').
+Locust uses the first LoadTestShape subclass it finds in the locustfile, so
+performance_test.py imports this module rather than the classes and exposes
+only the selected one.
+"""
+import json
+import os
+from typing import Dict, List, Optional, Type
+from locust import LoadTestShape
+from config import Config
+
+# JSON object overriding options of the selected shape
+LOAD_SHAPE_OPTIONS = os.getenv("LOAD_SHAPE_OPTIONS", "")
+
+def shape_options(name: str) -> Dict:
+    options = dict(Config.LOAD_SHAPES.get(name, {}))
+    if LOAD_SHAPE_OPTIONS:
+        options.update(json.loads(LOAD_SHAPE_OPTIONS))
+    return options
+
+class StagesShape(LoadTestShape):
+    """Runs through stages of {"until": seconds since start, "users", "spawn_rate"} and then stops"""
+
+    name = ""
+
+    def __init__(self):
+        super().__init__()
+        self.options = shape_options(self.name)
+        self.stages = self.build_stages(self.options)
+
+    def build_stages(self, options: Dict) -> List[Dict]:
+        return options["stages"]
+
+    @property
+    def max_users(self) -> int:
+        return max(stage["users"] for stage in self.stages)
+
+    @property
+    def duration(self) -> float:
+        return self.stages[-1]["until"]
+
+    def tick(self):
+        run_time = self.get_run_time()
+        for stage in self.stages:
+            if run_time < stage["until"]:
+                return stage["users"], stage["spawn_rate"]
+        return None
+
+class StepLoadShape(StagesShape):
+    """Adds ``step_users`` every ``step_seconds`` for ``steps`` steps, then holds the peak"""
+
+    name = "step"
+
+    def build_stages(self, options: Dict) -> List[Dict]:
+        stages = [
+            {
+                "until": options["step_seconds"] * (step + 1),
+                "users": options["step_users"] * (step + 1),
+                "spawn_rate": options["spawn_rate"],
+            }
+            for step in range(options["steps"])
+        ]
+        stages[-1]["until"] += options.get("hold_seconds", 0)
+        return stages
+
+class SpikeLoadShape(StagesShape):
+    """Steady base load, a sudden jump to ``peak_users``, then recovery at the base load"""
+
+    name = "spike"
+
+    def build_stages(self, options: Dict) -> List[Dict]:
+        warmup = options["warmup_seconds"]
+        spike_end = warmup + options["spike_seconds"]
+        return [
+            {"until": warmup, "users": options["base_users"], "spawn_rate": options["spawn_rate"]},
+            {"until": spike_end, "users": options["peak_users"], "spawn_rate": options["spike_spawn_rate"]},
+            {
+                "until": spike_end + options["recovery_seconds"],
+                "users": options["base_users"],
+                "spawn_rate": options["spike_spawn_rate"],
+            },
+        ]
+
+class SoakLoadShape(StagesShape):
+    """Constant ``users`` for a long ``duration_seconds`` after a gentle ramp"""
+
+    name = "soak"
+
+    def build_stages(self, options: Dict) -> List[Dict]:
+        users = options["users"]
+        return [{
+            "until": options["duration_seconds"],
+            "users": users,
+            "spawn_rate": users / max(1, options["ramp_seconds"]),
+        }]
+
+SHAPES: Dict[str, Type[StagesShape]] = {
+    shape.name: shape for shape in (StepLoadShape, SpikeLoadShape, SoakLoadShape)
+}
+
+def get_shape_class(name: str) -> Optional[Type[StagesShape]]:
+    """Shape class for LOAD_SHAPE, or None for Locust's constant --users/--spawn-rate"""
+    if not name:
+        return None
+    if name in SHAPES:
+        return SHAPES[name]
+    if "stages" in Config.LOAD_SHAPES.get(name, {}):
+        # Custom shapes defined as explicit stages in Config.LOAD_SHAPES
+        return type(f"{name.title()}LoadShape", (StagesShape,), {"name": name})
+    raise ValueError(f"Unknown load shape '{name}', expected one of {sorted(Config.LOAD_SHAPES)}")
@@ -0,0 +1,234 @@
+import math
+import os
+import time
+from typing import Callable, Dict, Optional
+from fastapi.responses import JSONResponse
+from auth import decode_access_token
+from metrics import registry
+from logger import logger
+
+# Fail fast with 503/429 instead of queueing once a route class is saturated (opt-in)
+LOAD_SHEDDING_ENABLED = os.getenv("LOAD_SHEDDING_ENABLED", "false").lower() in ("1", "true", "yes")
+# Upper bound of the adaptive in-flight limit per route class
+CONCURRENCY_LIMITS = os.getenv("CONCURRENCY_LIMITS", "auth=32,compute=256,history=64")
+CONCURRENCY_MIN_LIMIT = int(os.getenv("CONCURRENCY_MIN_LIMIT", "2"))
+# The limit shrinks while requests of the class complete slower than this
+LATENCY_TARGETS_MS = os.getenv("LATENCY_TARGETS_MS", "auth=1000,compute=100,history=250")
+# Per-client token buckets as "<class>=<requests per second>:<burst>"; empty disables
+RATE_LIMITS = os.getenv("RATE_LIMITS", "")
+SHED_RETRY_AFTER_SECONDS = int(os.getenv("SHED_RETRY_AFTER_SECONDS", "1"))
+
+# Request paths guarded by each limiter; everything else passes through
+ROUTE_CLASSES = {
+    "/token": "auth",
+    "/token/refresh": "auth",
+    "/register": "auth",
+    "/add": "compute",
+    "/subtract": "compute",
+    "/multiply": "compute",
+    "/root": "compute",
+    "/batch": "compute",
+    "/history": "history",
+    "/history/stats": "history",
+}
+
+requests_shed = registry.counter(
+    "requests_shed_total", "Requests rejected by load shedding", ("route_class", "reason")
+)
+concurrency_limit_gauge = registry.gauge(
+    "concurrency_limit", "Adaptive in-flight request limit", ("route_class",)
+)
+concurrency_in_flight_gauge = registry.gauge(
+    "concurrency_in_flight", "Requests in flight per limited route class", ("route_class",)
+)
+
+def parse_class_values(spec: str, cast: Callable[[str], object] = float) -> Dict[str, object]:
+    """"auth=32,compute=256" -> {"auth": 32, "compute": 256}"""
+    values = {}
+    for part in spec.split(","):
+        name, _, value = part.partition("=")
+        if name.strip() and value.strip():
+            values[name.strip()] = cast(value.strip())
+    return values
+
+class AIMDLimiter:
+    """Concurrency limit with additive increase and multiplicative decrease.
+
+    Every request whose first response byte comes within ``target_latency``
+    while the limit is at least half used raises it by 1/limit (about +1 per
+    limit's worth of requests); a slow or overloaded one multiplies it by
+    ``backoff``, at most once per ``target_latency`` so one burst of slow
+    requests counts once.
+    """
+
+    def __init__(
+        self,
+        max_limit: int,
+        target_latency: float,
+        min_limit: int = CONCURRENCY_MIN_LIMIT,
+        backoff: float = 0.9
+    ):
+        self.max_limit = max_limit
+        self.min_limit = min(min_limit, max_limit)
+        self.target_latency = target_latency
+        self.backoff = backoff
+        self.limit = float(max_limit)
+        self.in_flight = 0
+        self._last_decrease = 0.0
+
+    def try_acquire(self) -> bool:
+        if self.in_flight >= int(self.limit):
+            return False
+        self.in_flight += 1
+        return True
+
+    def release(self, latency: float, overloaded: bool = False) -> None:
+        in_flight = self.in_flight
+        self.in_flight -= 1
+        if overloaded or latency > self.target_latency:
+            now = time.monotonic()
+            if now - self._last_decrease >= self.target_latency:
+                self._last_decrease = now
+                self.limit = max(self.min_limit, self.limit * self.backoff)
+        elif in_flight * 2 >= self.limit:
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+class TokenBuckets:
+    """Per-client token buckets refilled at ``rate`` tokens per second up to ``burst``"""
+
+    MAX_TRACKED_CLIENTS = 10000
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self._buckets: Dict[str, list] = {}
+
+    def take(self, client: str) -> float:
+        """Spend one token; returns 0 when allowed, else the seconds until one is available"""
+        now = time.monotonic()
+        bucket = self._buckets.get(client)
+        if bucket is None:
+            if len(self._buckets) >= self.MAX_TRACKED_CLIENTS:
+                self._buckets.clear()
+            bucket = self._buckets[client] = [float(self.burst), now]
+        tokens = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+        bucket[1] = now
+        if tokens < 1:
+            bucket[0] = tokens
+            return (1 - tokens) / self.rate
+        bucket[0] = tokens - 1
+        return 0.0
+
+def default_limiters() -> Dict[str, AIMDLimiter]:
+    targets = parse_class_values(LATENCY_TARGETS_MS)
+    return {
+        name: AIMDLimiter(int(limit), targets.get(name, 1000) / 1000)
+        for name, limit in parse_class_values(CONCURRENCY_LIMITS).items()
+    }
+
+def default_quotas() -> Dict[str, TokenBuckets]:
+    quotas = {}
+    for name, value in parse_class_values(RATE_LIMITS, str).items():
+        rate, _, burst = value.partition(":")
+        quotas[name] = TokenBuckets(float(rate), int(burst or max(1, math.ceil(float(rate)))))
+    return quotas
+
+def client_key(scope) -> str:
+    """The bearer token's subject when it verifies, otherwise the client address"""
+    for name, value in scope.get("headers", ()):
+        if name == b"authorization":
+            scheme, _, token = value.decode("latin-1").partition(" ")
+            if scheme.lower() == "bearer" and token:
+                try:
+                    # Verified claims are cached, so this is a dictionary lookup after the first request
+                    subject = decode_access_token(token).get("sub")
+                except Exception:
+                    subject = None
+                if subject:
+                    return f"user:{subject}"
+            break
+    client = scope.get("client")
+    return f"ip:{client[0]}" if client else "ip:unknown"
+
+class LoadSheddingMiddleware:
+    """ASGI middleware applying per-route-class concurrency limits and client quotas.
+
+    Each class (auth, compute, history) has its own limiter, so a login storm
+    saturating bcrypt only sheds auth requests. Requests over a client's quota
+    get 429, requests over the class's concurrency limit get 503; both carry
+    Retry-After and are rejected before any work is done.
+    """
+
+    def __init__(
+        self,
+        app,
+        limiters: Optional[Dict[str, AIMDLimiter]] = None,
+        quotas: Optional[Dict[str, TokenBuckets]] = None,
+        route_classes: Optional[Dict[str, str]] = None
+    ):
+        self.app = app
+        self.limiters = default_limiters() if limiters is None else limiters
+        self.quotas = default_quotas() if quotas is None else quotas
+        self.route_classes = ROUTE_CLASSES if route_classes is None else route_classes
+        registry.add_collector(self.collect)
+
+    def collect(self) -> None:
+        for name, limiter in self.limiters.items():
+            concurrency_limit_gauge.set(int(limiter.limit), name)
+            concurrency_in_flight_gauge.set(limiter.in_flight, name)
+
+    async def _reject(self, scope, receive, send, route_class: str, status_code: int, retry_after: float):
+        reason = "quota" if status_code == 429 else "concurrency"
+        requests_shed.inc(route_class, reason)
+        detail = "Rate limit exceeded" if status_code == 429 else "Server is overloaded, retry later"
+        logger.info(
+            "Request shed",
+            route_class=route_class,
+            reason=reason,
+            path=scope["path"]
+        )
+        response = JSONResponse(
+            status_code=status_code,
+            content={"error": detail, "status_code": status_code},
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))}
+        )
+        await response(scope, receive, send)
+
+    async def __call__(self, scope, receive, send):
+        route_class = self.route_classes.get(scope["path"]) if scope["type"] == "http" else None
+        if route_class is None:
+            await self.app(scope, receive, send)
+            return
+
+        quota = self.quotas.get(route_class)
+        if quota is not None:
+            wait = quota.take(client_key(scope))
+            if wait:
+                await self._reject(scope, receive, send, route_class, 429, wait)
+                return
+
+        limiter = self.limiters.get(route_class)
+        if limiter is None:
+            await self.app(scope, receive, send)
+            return
+        if not limiter.try_acquire():
+            await self._reject(scope, receive, send, route_class, 503, SHED_RETRY_AFTER_SECONDS)
+            return
+
+        status = {"code": 500, "first_byte": None}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                status["first_byte"] = time.perf_counter()
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # Time to first byte: a long NDJSON stream or a large body is not a
+            # sign of overload, only a slow start is
+            latency = (status["first_byte"] or time.perf_counter()) - started
+            # A 503 from the handler (e.g. a full history queue) is an overload signal too
+            limiter.release(latency, overloaded=status["code"] == 503)
@@ -1,16 +1,35 @@
+import atexit
+import gzip
 import logging
+import queue
+import shutil
 import structlog
 import os
+import sys
+import threading
+import time
 from datetime import datetime
 from logging.handlers import RotatingFileHandler
-from typing import Dict, Any
-
-# Create logs directory if it doesn't exist
-os.makedirs("logs", exist_ok=True)
+from typing import Callable, Dict, Any, List, Optional, TextIO
 
 # Get environment
 ENV = os.getenv("ENV", "development")
 
+# Queued logging: callers only enqueue; a background thread renders and writes
+LOG_ASYNC = os.getenv("LOG_ASYNC", "true").lower() in ("1", "true", "yes")
+LOG_BATCH_SIZE = int(os.getenv("LOG_BATCH_SIZE", "256"))
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "100000"))
+LOG_FLUSH_INTERVAL_SECONDS = float(os.getenv("LOG_FLUSH_INTERVAL_SECONDS", "0.05"))
+
+# Sampling of info/debug events; warnings and errors are never sampled.
+# LOG_SAMPLE_RATES keeps 1 in N per event name, e.g.
+# "Addition operation performed=10,*=2" ("*" applies to all other events)
+LOG_SAMPLE_RATES = os.getenv("LOG_SAMPLE_RATES", "")
+# Per-user token bucket (events per second, 0 disables) keyed by the "username" field
+LOG_USER_RATE_PER_SECOND = float(os.getenv("LOG_USER_RATE_PER_SECOND", "0"))
+LOG_USER_BURST = int(os.getenv("LOG_USER_BURST", "20"))
+LOG_SAMPLING_REPORT_INTERVAL_SECONDS = float(os.getenv("LOG_SAMPLING_REPORT_INTERVAL_SECONDS", "60"))
+
 # Configure log levels based on environment
 LOG_LEVELS: Dict[str, int] = {
     "development": logging.DEBUG,
@@ -19,6 +38,242 @@ LOG_LEVELS: Dict[str, int] = {
     "production": logging.WARNING
 }
 
+_STOP = object()
+
+class LogPipeline:
+    """Background writer for structlog events and stdlib log records.
+
+    Items are taken off the queue in batches at most every ``flush_interval``
+    seconds; structlog events are rendered and written to the stream with a
+    single write per batch, stdlib records are passed to the wrapped handlers.
+    When the queue is full new items are dropped (and counted) rather than
+    blocking the caller. The ``periodic`` callbacks run on the writer thread
+    after every batch and at least every ``tick_interval`` seconds while the
+    queue is idle.
+    """
+
+    def __init__(
+        self,
+        renderer=None,
+        handlers: Optional[List[logging.Handler]] = None,
+        stream: Optional[TextIO] = None,
+        batch_size: int = LOG_BATCH_SIZE,
+        queue_size: int = LOG_QUEUE_SIZE,
+        flush_interval: float = LOG_FLUSH_INTERVAL_SECONDS,
+        periodic: Optional[List[Callable[[], None]]] = None,
+        tick_interval: float = 1.0
+    ):
+        self.renderer = renderer
+        self.handlers = handlers or []
+        self.stream = stream
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.periodic = list(periodic or [])
+        self.tick_interval = tick_interval
+        self.queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self.dropped = 0
+        self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+        self._thread.start()
+
+    def put(self, item: Any) -> None:
+        try:
+            self.queue.put_nowait(item)
+        except queue.Full:
+            self.dropped += 1
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """Write everything still queued and stop the writer thread"""
+        if self._thread.is_alive():
+            self.queue.put(_STOP)
+            self._thread.join(timeout)
+
+    def _run(self) -> None:
+        while True:
+            try:
+                batch = [self.queue.get(timeout=self.tick_interval if self.periodic else None)]
+            except queue.Empty:
+                self._tick()
+                continue
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            if not self._write(batch):
+                return
+            self._tick()
+            if len(batch) < self.batch_size:
+                # Let a backlog build up instead of waking for every record
+                time.sleep(self.flush_interval)
+
+    def _tick(self) -> None:
+        for callback in self.periodic:
+            try:
+                callback()
+            except Exception:
+                pass
+
+    def _write(self, batch: list) -> bool:
+        lines = []
+        running = True
+        for item in batch:
+            try:
+                if item is _STOP:
+                    running = False
+                elif isinstance(item, logging.LogRecord):
+                    for handler in self.handlers:
+                        if item.levelno >= handler.level:
+                            handler.handle(item)
+                else:
+                    method_name, event_dict = item
+                    lines.append(self.renderer(None, method_name, event_dict))
+            except Exception:
+                # A broken record must never kill the writer thread
+                pass
+        if lines:
+            stream = self.stream or sys.stdout
+            try:
+                stream.write("\n".join(lines) + "\n")
+                stream.flush()
+            except Exception:
+                pass
+        return running
+
+class QueuedLogger:
+    """structlog logger that hands the unrendered event dict to a LogPipeline"""
+
+    def __init__(self, pipeline: LogPipeline):
+        self._pipeline = pipeline
+
+    def msg(self, **event_dict: Any) -> None:
+        self._pipeline.put((event_dict.get("level", "info"), event_dict))
+
+    log = debug = info = warn = warning = msg
+    fatal = failure = err = error = critical = exception = msg
+
+class QueuedLoggerFactory:
+    def __init__(self, pipeline: LogPipeline):
+        self._pipeline = pipeline
+
+    def __call__(self, *args: Any) -> QueuedLogger:
+        return QueuedLogger(self._pipeline)
+
+class PipelineHandler(logging.Handler):
+    """stdlib handler that defers formatting and I/O to a LogPipeline"""
+
+    def __init__(self, pipeline: LogPipeline):
+        super().__init__()
+        self.pipeline = pipeline
+
+    def emit(self, record: logging.LogRecord) -> None:
+        self.pipeline.put(record)
+
+def parse_sample_rates(spec: str) -> Dict[str, int]:
+    rates = {}
+    for part in spec.split(","):
+        name, _, rate = part.rpartition("=")
+        if name.strip() and rate.strip():
+            rates[name.strip()] = max(1, int(rate))
+    return rates
+
+class SamplingProcessor:
+    """structlog processor that samples and rate-limits low-severity events.
+
+    Dropped events are counted per event name; ``report`` logs the counts as
+    "Log events dropped by sampling" and resets them at most once per
+    ``report_interval``. It is called periodically from the log writer thread
+    (or a timer thread without LOG_ASYNC), so the summary also goes out when
+    logging falls quiet after a burst.
+    """
+
+    SAMPLED_METHODS = ("debug", "info")
+    MAX_TRACKED_USERS = 10000
+
+    def __init__(
+        self,
+        sample_rates: Optional[Dict[str, int]] = None,
+        user_rate: float = 0.0,
+        user_burst: int = 20,
+        report_interval: float = 60.0
+    ):
+        self.sample_rates = sample_rates or {}
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.report_interval = report_interval
+        self.seen: Dict[str, int] = {}
+        self.dropped: Dict[str, int] = {}
+        self.dropped_total = 0
+        self._buckets: Dict[str, list] = {}
+        self._last_report = time.monotonic()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.sample_rates) or self.user_rate > 0
+
+    def __call__(self, logger, method_name: str, event_dict: dict) -> dict:
+        if event_dict.pop("_sampling_report", False) or method_name not in self.SAMPLED_METHODS:
+            return event_dict
+
+        event = str(event_dict.get("event"))
+        if not self._keep(event, event_dict.get("username")):
+            with self._lock:
+                self.dropped[event] = self.dropped.get(event, 0) + 1
+                self.dropped_total += 1
+            raise structlog.DropEvent
+        return event_dict
+
+    def _keep(self, event: str, username: Optional[str]) -> bool:
+        rate = self.sample_rates.get(event, self.sample_rates.get("*", 1))
+        if rate > 1:
+            count = self.seen.get(event, 0)
+            self.seen[event] = count + 1
+            if count % rate:
+                return False
+
+        if self.user_rate > 0 and username is not None:
+            now = time.monotonic()
+            bucket = self._buckets.get(username)
+            if bucket is None:
+                if len(self._buckets) >= self.MAX_TRACKED_USERS:
+                    self._buckets.clear()
+                bucket = self._buckets[username] = [float(self.user_burst), now]
+            tokens = min(self.user_burst, bucket[0] + (now - bucket[1]) * self.user_rate)
+            bucket[1] = now
+            if tokens < 1:
+                bucket[0] = tokens
+                return False
+            bucket[0] = tokens - 1
+        return True
+
+    def report(self) -> None:
+        now = time.monotonic()
+        with self._lock:
+            if not self.dropped or now - self._last_report < self.report_interval:
+                return
+            dropped, self.dropped = self.dropped, {}
+            self._last_report = now
+        structlog.get_logger().info(
+            "Log events dropped by sampling",
+            dropped=dropped,
+            _sampling_report=True
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        return {"dropped_total": self.dropped_total, "dropped_pending": dict(self.dropped)}
+
+log_sampler = SamplingProcessor(
+    sample_rates=parse_sample_rates(LOG_SAMPLE_RATES),
+    user_rate=LOG_USER_RATE_PER_SECOND,
+    user_burst=LOG_USER_BURST,
+    report_interval=LOG_SAMPLING_REPORT_INTERVAL_SECONDS
+)
+
+def get_renderer():
+    if ENV == "development":
+        return structlog.dev.ConsoleRenderer()
+    return structlog.processors.JSONRenderer()
+
 # Configure structlog processors based on environment
 def get_processors() -> list:
     base_processors = [
@@ -29,23 +284,37 @@ def get_processors() -> list:
         structlog.processors.UnicodeDecoder(),
     ]
 
-    if ENV == "development":
-        base_processors.append(structlog.processors.ConsoleRenderer())
-    else:
-        base_processors.append(structlog.processors.JSONRenderer())
+    # Sample first so dropped events skip the rest of the chain
+    if log_sampler.enabled:
+        base_processors.insert(0, log_sampler)
+
+    # With the queued pipeline, rendering happens on the writer thread
+    if not LOG_ASYNC:
+        base_processors.append(get_renderer())
 
     return base_processors
 
-# Configure structlog
-structlog.configure(
-    processors=get_processors(),
-    wrapper_class=structlog.make_filtering_bound_logger(LOG_LEVELS.get(ENV, logging.INFO)),
-    context_class=dict,
-    logger_factory=structlog.PrintLoggerFactory(),
-)
+def _compress_rotated(source: str, dest: str) -> None:
+    """Rotator for RotatingFileHandler: rename now, gzip in a background thread"""
+    uncompressed = dest[:-len(".gz")] if dest.endswith(".gz") else dest
+    os.rename(source, uncompressed)
+    if uncompressed == dest:
+        return
+
+    def compress():
+        try:
+            with open(uncompressed, "rb") as f_in, gzip.open(dest, "wb") as f_out:
+                shutil.copyfileobj(f_in, f_out)
+            os.remove(uncompressed)
+        except OSError:
+            pass
+
+    threading.Thread(target=compress, name="log-compress", daemon=True).start()
 
 # Configure standard logging with rotation
 def setup_file_handler() -> RotatingFileHandler:
+    # Create logs directory if it doesn't exist
+    os.makedirs("logs", exist_ok=True)
     handler = RotatingFileHandler(
         "logs/app.log",
         maxBytes=10*1024*1024,  # 10MB
@@ -56,24 +325,88 @@ def setup_file_handler() -> RotatingFileHandler:
     handler.setFormatter(
         logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
     )
+    # Rotated files are stored as app.log.N.gz
+    handler.namer = lambda name: name + ".gz"
+    handler.rotator = _compress_rotated
     return handler
 
-# Configure standard logging
-logging.basicConfig(
-    level=LOG_LEVELS.get(ENV, logging.INFO),
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        setup_file_handler(),
-        logging.StreamHandler()
-    ]
-)
+def setup_stream_handler() -> logging.StreamHandler:
+    handler = logging.StreamHandler()
+    handler.setFormatter(
+        logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    )
+    return handler
 
-# Create logger
-logger = structlog.get_logger()
+log_pipeline: Optional[LogPipeline] = None
+_configured = False
 
-# Write initial log entry with environment info
-logger.info(
-    "Logging system initialized",
-    environment=ENV,
-    log_level=logging.getLevelName(LOG_LEVELS.get(ENV, logging.INFO))
-)
+def _report_sampling() -> None:
+    """Timer loop for the sampling summary when there is no log writer thread"""
+    while True:
+        time.sleep(min(1.0, log_sampler.report_interval))
+        try:
+            log_sampler.report()
+        except Exception:
+            pass
+
+def configure_logging() -> None:
+    """Set up handlers, the log pipeline and structlog (idempotent).
+
+    Importing this module has no side effects; this runs on the first log call
+    or explicitly at application startup.
+    """
+    global log_pipeline, _configured
+    if _configured:
+        return
+    _configured = True
+
+    if LOG_ASYNC:
+        log_pipeline = LogPipeline(
+            renderer=get_renderer(),
+            handlers=[setup_file_handler(), setup_stream_handler()],
+            periodic=[log_sampler.report] if log_sampler.enabled else None
+        )
+        atexit.register(log_pipeline.stop)
+    elif log_sampler.enabled:
+        threading.Thread(target=_report_sampling, name="log-sampling-report", daemon=True).start()
+
+    # Configure structlog
+    structlog.configure(
+        processors=get_processors(),
+        wrapper_class=structlog.make_filtering_bound_logger(LOG_LEVELS.get(ENV, logging.INFO)),
+        context_class=dict,
+        logger_factory=QueuedLoggerFactory(log_pipeline) if LOG_ASYNC else structlog.PrintLoggerFactory(),
+    )
+
+    # Configure standard logging
+    logging.basicConfig(
+        level=LOG_LEVELS.get(ENV, logging.INFO),
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        handlers=[PipelineHandler(log_pipeline)] if LOG_ASYNC else [
+            setup_file_handler(),
+            logging.StreamHandler()
+        ]
+    )
+
+    # Write initial log entry with environment info
+    structlog.get_logger().info(
+        "Logging system initialized",
+        environment=ENV,
+        log_level=logging.getLevelName(LOG_LEVELS.get(ENV, logging.INFO))
+    )
+
+def get_log_pipeline() -> Optional[LogPipeline]:
+    return log_pipeline
+
+class LazyLogger:
+    """structlog logger that configures logging the first time it is used"""
+
+    def __init__(self):
+        self._logger = structlog.get_logger()
+
+    def __getattr__(self, name: str) -> Any:
+        configure_logging()
+        return getattr(self._logger, name)
+
+# Create logger
+logger = LazyLogger()
@@ -0,0 +1,127 @@
+from typing import Awaitable, Callable, List, Optional
+from sqlalchemy import func, insert, inspect, select, text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+from models import RefreshToken, SchemaVersion
+from stats import rebuild_operation_stats
+from logger import logger
+
+HISTORY_INDEX = "ix_operation_history_user_ts_id"
+
+class Migration:
+    """A numbered schema change.
+
+    ``concurrent`` migrations run outside a transaction on PostgreSQL so they
+    can use CREATE INDEX CONCURRENTLY; everywhere else they run in one.
+    """
+
+    def __init__(
+        self,
+        version: int,
+        description: str,
+        upgrade: Callable[[AsyncConnection], Awaitable[None]],
+        concurrent: bool = False
+    ):
+        self.version = version
+        self.description = description
+        self.upgrade = upgrade
+        self.concurrent = concurrent
+
+async def _create_history_index(conn: AsyncConnection) -> None:
+    if conn.dialect.name == "postgresql":
+        # A failed concurrent build leaves an INVALID index behind; rebuild it
+        invalid = await conn.execute(
+            text(
+                "SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+                "WHERE c.relname = :name AND NOT i.indisvalid"
+            ),
+            {"name": HISTORY_INDEX}
+        )
+        if invalid.first():
+            await conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {HISTORY_INDEX}"))
+        await conn.execute(text(
+            f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {HISTORY_INDEX} "
+            "ON operation_history (user_id, timestamp, id)"
+        ))
+    else:
+        await conn.execute(text(
+            f"CREATE INDEX IF NOT EXISTS {HISTORY_INDEX} "
+            "ON operation_history (user_id, timestamp, id)"
+        ))
+
+async def _backfill_operation_stats(conn: AsyncConnection) -> None:
+    await rebuild_operation_stats(conn)
+
+async def _create_refresh_tokens(conn: AsyncConnection) -> None:
+    await conn.run_sync(RefreshToken.__table__.create, checkfirst=True)
+
+async def _create_refresh_token_expiry_index(conn: AsyncConnection) -> None:
+    await conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_refresh_tokens_expires_at ON refresh_tokens (expires_at)"
+    ))
+
+# Append new migrations here; versions must increase and never be reused
+MIGRATIONS: List[Migration] = [
+    Migration(1, "composite index on operation_history (user_id, timestamp, id)",
+              _create_history_index, concurrent=True),
+    Migration(2, "backfill operation_stats rollups from operation_history",
+              _backfill_operation_stats),
+    Migration(3, "refresh_tokens table for rotating refresh tokens",
+              _create_refresh_tokens),
+    Migration(4, "index on refresh_tokens (expires_at) for purging",
+              _create_refresh_token_expiry_index),
+]
+
+LATEST_VERSION = MIGRATIONS[-1].version
+
+async def stored_version(conn: AsyncConnection) -> Optional[int]:
+    """Schema version of an existing database, or None before the first migration"""
+    has_table = await conn.run_sync(lambda sync_conn: inspect(sync_conn).has_table(SchemaVersion.__tablename__))
+    if not has_table:
+        return None
+    return await current_version(conn)
+
+async def current_version(conn: AsyncConnection) -> int:
+    result = await conn.execute(select(func.max(SchemaVersion.version)))
+    return result.scalar() or 0
+
+async def _record(conn: AsyncConnection, migration: Migration) -> None:
+    await conn.execute(
+        insert(SchemaVersion).values(
+            version=migration.version,
+            description=migration.description
+        )
+    )
+
+async def run_migrations(engine: AsyncEngine) -> int:
+    """Apply pending migrations in order and return the resulting version"""
+    async with engine.begin() as conn:
+        await conn.run_sync(SchemaVersion.__table__.create, checkfirst=True)
+        version = await current_version(conn)
+
+    for migration in MIGRATIONS:
+        if migration.version <= version:
+            continue
+        logger.info(
+            "Applying schema migration",
+            version=migration.version,
+            description=migration.description
+        )
+        if migration.concurrent and engine.dialect.name == "postgresql":
+            async with engine.connect() as conn:
+                conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+                await migration.upgrade(conn)
+                await _record(conn, migration)
+        else:
+            async with engine.begin() as conn:
+                await migration.upgrade(conn)
+                await _record(conn, migration)
+        version = migration.version
+
+    return version
+
+if __name__ == "__main__":
+    import asyncio
+    from database import engine
+
+    version = asyncio.run(run_migrations(engine))
+    print(f"Database schema at version {version}")
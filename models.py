@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Boolean
+from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Boolean, Index
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from base import Base
@@ -29,3 +29,40 @@ class OperationHistory(Base):
 
     # Relationship with user
     user = relationship("User", back_populates="operations")
+
+    # Serves /history: filter on user_id, newest first, id as tiebreaker
+    __table_args__ = (
+        Index("ix_operation_history_user_ts_id", "user_id", "timestamp", "id"),
+    )
+
+class OperationStats(Base):
+    """Per-user, per-operation rollup maintained alongside OperationHistory inserts"""
+    __tablename__ = "operation_stats"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    operation = Column(String, primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+    total = Column(Float, nullable=False, default=0)
+    min_result = Column(Float)
+    max_result = Column(Float)
+    last_timestamp = Column(DateTime)
+
+class RefreshToken(Base):
+    """Issued refresh tokens; each rotation adds a token to the family of its login"""
+    __tablename__ = "refresh_tokens"
+
+    jti = Column(String, primary_key=True)
+    family_id = Column(String, nullable=False, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    # Serves the purge of expired tokens (auth.purge_refresh_tokens)
+    expires_at = Column(DateTime, nullable=False, index=True)
+    revoked_at = Column(DateTime)
+    replaced_by = Column(String)
+
+class SchemaVersion(Base):
+    __tablename__ = "schema_version"
+
+    version = Column(Integer, primary_key=True)
+    description = Column(String)
+    applied_at = Column(DateTime, default=datetime.utcnow)
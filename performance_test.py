@@ -1,201 +1,281 @@
-from locust import HttpUser, task, between
+from locust import HttpUser, between, events
+from locust.contrib.fasthttp import FastHttpUser
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+import argparse
+import json
+import os
 import time
 import uuid
-from typing import Optional
+from typing import Dict, List, Optional
 import logging
+import random
+import requests
 from config import Config
+import load_shapes
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-class ArithmeticAPIUser(HttpUser):
-    wait_time = between(1, 3)
+# Accounts created ahead of the run, so ramp-up does not wait on bcrypt
+USER_POOL_FILE = os.getenv("USER_POOL_FILE", "locust_users.json")
+USER_POOL_SIZE = int(os.getenv("USER_POOL_SIZE", str(Config.PERFORMANCE_TEST_USERS)))
+SEED_CONCURRENCY = int(os.getenv("SEED_CONCURRENCY", "8"))
+SEED_ATTEMPTS = 5
+PASSWORD = "testpassword123"
+WAIT_MIN_SECONDS, WAIT_MAX_SECONDS = (float(v) for v in Config.PERFORMANCE_TEST_WAIT_SECONDS.split(","))
+
+def register_account(base_url: str, timeout: float = 30) -> Dict[str, str]:
+    """Register a fresh account and return its credentials and access token"""
+    unique_id = uuid.uuid4().hex[:8]
+    account = {
+        "username": f"testuser_{unique_id}",
+        "email": f"test_{unique_id}@example.com",
+        "password": PASSWORD
+    }
+    for _ in range(SEED_ATTEMPTS):
+        response = requests.post(f"{base_url}/register", json=account, timeout=timeout)
+        if response.status_code not in (429, 503):
+            break
+        # Shed by the server's load limiter: back off as told
+        time.sleep(float(response.headers.get("Retry-After", "1")))
+    response.raise_for_status()
+    account["token"] = response.json()["access_token"]
+    return account
+
+def seed_user_pool(base_url: str, count: int, path: str = USER_POOL_FILE) -> List[Dict[str, str]]:
+    """Create ``count`` accounts concurrently and store them in ``path``"""
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=SEED_CONCURRENCY) as executor:
+        accounts = list(executor.map(lambda _: register_account(base_url), range(count)))
+    with open(path, "w") as f:
+        json.dump(accounts, f, indent=2)
+    logger.info(f"Seeded {count} users into {path} in {time.perf_counter() - started:.1f}s")
+    return accounts
+
+class UserPool:
+    """Pre-provisioned accounts shared by the simulated users of one Locust process.
+
+    Simulated users check an account out in on_start and return it in on_stop.
+    When the pool runs dry a new account is registered on the spot (and logged),
+    so an undersized pool slows the ramp-up instead of failing it. Locust
+    workers each load their own copy of the file and may share accounts, which
+    the API allows.
+    """
+
+    def __init__(self):
+        self.available: deque = deque()
+
+    def load(self, path: str) -> int:
+        with open(path) as f:
+            self.available.extend(json.load(f))
+        return len(self.available)
+
+    def checkout(self, base_url: str) -> Dict[str, str]:
+        if self.available:
+            return self.available.popleft()
+        logger.warning("User pool exhausted, registering an extra user")
+        return register_account(base_url)
+
+    def checkin(self, account: Dict[str, str]) -> None:
+        self.available.append(account)
+
+user_pool = UserPool()
+
+@events.test_start.add_listener
+def prepare_user_pool(environment, **kwargs):
+    if user_pool.available:
+        return
+    if os.path.exists(USER_POOL_FILE):
+        loaded = user_pool.load(USER_POOL_FILE)
+        logger.info(f"Loaded {loaded} users from {USER_POOL_FILE}")
+    elif environment.host:
+        user_pool.available.extend(seed_user_pool(environment.host, USER_POOL_SIZE))
+
+class ArithmeticTasks:
+    """Task set shared by the requests-based and the FastHttpUser-based users"""
+
+    wait_time = between(WAIT_MIN_SECONDS, WAIT_MAX_SECONDS)
     max_retries = 3
-    timeout = 10
-    _token: Optional[str] = None
+    # Extra keyword arguments for each client request (the fast client has no per-request timeout)
+    request_options: dict = {}
+    account: Optional[Dict[str, str]] = None
 
     def on_start(self):
-        """Initialize user session with registration and login."""
-        # Generate unique username and email
-        unique_id = str(uuid.uuid4())[:8]
-        self.username = f"testuser_{unique_id}"
-        self.email = f"test_{unique_id}@example.com"
-        self.password = "testpassword123"
-
-        # Try to register and login with retries
+        """Check out a pre-provisioned account for this simulated user."""
         for attempt in range(self.max_retries):
             try:
-                # Register new user
-                register_response = self.client.post(
-                    "/register",
-                    json={
-                        "username": self.username,
-                        "email": self.email,
-                        "password": self.password
-                    },
-                    timeout=self.timeout
-                )
-
-                if register_response.status_code == 200:
-                    logger.info(f"Successfully registered user {self.username}")
-                    break
-                elif register_response.status_code == 400 and "already registered" in register_response.text.lower():
-                    logger.info(f"User {self.username} already exists, proceeding to login")
-                    break
-                else:
-                    logger.error(f"Registration failed: {register_response.text}")
-                    if attempt == self.max_retries - 1:
-                        raise Exception("Failed to register user after maximum retries")
-
-                # Login
-                login_response = self.client.post(
-                    "/token",
-                    data={
-                        "username": self.username,
-                        "password": self.password
-                    },
-                    timeout=self.timeout
-                )
-
-                if login_response.status_code == 200:
-                    self._token = login_response.json()["access_token"]
-                    logger.info(f"Successfully logged in user {self.username}")
-                    break
-                else:
-                    logger.error(f"Login failed: {login_response.text}")
-                    if attempt == self.max_retries - 1:
-                        raise Exception("Failed to login after maximum retries")
-
+                self.account = user_pool.checkout(self.host)
+                break
             except Exception as e:
                 logger.error(f"Error during user initialization: {str(e)}")
                 if attempt == self.max_retries - 1:
                     raise
                 time.sleep(2)  # Wait before retry
 
-        if not self._token:
-            raise Exception("Failed to initialize user session")
+        if not self.account.get("token"):
+            self.login()
+
+    def on_stop(self):
+        if self.account is not None:
+            user_pool.checkin(self.account)
+            self.account = None
+
+    def login(self) -> None:
+        """Fetch a new token for the checked-out account, e.g. after it expired."""
+        with self.client.post(
+            "/token",
+            data={"username": self.account["username"], "password": self.account["password"]},
+            catch_response=True,
+            **self.request_options
+        ) as response:
+            if response.status_code == 200:
+                self.account["token"] = response.json()["access_token"]
+                self.account["refresh_token"] = response.json().get("refresh_token")
+                logger.info(f"Successfully logged in user {self.account['username']}")
+            else:
+                response.failure(f"Login failed: {response.text}")
+
+    def refresh(self) -> None:
+        """Renew the access token with the refresh token, falling back to a full login."""
+        if not self.account.get("refresh_token"):
+            self.login()
+            return
+        with self.client.post(
+            "/token/refresh",
+            json={"refresh_token": self.account["refresh_token"]},
+            catch_response=True,
+            **self.request_options
+        ) as response:
+            if response.status_code == 200:
+                self.account["token"] = response.json()["access_token"]
+                self.account["refresh_token"] = response.json()["refresh_token"]
+                return
+            if response.status_code == 401:
+                # Another simulated user sharing the account may have rotated it first
+                response.success()
+            else:
+                response.failure(f"Token refresh failed: {response.status_code} {response.text}")
+        self.login()
+
+    def post_operation(self, path: str, payload: dict) -> None:
+        with self.client.post(
+            path,
+            json=payload,
+            headers={"Authorization": f"Bearer {self.account['token']}"},
+            catch_response=True,
+            **self.request_options
+        ) as response:
+            if response.status_code == 401:
+                response.failure("Access token rejected")
+                self.refresh()
+            elif response.status_code != 200:
+                logger.error(f"{path} operation failed: {response.text}")
+                response.failure(f"{path} operation failed: {response.text}")
 
-    @task(1)
     def test_add(self):
         """Test addition operation."""
-        try:
-            response = self.client.post(
-                "/add",
-                json={"num1": 5, "num2": 3},
-                headers={"Authorization": f"Bearer {self._token}"},
-                timeout=self.timeout
-            )
+        self.post_operation("/add", {"num1": 5, "num2": 3})
 
-            if response.status_code != 200:
-                logger.error(f"Add operation failed: {response.text}")
-                self.environment.events.request_failure.fire(
-                    request_type="POST",
-                    name="/add",
-                    response_time=0,
-                    response_length=0,
-                    exception=Exception(f"Add operation failed: {response.text}")
-                )
-        except Exception as e:
-            logger.error(f"Error in add operation: {str(e)}")
-            self.environment.events.request_failure.fire(
-                request_type="POST",
-                name="/add",
-                response_time=0,
-                response_length=0,
-                exception=e
-            )
-
-    @task(1)
     def test_subtract(self):
         """Test subtraction operation."""
-        try:
-            response = self.client.post(
-                "/subtract",
-                json={"num1": 10, "num2": 4},
-                headers={"Authorization": f"Bearer {self._token}"},
-                timeout=self.timeout
-            )
+        self.post_operation("/subtract", {"num1": 10, "num2": 4})
 
-            if response.status_code != 200:
-                logger.error(f"Subtract operation failed: {response.text}")
-                self.environment.events.request_failure.fire(
-                    request_type="POST",
-                    name="/subtract",
-                    response_time=0,
-                    response_length=0,
-                    exception=Exception(f"Subtract operation failed: {response.text}")
-                )
-        except Exception as e:
-            logger.error(f"Error in subtract operation: {str(e)}")
-            self.environment.events.request_failure.fire(
-                request_type="POST",
-                name="/subtract",
-                response_time=0,
-                response_length=0,
-                exception=e
-            )
-
-    @task(1)
     def test_multiply(self):
         """Test multiplication operation."""
-        try:
-            response = self.client.post(
-                "/multiply",
-                json={"num1": 6, "num2": 7},
-                headers={"Authorization": f"Bearer {self._token}"},
-                timeout=self.timeout
-            )
+        self.post_operation("/multiply", {"num1": 6, "num2": 7})
 
-            if response.status_code != 200:
-                logger.error(f"Multiply operation failed: {response.text}")
-                self.environment.events.request_failure.fire(
-                    request_type="POST",
-                    name="/multiply",
-                    response_time=0,
-                    response_length=0,
-                    exception=Exception(f"Multiply operation failed: {response.text}")
-                )
-        except Exception as e:
-            logger.error(f"Error in multiply operation: {str(e)}")
-            self.environment.events.request_failure.fire(
-                request_type="POST",
-                name="/multiply",
-                response_time=0,
-                response_length=0,
-                exception=e
-            )
-
-    @task(1)
     def test_root(self):
         """Test square root operation."""
-        try:
-            response = self.client.post(
-                "/root",
-                json={"number": 16},
-                headers={"Authorization": f"Bearer {self._token}"},
-                timeout=self.timeout
-            )
+        self.post_operation("/root", {"number": 16})
 
+    def test_history(self):
+        """Read the latest history page, sometimes followed by the next one."""
+        headers = {"Authorization": f"Bearer {self.account['token']}"}
+        with self.client.get(
+            "/history?limit=50", headers=headers, name="/history", catch_response=True, **self.request_options
+        ) as response:
             if response.status_code != 200:
-                logger.error(f"Root operation failed: {response.text}")
-                self.environment.events.request_failure.fire(
-                    request_type="POST",
-                    name="/root",
-                    response_time=0,
-                    response_length=0,
-                    exception=Exception(f"Root operation failed: {response.text}")
-                )
-        except Exception as e:
-            logger.error(f"Error in root operation: {str(e)}")
-            self.environment.events.request_failure.fire(
-                request_type="POST",
-                name="/root",
-                response_time=0,
-                response_length=0,
-                exception=e
-            )
+                response.failure(f"/history failed: {response.text}")
+                return
+            cursor = response.headers.get("X-Next-Cursor")
+        if cursor and random.random() < 0.2:
+            with self.client.get(
+                f"/history?limit=50&cursor={cursor}", headers=headers, name="/history?cursor",
+                catch_response=True, **self.request_options
+            ) as response:
+                if response.status_code != 200:
+                    response.failure(f"/history page failed: {response.text}")
+
+    def test_history_stats(self):
+        """Read the per-operation rollup."""
+        with self.client.get(
+            "/history/stats",
+            headers={"Authorization": f"Bearer {self.account['token']}"},
+            catch_response=True,
+            **self.request_options
+        ) as response:
+            if response.status_code != 200:
+                response.failure(f"/history/stats failed: {response.text}")
+
+    def test_batch(self):
+        """Submit a small batch of mixed operations."""
+        self.post_operation("/batch", {"operations": [
+            {"operation": random.choice(["add", "subtract", "multiply"]), "num1": i, "num2": 2}
+            for i in range(random.randint(2, 20))
+        ]})
+
+    def test_login(self):
+        """Log in again, as returning users do (bcrypt-bound on the server)."""
+        self.login()
+
+    def test_refresh(self):
+        """Renew the access token as long-running clients do, without bcrypt."""
+        self.refresh()
+
+    # Task weights per Config.PERFORMANCE_TEST_MIX. Listed explicitly: Locust only
+    # collects @task methods from User/TaskSet classes, not from mixins.
+    task_mixes = {
+        "arithmetic": {test_add: 1, test_subtract: 1, test_multiply: 1, test_root: 1},
+        "realistic": {
+            test_add: 20, test_subtract: 10, test_multiply: 10, test_root: 5,
+            test_history: 30, test_history_stats: 10, test_batch: 10, test_login: 5,
+            test_refresh: 5,
+        },
+    }
+    tasks = task_mixes[Config.PERFORMANCE_TEST_MIX]
+
+# Only the user class selected by PERFORMANCE_TEST_CLIENT is picked up by Locust
+class ArithmeticAPIUser(ArithmeticTasks, HttpUser):
+    abstract = Config.PERFORMANCE_TEST_CLIENT != "http"
+    request_options = {"timeout": 10}
+
+class FastArithmeticAPIUser(ArithmeticTasks, FastHttpUser):
+    """geventhttpclient-based user: several times more requests per second per load generator core"""
+    abstract = Config.PERFORMANCE_TEST_CLIENT != "fast"
+    network_timeout = 10.0
+    connection_timeout = 10.0
+
+# The selected load shape, if any (Locust runs the first LoadTestShape found here)
+LoadShape = load_shapes.get_shape_class(Config.LOAD_SHAPE)
 
 if __name__ == "__main__":
-    import os
-    os.system(f"locust -f performance_test.py --host={Config.BASE_URL}")
+    import sys
+
+    command = sys.argv[1] if len(sys.argv) > 1 and not sys.argv[1].startswith("-") else "run"
+    if command == "run":
+        # Headless run with SLO gates; see load_runner.py for its options
+        import load_runner
+        sys.exit(load_runner.main(sys.argv[2:] if len(sys.argv) > 1 and sys.argv[1] == "run" else sys.argv[1:]))
+
+    parser = argparse.ArgumentParser(description="Arithmetic API load test")
+    parser.add_argument("command", choices=["seed", "ui"])
+    parser.add_argument("--users", type=int, default=USER_POOL_SIZE, help="accounts to create with 'seed'")
+    parser.add_argument("--host", default=Config.BASE_URL)
+    args = parser.parse_args()
+
+    if args.command == "seed":
+        seed_user_pool(args.host, args.users)
+    else:
+        os.system(f"locust -f performance_test.py --host={args.host}")
@@ -0,0 +1,78 @@
+import asyncio
+import cProfile
+import os
+import random
+import re
+import time
+from datetime import datetime
+from logger import logger
+
+# Request profiling is opt-in; when disabled the middleware is not installed at all
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "false").lower() in ("1", "true", "yes")
+# Fraction of requests profiled at random (0.0 - 1.0)
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+# Requests carrying this header (any value) are always profiled
+PROFILE_HEADER = os.getenv("PROFILE_HEADER", "X-Debug-Profile")
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+
+def profile_filename(method: str, route: str, latency_ms: float) -> str:
+    """<timestamp>_<method>_<route>_<latency>ms.prof, safe for any route template"""
+    timestamp = datetime.utcnow().strftime("%Y%m%dT%H%M%S%f")
+    route_part = re.sub(r"[^A-Za-z0-9]+", "-", route).strip("-") or "root"
+    return f"{timestamp}_{method}_{route_part}_{latency_ms:.1f}ms.prof"
+
+class ProfilingMiddleware:
+    """ASGI middleware that runs cProfile around sampled requests.
+
+    Profiles are written in pstats format to ``output_dir``; open them with
+    ``python -m pstats``, snakeviz, or convert to a flamegraph with flameprof.
+    cProfile hooks the whole event loop thread, so only one request is profiled
+    at a time and requests arriving meanwhile are passed through untouched.
+    """
+
+    def __init__(
+        self,
+        app,
+        sample_rate: float = PROFILE_SAMPLE_RATE,
+        header: str = PROFILE_HEADER,
+        output_dir: str = PROFILE_DIR
+    ):
+        self.app = app
+        self.sample_rate = sample_rate
+        self.header = header.lower().encode("latin-1")
+        self.output_dir = output_dir
+        self.active = False
+        self.written = 0
+
+    def _wanted(self, scope) -> bool:
+        if any(name == self.header for name, _ in scope.get("headers", ())):
+            return True
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or self.active or not self._wanted(scope):
+            await self.app(scope, receive, send)
+            return
+
+        self.active = True
+        profiler = cProfile.Profile()
+        started = time.perf_counter()
+        profiler.enable()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            profiler.disable()
+            self.active = False
+            latency_ms = (time.perf_counter() - started) * 1000
+            route = getattr(scope.get("route"), "path", scope["path"])
+            await self._write(profiler, scope["method"], route, latency_ms)
+
+    async def _write(self, profiler: cProfile.Profile, method: str, route: str, latency_ms: float) -> None:
+        path = os.path.join(self.output_dir, profile_filename(method, route, latency_ms))
+        try:
+            os.makedirs(self.output_dir, exist_ok=True)
+            await asyncio.get_running_loop().run_in_executor(None, profiler.dump_stats, path)
+            self.written += 1
+            logger.info("Request profile written", route=route, latency_ms=round(latency_ms, 1), path=path)
+        except OSError as e:
+            logger.error("Failed to write request profile", route=route, error=str(e))
@@ -0,0 +1,94 @@
+"""Production launcher: uvicorn with the fastest available event loop and parser.
+
+Metrics (/metrics) and the slow query log (/admin/slow-queries) are kept per
+process. With ``--workers N`` all workers share one port, so a scrape reaches
+an arbitrary worker; use ``--port-per-worker`` to run N single-worker servers
+on consecutive ports instead, put them behind a load balancer and scrape each
+port.
+
+Usage:
+    python serve.py                                   # one worker per CPU (WEB_CONCURRENCY)
+    python serve.py --workers 1                       # single process, like apiserver.py
+    python serve.py --workers 4 --port-per-worker     # ports 8000-8003, scrape each
+    python serve.py --workers 4 --port 8080           # shared port, per-worker metrics not addressable
+"""
+import argparse
+import importlib.util
+import os
+import signal
+import subprocess
+import sys
+import uvicorn
+
+SERVER_HOST = os.getenv("SERVER_HOST", "0.0.0.0")
+SERVER_PORT = int(os.getenv("SERVER_PORT", "8000"))
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", str(os.cpu_count() or 1)))
+SERVER_LOG_LEVEL = os.getenv("SERVER_LOG_LEVEL", "info")
+
+def _installed(module: str) -> bool:
+    return importlib.util.find_spec(module) is not None
+
+def server_options() -> dict:
+    """Event loop and HTTP parser choices: uvloop and httptools when installed"""
+    return {
+        "loop": "uvloop" if _installed("uvloop") else "asyncio",
+        "http": "httptools" if _installed("httptools") else "h11",
+    }
+
+def run_port_per_worker(args) -> int:
+    """Start one single-worker server per port and wait for all of them"""
+    servers = [
+        subprocess.Popen([
+            sys.executable, os.path.abspath(__file__),
+            "--host", args.host,
+            "--port", str(args.port + index),
+            "--workers", "1",
+            "--log-level", args.log_level,
+        ])
+        for index in range(args.workers)
+    ]
+
+    def stop(signum, frame):
+        for server in servers:
+            server.send_signal(signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    return max(server.wait() for server in servers)
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default=SERVER_HOST)
+    parser.add_argument("--port", type=int, default=SERVER_PORT)
+    parser.add_argument("--workers", type=int, default=WEB_CONCURRENCY)
+    parser.add_argument("--port-per-worker", action="store_true",
+                        help="run each worker as its own server on port, port+1, ...")
+    parser.add_argument("--log-level", default=SERVER_LOG_LEVEL)
+    args = parser.parse_args(argv)
+
+    options = server_options()
+    if args.workers > 1:
+        # Workers (and per-port servers) inherit this, so each one knows it is
+        # not alone, e.g. to warn about HISTORY_VERSION_SOURCE=process
+        os.environ["WEB_CONCURRENCY"] = str(args.workers)
+    if args.workers > 1 and args.port_per_worker:
+        print(f"Starting {args.workers} server(s) on {args.host}:{args.port}-{args.port + args.workers - 1} "
+              f"(loop={options['loop']}, http={options['http']})")
+        sys.exit(run_port_per_worker(args))
+
+    print(f"Starting {args.workers} worker(s) on {args.host}:{args.port} "
+          f"(loop={options['loop']}, http={options['http']})")
+    # Each worker imports apiserver and runs its startup; init_db serializes
+    # schema creation across them with an inter-process lock
+    uvicorn.run(
+        "apiserver:app",
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        reload=False,
+        log_level=args.log_level,
+        **options
+    )
+
+if __name__ == "__main__":
+    main()
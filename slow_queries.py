@@ -0,0 +1,180 @@
+import asyncio
+import os
+import re
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Set
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.pool import StaticPool
+from logger import logger
+
+# Statements slower than this are recorded (0 or less disables the recorder)
+SLOW_QUERY_THRESHOLD_MS = float(os.getenv("SLOW_QUERY_THRESHOLD_MS", "100"))
+# Distinct normalized statements kept; the cheapest entry is evicted beyond this
+SLOW_QUERY_MAX_ENTRIES = int(os.getenv("SLOW_QUERY_MAX_ENTRIES", "200"))
+SLOW_QUERY_EXPLAIN = os.getenv("SLOW_QUERY_EXPLAIN", "true").lower() in ("1", "true", "yes")
+# Bound parameters of the latest sample are only kept when this is on; even then
+# statements on tables holding credentials never expose theirs
+SLOW_QUERY_LOG_PARAMETERS = os.getenv("SLOW_QUERY_LOG_PARAMETERS", "false").lower() in ("1", "true", "yes")
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"\b\d+(?:\.\d+)?\b")
+_PLACEHOLDER = re.compile(r"\?|%\(\w+\)s|%s|\$\d+|:\w+")
+_PLACEHOLDER_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_VALUES_ROWS = re.compile(r"(VALUES\s*\(\?\))(?:\s*,\s*\(\?\))+", re.IGNORECASE)
+_WHITESPACE = re.compile(r"\s+")
+_SENSITIVE_TABLES = re.compile(r"\b(users|refresh_tokens)\b", re.IGNORECASE)
+
+def normalize_statement(statement: str) -> str:
+    """Reduce a statement to its shape: literals and bind markers become "?",
+    IN lists and multi-row VALUES collapse to a single element."""
+    normalized = _STRING_LITERAL.sub("?", statement)
+    normalized = _PLACEHOLDER.sub("?", normalized)
+    normalized = _NUMBER_LITERAL.sub("?", normalized)
+    normalized = _PLACEHOLDER_LIST.sub("(?)", normalized)
+    normalized = _VALUES_ROWS.sub(r"\1", normalized)
+    return _WHITESPACE.sub(" ", normalized).strip()
+
+class SlowQueryLog:
+    """Aggregates slow statements per engine and normalized statement.
+
+    Timing comes from SQLAlchemy cursor events on the engines passed to
+    ``attach``. The first time a SELECT shape is seen, its plan is fetched in a
+    background task on a separate connection so the slow request is not delayed
+    further.
+    """
+
+    def __init__(
+        self,
+        threshold_ms: float = SLOW_QUERY_THRESHOLD_MS,
+        max_entries: int = SLOW_QUERY_MAX_ENTRIES,
+        explain: bool = SLOW_QUERY_EXPLAIN,
+        log_parameters: bool = SLOW_QUERY_LOG_PARAMETERS
+    ):
+        self.threshold_ms = threshold_ms
+        self.max_entries = max_entries
+        self.explain = explain
+        self.log_parameters = log_parameters
+        self.entries: Dict[tuple, Dict[str, Any]] = {}
+        self._explain_tasks: Set[asyncio.Task] = set()
+
+    def attach(self, engine: AsyncEngine, name: str) -> None:
+        sync_engine = engine.sync_engine
+
+        @event.listens_for(sync_engine, "before_cursor_execute")
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            conn.info.setdefault("slow_query_start", []).append(time.perf_counter())
+
+        @event.listens_for(sync_engine, "after_cursor_execute")
+        def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            starts = conn.info.get("slow_query_start")
+            if not starts:
+                return
+            duration_ms = (time.perf_counter() - starts.pop()) * 1000
+            if 0 < self.threshold_ms <= duration_ms:
+                self.record(engine, name, statement, parameters, duration_ms, executemany)
+
+    def record(
+        self,
+        engine: AsyncEngine,
+        name: str,
+        statement: str,
+        parameters: Any,
+        duration_ms: float,
+        executemany: bool = False
+    ) -> None:
+        normalized = normalize_statement(statement)
+        if normalized.upper().startswith("EXPLAIN"):
+            return
+
+        key = (name, normalized)
+        entry = self.entries.get(key)
+        if entry is None:
+            if len(self.entries) >= self.max_entries:
+                cheapest = min(self.entries, key=lambda k: self.entries[k]["total_ms"])
+                del self.entries[cheapest]
+            entry = self.entries[key] = {
+                "engine": name,
+                "statement": normalized,
+                "count": 0,
+                "total_ms": 0.0,
+                "max_ms": 0.0,
+                "plan": None,
+            }
+        entry["count"] += 1
+        entry["total_ms"] += duration_ms
+        entry["max_ms"] = max(entry["max_ms"], duration_ms)
+        entry["last_ms"] = duration_ms
+        entry["last_seen"] = datetime.utcnow().isoformat()
+        entry["sample_sql"] = statement
+        entry["sample_parameters"] = self._sample_parameters(statement, parameters)
+
+        logger.warning(
+            "Slow query",
+            engine=name,
+            duration_ms=round(duration_ms, 2),
+            statement=normalized[:200]
+        )
+
+        if (
+            self.explain
+            and entry["plan"] is None
+            and not executemany
+            and normalized.upper().startswith("SELECT")
+        ):
+            entry["plan"] = []  # marks the plan as pending
+            self._schedule_explain(engine, entry, statement, parameters)
+
+    def _sample_parameters(self, statement: str, parameters: Any) -> Optional[str]:
+        if not self.log_parameters:
+            return None
+        if _SENSITIVE_TABLES.search(statement):
+            # Password hashes, emails and refresh token ids
+            return "<redacted>"
+        return repr(parameters)[:500]
+
+    def _schedule_explain(self, engine: AsyncEngine, entry: dict, statement: str, parameters: Any) -> None:
+        if isinstance(engine.sync_engine.pool, StaticPool):
+            # A second checkout would share (and on return roll back) the caller's connection
+            entry["plan"] = ["unavailable: engine uses a single shared connection"]
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            entry["plan"] = None
+            return
+        task = loop.create_task(self._explain(engine, entry, statement, parameters))
+        self._explain_tasks.add(task)
+        task.add_done_callback(self._explain_tasks.discard)
+
+    async def _explain(self, engine: AsyncEngine, entry: dict, statement: str, parameters: Any) -> None:
+        prefix = "EXPLAIN QUERY PLAN " if engine.dialect.name == "sqlite" else "EXPLAIN "
+        try:
+            async with engine.connect() as conn:
+                result = await conn.exec_driver_sql(prefix + statement, parameters)
+                rows = result.fetchall()
+            if engine.dialect.name == "sqlite":
+                # (id, parent, notused, detail)
+                entry["plan"] = [row[-1] for row in rows]
+            else:
+                entry["plan"] = [row[0] for row in rows]
+        except Exception as e:
+            entry["plan"] = [f"unavailable: {e}"]
+            logger.error("Failed to capture query plan", engine=entry["engine"], error=str(e))
+
+    async def wait_for_plans(self) -> None:
+        """Wait for pending EXPLAIN tasks (used by tests and benchmarks)"""
+        if self._explain_tasks:
+            await asyncio.gather(*list(self._explain_tasks), return_exceptions=True)
+
+    def top(self, limit: int = 20, order_by: str = "total_ms") -> List[Dict[str, Any]]:
+        return sorted(self.entries.values(), key=lambda entry: entry[order_by], reverse=True)[:limit]
+
+    def clear(self) -> None:
+        self.entries.clear()
+
+slow_query_log = SlowQueryLog()
+
+def attach_slow_query_log(engine: AsyncEngine, name: str, log: Optional[SlowQueryLog] = None) -> None:
+    (log or slow_query_log).attach(engine, name)
@@ -0,0 +1,138 @@
+import asyncio
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import delete, func, insert, select
+from models import OperationHistory, OperationStats
+
+def _aggregate(rows: List[dict]) -> List[dict]:
+    groups: Dict[Tuple[int, str], dict] = {}
+    for row in rows:
+        if row["user_id"] is None:
+            continue
+        key = (row["user_id"], row["operation"])
+        stats = groups.get(key)
+        if stats is None:
+            groups[key] = {
+                "user_id": row["user_id"],
+                "operation": row["operation"],
+                "count": 1,
+                "total": row["result"],
+                "min_result": row["result"],
+                "max_result": row["result"],
+                "last_timestamp": row["timestamp"],
+            }
+        else:
+            stats["count"] += 1
+            stats["total"] += row["result"]
+            stats["min_result"] = min(stats["min_result"], row["result"])
+            stats["max_result"] = max(stats["max_result"], row["result"])
+            stats["last_timestamp"] = max(stats["last_timestamp"], row["timestamp"])
+    return list(groups.values())
+
+async def update_operation_stats(db, rows: List[dict]) -> None:
+    """Fold new OperationHistory rows into the rollup table (caller commits).
+
+    ``db`` is an AsyncSession or AsyncConnection; run it in the same
+    transaction as the history insert so the two never drift apart.
+    """
+    values = _aggregate(rows)
+    if not values:
+        return
+
+    bind = db.get_bind() if hasattr(db, "get_bind") else db
+    dialect = bind.dialect.name
+    # Dialect modules are imported here: only the one in use needs loading
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        stmt = dialect_insert(OperationStats).values(values)
+        least, greatest = func.least, func.greatest
+    else:
+        # SQLite's multi-argument min()/max() are scalar functions
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        stmt = dialect_insert(OperationStats).values(values)
+        least, greatest = func.min, func.max
+
+    excluded = stmt.excluded
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[OperationStats.user_id, OperationStats.operation],
+        set_={
+            "count": OperationStats.count + excluded.count,
+            "total": OperationStats.total + excluded.total,
+            "min_result": least(OperationStats.min_result, excluded.min_result),
+            "max_result": greatest(OperationStats.max_result, excluded.max_result),
+            "last_timestamp": greatest(OperationStats.last_timestamp, excluded.last_timestamp),
+        }
+    )
+    await db.execute(stmt)
+
+async def rebuild_operation_stats(db, user_id: Optional[int] = None, archive=None) -> None:
+    """Recompute the rollups from operation_history and archived history (caller commits)
+
+    ``archive`` defaults to archive.history_archive; rows moved there by
+    archive.py are folded back in one partition file at a time.
+    """
+    clear = delete(OperationStats)
+    source = select(
+        OperationHistory.user_id,
+        OperationHistory.operation,
+        func.count(),
+        func.coalesce(func.sum(OperationHistory.result), 0),
+        func.min(OperationHistory.result),
+        func.max(OperationHistory.result),
+        func.max(OperationHistory.timestamp),
+    ).where(OperationHistory.user_id.is_not(None))
+    if user_id is not None:
+        clear = clear.where(OperationStats.user_id == user_id)
+        source = source.where(OperationHistory.user_id == user_id)
+    source = source.group_by(OperationHistory.user_id, OperationHistory.operation)
+
+    await db.execute(clear)
+    await db.execute(
+        insert(OperationStats).from_select(
+            ["user_id", "operation", "count", "total", "min_result", "max_result", "last_timestamp"],
+            source
+        )
+    )
+
+    if archive is None:
+        from archive import history_archive as archive
+    loop = asyncio.get_running_loop()
+    user_ids = [user_id] if user_id is not None else archive.user_ids()
+    for archived_user in user_ids:
+        for _, path in archive.partitions(archived_user):
+            rows = await loop.run_in_executor(None, archive.load_partition, path, archived_user)
+            await update_operation_stats(db, rows)
+
+async def get_operation_stats(db, user_id: int) -> List[dict]:
+    result = await db.execute(
+        select(OperationStats)
+        .where(OperationStats.user_id == user_id)
+        .order_by(OperationStats.operation)
+    )
+    return [
+        {
+            "operation": stats.operation,
+            "count": stats.count,
+            "sum": stats.total,
+            "min": stats.min_result,
+            "max": stats.max_result,
+            "avg": stats.total / stats.count if stats.count else None,
+            "last_timestamp": stats.last_timestamp,
+        }
+        for stats in result.scalars()
+    ]
+
+if __name__ == "__main__":
+    import argparse
+    from database import engine
+
+    parser = argparse.ArgumentParser(description="Operation statistics maintenance")
+    parser.add_argument("command", choices=["rebuild"])
+    parser.add_argument("--user-id", type=int, default=None)
+    args = parser.parse_args()
+
+    async def rebuild():
+        async with engine.begin() as conn:
+            await rebuild_operation_stats(conn, args.user_id)
+        print("Operation statistics rebuilt")
+
+    asyncio.run(rebuild())